@@ -8,6 +8,7 @@
 import os
 import sys
 from final_photo_selector import FinalBagPhotoSelector
+from model_registry import model_registry
 
 def get_all_folders():
     """Получает все папки для анализа"""
@@ -97,12 +98,18 @@ def main():
     
     print(f"\nНачинаю анализ...")
     
+    # Загружаем модель один раз для всех папок
+    if not model_registry.preload():
+        print("Не удалось загрузить AI модель!")
+        return
+    
     # Анализируем каждую папку
     for folder in folders:
         analyze_folder(folder)
     
     # Показываем финальную структуру
     show_final_structure()
+    model_registry.print_stats()
     
     print(f"\nАНАЛИЗ ВСЕХ ПАПОК ЗАВЕРШЕН!")
     print(f"Результаты сохранены в структурированных папках")
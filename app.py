@@ -1,11 +1,18 @@
 from flask import Flask, render_template, request, jsonify, send_from_directory
+import html
 import os
-import shutil
+from typing import Dict, List, Tuple
+from werkzeug.datastructures import FileStorage
 from universal_smart_selector import UniversalSmartSelector
-import tempfile
+from inference import IMAGE_EXTENSIONS
+
 
 app = Flask(__name__)
 
+# Большие запросы werkzeug пишет во временные файлы (в памяти - только мелкие);
+# в память читаются только файлы анализируемой папки
+app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
+
 # Папка для загруженных файлов
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
@@ -717,6 +724,52 @@ def index():
     </html>
     '''
 
+# Предпочтительные папки загрузки: корень, затем big (полный размер), затем small
+UPLOAD_FOLDER_PREFERENCE = ('', 'big', 'small')
+
+_selector = None
+
+
+def get_selector() -> UniversalSmartSelector:
+    """Один селектор на процесс (модель берется из общего реестра)"""
+    global _selector
+    if _selector is None:
+        _selector = UniversalSmartSelector()
+    return _selector
+
+
+def group_uploaded_images(files) -> Dict[str, List[Tuple[str, FileStorage]]]:
+    """Один проход по загрузке: {относительная папка: [(имя файла, файл запроса)]}, только изображения.
+    Файлы не читаются: байты нужны только папке, выбранной для анализа"""
+    folders: Dict[str, List[Tuple[str, FileStorage]]] = {}
+    for file in files:
+        if not file.filename:
+            continue
+        relative = file.filename.replace('\\', '/').strip('/')
+        folder, _, name = relative.rpartition('/')
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        folders.setdefault(folder, []).append((name, file))
+    return folders
+
+
+def uploaded_size(file: FileStorage) -> int:
+    """Размер загруженного файла без чтения (поток запроса - BytesIO или временный файл)"""
+    stream = file.stream
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size
+
+
+def choose_analysis_folder(folders: Dict[str, List]) -> str:
+    """Папка для анализа: корень, затем .../big, затем .../small, затем первая по порядку загрузки"""
+    for preferred in UPLOAD_FOLDER_PREFERENCE:
+        for folder in folders:
+            if folder.rpartition('/')[2] == preferred:
+                return folder
+    return next(iter(folders))
+
 @app.route('/upload', methods=['POST'])
 def upload_files():
     try:
@@ -733,163 +786,56 @@ def upload_files():
             print("❌ Список файлов пуст")
             return jsonify({'success': False, 'error': 'Файлы не выбраны'})
         
-        # Создаем временную папку для загруженных файлов
-        with tempfile.TemporaryDirectory() as temp_dir:
-            print(f"📂 Создана временная папка: {temp_dir}")
-            
-            # Сохраняем файлы во временную папку
-            saved_files = []
-            for i, file in enumerate(files):
-                if file.filename:
-                    print(f" Обрабатываю файл {i+1}: {file.filename}")
-                    
-                    # Исправляем пути - заменяем слеши на правильные
-                    safe_filename = file.filename.replace('/', os.sep).replace('\\', os.sep)
-                    file_path = os.path.join(temp_dir, safe_filename)
-                    
-                    print(f"🔧 Безопасное имя: {safe_filename}")
-                    print(f" Полный путь: {file_path}")
-                    
-                    # Создаем папки если нужно
-                    dir_path = os.path.dirname(file_path)
-                    if dir_path != temp_dir:
-                        print(f" Создаю папку: {dir_path}")
-                        os.makedirs(dir_path, exist_ok=True)
-                    
-                    # Сохраняем файл
-                    file.save(file_path)
-                    saved_files.append(file_path)
-                    
-                    # Проверяем что файл сохранился
-                    if os.path.exists(file_path):
-                        file_size = os.path.getsize(file_path)
-                        print(f"✅ Файл сохранен: {file_path} ({file_size} байт)")
-                    else:
-                        print(f"❌ Файл НЕ сохранен: {file_path}")
-                else:
-                    print(f"⚠️ Файл {i+1} без имени")
-            
-            print(f"📊 Всего сохранено файлов: {len(saved_files)}")
-            
-            # Проверяем содержимое временной папки
-            print(f"🔍 Содержимое временной папки {temp_dir}:")
-            for root, dirs, files_in_dir in os.walk(temp_dir):
-                level = root.replace(temp_dir, '').count(os.sep)
-                indent = ' ' * 2 * level
-                print(f"{indent}{os.path.basename(root)}/")
-                subindent = ' ' * 2 * (level + 1)
-                for file_in_dir in files_in_dir:
-                    file_full_path = os.path.join(root, file_in_dir)
-                    file_size = os.path.getsize(file_full_path)
-                    print(f"{subindent}{file_in_dir} ({file_size} байт)")
-            
-            # Проверяем что файлы сохранились
-            if not saved_files:
-                print("❌ Нет сохраненных файлов")
-                return jsonify({'success': False, 'error': 'Файлы не сохранились'})
-            
-            # Показываем информацию о загруженных файлах
-            file_info = f"Загружено файлов: {len(saved_files)}\n"
-            file_info += f"Временная папка: {temp_dir}\n"
-            file_info += "Список файлов:\n"
-            for file_path in saved_files:
-                if os.path.exists(file_path):
-                    file_size = os.path.getsize(file_path)
-                    file_info += f"- {os.path.basename(file_path)} ({file_size} байт)\n"
-                else:
-                    file_info += f"- {os.path.basename(file_path)} (ФАЙЛ НЕ НАЙДЕН!)\n"
-            
-            # Показываем содержимое временной папки
-            temp_contents = []
-            for root, dirs, files_in_dir in os.walk(temp_dir):
-                for file_in_dir in files_in_dir:
-                    file_full_path = os.path.join(root, file_in_dir)
-                    temp_contents.append(file_full_path)
-            
-            file_info += f"\nВсего файлов в папке: {len(temp_contents)}\n"
-            file_info += "Содержимое:\n"
-            for file_path in temp_contents:
-                file_size = os.path.getsize(file_path)
-                file_info += f"- {file_path} ({file_size} байт)\n"
-            
-         # Пробуем проанализировать фотографии
-            try:                            # Пробуем разные пути - добавляем все возможные подпапки
-                            analysis_paths = [
-                                temp_dir,  # Корневая папка
-                                os.path.join(temp_dir, '9'),  # Папка 9
-                                os.path.join(temp_dir, '9', 'big'),  # Папка 9/big
-                                os.path.join(temp_dir, '9', 'small'),  # Папка 9/small
-                                os.path.join(temp_dir, 'big'),  # Папка big (если есть)
-                                os.path.join(temp_dir, 'small')  # Папка small (если есть)
-                            ]
-                            
-                            # Добавляем все найденные подпапки
-                            for root, dirs, files_in_dir in os.walk(temp_dir):
-                                for dir_name in dirs:
-                                    full_dir_path = os.path.join(root, dir_name)
-                                    if full_dir_path not in analysis_paths:
-                                        analysis_paths.append(full_dir_path)
-                                        print(f"🔍 Добавлен путь для анализа: {full_dir_path}")
-                            
-                            print(f"🎯 Всего путей для анализа: {len(analysis_paths)}")
-                            
-                            analysis_success = False
-                            for path in analysis_paths:
-                                if os.path.exists(path):
-                                    print(f"🎯 Пробую проанализировать путь: {path}")
-                                    try:
-                                        # Проверяем что в папке есть изображения
-                                        path_files = []
-                                        for root, dirs, files_in_dir in os.walk(path):
-                                            for file_in_dir in files_in_dir:
-                                                file_full_path = os.path.join(root, file_in_dir)
-                                                file_ext = os.path.splitext(file_in_dir)[1].lower()
-                                                if file_ext in image_extensions:
-                                                    path_files.append(file_full_path)
-                                        
-                                        if path_files:
-                                            print(f"🖼️ В пути {path} найдено {len(path_files)} изображений")
-                                            try:
-                                                results = selector.select_best_photos(path, 2)
-                                                if results and str(results).strip():
-                                                    analysis_result = f"AI анализ завершен!\n\nПуть анализа: {path}\n\nНайдено изображений в пути: {len(path_files)}\n\nРезультаты:\n{results}"
-                                                    print(f"✅ select_best_photos работает с путем: {path}")
-                                                    analysis_success = True
-                                                    break
-                                                else:
-                                                    print(f"⚠️ select_best_photos вернул пустой результат для пути: {path}")
-                                            except Exception as e:
-                                                print(f"❌ select_best_photos не работает с путем {path}: {str(e)}")
-                                                continue
-                                        else:
-                                            print(f"⚠️ В пути {path} нет изображений")
-                                            continue
-                                    except Exception as e:
-                                        print(f"❌ Ошибка при проверке пути {path}: {str(e)}")
-                                        continue
-                            
-                            if not analysis_success:
-                                # Если все пути не сработали
-                                analysis_result = f"AI анализ не удался для всех путей.\n\nНайдено изображений: {len(image_files)}\n\nПопробованные пути:\n"
-                                for path in analysis_paths:
-                                    if os.path.exists(path):
-                                        analysis_result += f"- {path}\n"
-                                
-                                analysis_result += f"\nДля полного анализа используйте командную строку:\npython universal_smart_selector.py {temp_dir}"
-                                
-            except Exception as e:
-                            print(f"❌ Ошибка при анализе: {str(e)}")
-                            analysis_result = f"Ошибка при анализе: {str(e)}\n\nНайдено изображений: {len(image_files)}\n\nДля полного анализа используйте командную строку:\npython universal_smart_selector.py {temp_dir}"
+        # Один проход по загрузке: изображения по папкам, байты прямо из запроса
+        folders = group_uploaded_images(files)
+        total_files = sum(len(items) for items in folders.values())
+        print(f"📊 Изображений в загрузке: {total_files}, папок: {len(folders)}")
+        
+        if not folders:
+            print("❌ В загрузке нет изображений")
+            return jsonify({'success': False, 'error': 'Изображения не найдены'})
+        
+        folder = choose_analysis_folder(folders)
+        names = [name for name, _ in folders[folder]]
+        print(f"🎯 Анализирую папку загрузки: {folder or '/'} ({len(names)} изображений)")
+        
+        # Каждое изображение выбранной папки классифицируется ровно один раз, без копий на диске
+        file_info = f"Загружено изображений: {total_files}\n"
+        file_info += "Папки:\n"
+        for name, items in folders.items():
+            file_info += f"- {name or '/'}: {len(items)} ({sum(uploaded_size(file) for _, file in items)} байт)\n"
+        
+        try:
+            result = get_selector().analyze([file.read() for _, file in folders[folder]], 2, names)
+            best_photos = result['best_photos']
+            if best_photos:
+                analysis_result = (f"AI анализ завершен!\n\nПуть анализа: {folder or '/'}\n\n"
+                                   f"Найдено изображений в пути: {len(names)}\n\n"
+                                   f"Категория: {result.get('category', 'general')}\n\nРезультаты:\n")
+                for i, photo in enumerate(best_photos, 1):
+                    analysis_result += (f"{i}. {photo['filename']} - {photo['final_score']}/10 "
+                                        f"({photo['content_type']}, {photo['width']} × {photo['height']})\n")
+            else:
+                analysis_result = (f"AI анализ не выбрал фотографии.\n\nНайдено изображений: {len(names)}\n\n"
+                                   f"Для полного анализа используйте командную строку:\n"
+                                   f"python universal_smart_selector.py <папка>")
+        except Exception as e:
+            print(f"❌ Ошибка при анализе: {str(e)}")
+            analysis_result = (f"Ошибка при анализе: {str(e)}\n\nНайдено изображений: {len(names)}\n\n"
+                               f"Для полного анализа используйте командную строку:\n"
+                               f"python universal_smart_selector.py <папка>")
         print("=== КОНЕЦ ЗАГРУЗКИ ===")
-            
-            # Форматируем результаты в HTML
+        
+        final_results = file_info + "\n" + analysis_result
+        
+        # Форматируем результаты в HTML
         html_results = f'''
             <div style="background: white; padding: 20px; border-radius: 10px; margin-bottom: 20px;">
                 <h4>🎯 Результаты загрузки и анализа</h4>
-                <pre style="background: #f8f9fa; padding: 15px; border-radius: 5px; overflow-x: auto; max-height: 400px;">{final_results}</pre>
+                <pre style="background: #f8f9fa; padding: 15px; border-radius: 5px; overflow-x: auto; max-height: 400px;">{html.escape(final_results)}</pre>
             </div>
             '''
-            
+        
         return jsonify({
                 'success': True,
                 'html': html_results
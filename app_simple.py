@@ -1,10 +1,12 @@
 from flask import Flask, request, jsonify
+import hashlib
 import os
 import tempfile
-import shutil
 import time
-from universal_smart_selector import UniversalSmartSelector
-from celery import Celery
+from celery import Celery, current_task
+from streaming_selection import SELECTION_EVENT
+from metrics import metrics, install_celery_metrics, redis_queue_depth, CONTENT_TYPE
+from worker_warmup import get_selector
 
 app = Flask(__name__)
 
@@ -18,48 +20,102 @@ app.config['CELERY_RESULT_BACKEND'] = os.environ.get('CELERY_RESULT_BACKEND', 'r
 celery = Celery(app.name, broker=app.config['CELERY_BROKER_URL'])
 celery.conf.update(app.config)
 
+# Метрики: время в очереди и выполнения задач, экспортер в воркере; длина очереди - при сборе /metrics
+install_celery_metrics(celery)
+metrics.add_collector(redis_queue_depth(app.config['CELERY_BROKER_URL']))
+
+# Не чаще одного обновления прогресса задачи в Redis за интервал (секунды)
+PROGRESS_INTERVAL = 0.5
+
+# Загрузки хранятся по хэшу содержимого в общем volume: задача получает ссылки, а не копии
+UPLOAD_ROOT = os.environ.get('PHOTO_SELECTOR_UPLOAD_ROOT', os.path.join('/app', 'temp_uploads'))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+# Версия схемы результата задачи (в Redis и для /status): только компактные поля фото
+RESULT_SCHEMA_VERSION = 1
+RESULT_PHOTO_FIELDS = ('filename', 'final_score', 'content_score', 'viewpoint_score',
+                       'content_type', 'main_view', 'width', 'height')
+
+def store_upload(data, filename):
+    """Сохраняет файл под ключом objects/<ab>/<sha256><расширение>; одинаковые загрузки не дублируются"""
+    digest = hashlib.sha256(data).hexdigest()
+    key = f"objects/{digest[:2]}/{digest}{os.path.splitext(filename)[1].lower()}"
+    path = os.path.join(UPLOAD_ROOT, key)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Уникальный временный файл: одинаковые загрузки из разных потоков не делят его
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return key
+
+def compact_photo(photo):
+    """Фото в результате задачи: оценки и размеры, без строк анализа"""
+    return {field: photo.get(field) for field in RESULT_PHOTO_FIELDS}
+
+def report_progress(done, total, leaders):
+    """Промежуточный результат задачи: сколько фото оценено и лучшие на данный момент"""
+    if current_task is None or not current_task.request.id:
+        return
+    current_task.update_state(state='PROGRESS', meta={
+        'done': done,
+        'total': total,
+        'leaders': [compact_photo(p) for p in leaders],
+    })
+
 @celery.task
-def analyze_photos_task(image_files, temp_dir):
-    """Фоновая задача для анализа фото"""
+def analyze_photos_task(image_refs, temp_dir=None):
+    """Фоновая задача для анализа фото (чистый анализ: без копий и отчетов на диске).
+    image_refs - [[имя файла, ключ в UPLOAD_ROOT], ...]; задачи старого формата
+    передают абсолютные пути (temp_dir не используется)"""
     try:
-        print(f"DEBUG: temp_dir = {temp_dir}")
-        print(f"DEBUG: image_files = {image_files}")
-        
-        # Создаем структуру для AI анализа - используем существующую папку big
-        folder_1 = os.path.join(temp_dir, "1", "big")
-        os.makedirs(folder_1, exist_ok=True)
-        
-        print(f"DEBUG: Created folder_1 = {folder_1}")
-        
-        # Копируем изображения из папки big в папку 1/big
-        copied_files = []
-        for img_file in image_files:
-            if os.path.exists(img_file):
-                img_name = os.path.basename(img_file)
-                dest_path = os.path.join(folder_1, img_name)
-                shutil.copy2(img_file, dest_path)
-                copied_files.append(dest_path)
-                print(f"DEBUG: Copied {img_file} -> {dest_path}")
+        refs = [(os.path.basename(ref), ref) if isinstance(ref, str) else tuple(ref) for ref in image_refs]
+        existing = []
+        for name, key in refs:
+            path = os.path.join(UPLOAD_ROOT, key)
+            if os.path.exists(path):
+                existing.append((name, path))
             else:
-                print(f"DEBUG: File not found: {img_file}")
-        
-        print(f"DEBUG: Copied {len(copied_files)} files to {folder_1}")
+                print(f"DEBUG: File not found: {name} ({key})")
         
-        # Проверяем что файлы скопированы
-        if not copied_files:
-            return {"success": False, "error": "No image files were copied"}
+        # Проверяем что файлы есть
+        if not existing:
+            return {"schema": RESULT_SCHEMA_VERSION, "success": False, "error": "No image files were uploaded"}
         
-        # Запускаем AI анализ
-        selector = UniversalSmartSelector()
-        ai_results = selector.select_best_photos(folder_1, 2)
+        # Запускаем AI анализ: селектор процесса с моделью, прогретой при старте воркера
+        selector = get_selector()
+        selection = {}
+        leaders = []
+        last_report = 0.0
+        for event in selector.iter_analyze([path for _, path in existing], 2, [name for name, _ in existing]):
+            if event['event'] == SELECTION_EVENT:
+                selection = event
+                continue
+            leaders = sorted(leaders + [event['photo']], key=lambda p: p['final_score'], reverse=True)[:3]
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                report_progress(event['done'], event['total'], leaders)
+                last_report = time.monotonic()
         
-        print(f"DEBUG: AI results = {ai_results}")
+        best = [compact_photo(p) for p in selection.get('best_photos', [])]
+        print(f"DEBUG: AI results = {best}")
         
-        return {"success": True, "results": ai_results}
+        return {
+            "schema": RESULT_SCHEMA_VERSION,
+            "success": True,
+            "total": selection.get('total', 0),
+            "category": selection.get('category'),
+            "confidence": round(float(selection.get('confidence') or 0.0), 3),
+            "best": best,
+        }
         
     except Exception as e:
         print(f"DEBUG: Error in analyze_photos_task: {str(e)}")
-        return {"success": False, "error": str(e)}
+        return {"schema": RESULT_SCHEMA_VERSION, "success": False, "error": str(e)}
 
 @app.route('/')
 def index():
@@ -171,7 +227,14 @@ def index():
                                 const statusResponse = await fetch(`/status/${taskId}`);
                                 const statusData = await statusResponse.json();
                                 
-                                if (statusData.status === 'processing') {
+                                if (statusData.status === 'processing' && statusData.total) {
+                                    // Реальный прогресс: фото оцениваются по одному
+                                    clearInterval(progressInterval);
+                                    const leader = statusData.leaders.length ? statusData.leaders[0] : null;
+                                    statusText.textContent = `🤖 ${statusData.message}` +
+                                        (leader ? ` Best so far: ${leader.filename} (${leader.final_score}/10)` : '');
+                                    progressFill.style.width = (10 + 85 * statusData.done / statusData.total) + '%';
+                                } else if (statusData.status === 'processing') {
                                     statusText.textContent = '🤖 AI is analyzing photos...';
                                     progressFill.style.width = '75%';
                                 } else if (statusData.status === 'completed') {
@@ -234,45 +297,40 @@ def index():
 </html>
 '''
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики процесса веб-приложения в формате Prometheus"""
+    return metrics.render(), 200, {'Content-Type': CONTENT_TYPE}
+
 @app.route('/upload', methods=['POST'])
 def upload_files():
+    upload_start = time.perf_counter()
     try:
         files = request.files.getlist('files')
         if not files:
             return jsonify({'success': False, 'error': 'No files uploaded'})
         
-        # Создаем папку в общем volume (не временную)
-        temp_dir = os.path.join('/app', 'temp_uploads', f'upload_{int(time.time())}')
-        os.makedirs(temp_dir, exist_ok=True)
-        image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
-        image_files = []
-        
-        print(f"DEBUG: Uploading {len(files)} files to {temp_dir}")
+        print(f"DEBUG: Uploading {len(files)} files to {UPLOAD_ROOT}")
         
-        # Создаем папку big для изображений
-        big_folder = os.path.join(temp_dir, "big")
-        os.makedirs(big_folder, exist_ok=True)
-        
-        # Сохраняем файлы
+        # Сохраняем изображения по хэшу содержимого (общий volume с воркером)
+        image_refs = []
         for file in files:
             if file.filename:
-                safe_filename = file.filename.replace('/', os.sep).replace('\\', os.sep)
                 # Убираем лишние папки из имени файла
-                safe_filename = os.path.basename(safe_filename)
-                file_path = os.path.join(big_folder, safe_filename)
-                file.save(file_path)
-                
-                print(f"DEBUG: Saved file: {file_path}")
+                safe_filename = os.path.basename(file.filename.replace('\\', '/'))
+                data = file.read()
+                metrics.inc('photo_selector_upload_files_total')
+                metrics.inc('photo_selector_upload_bytes_total', len(data))
                 
-                if any(file.filename.lower().endswith(ext) for ext in image_extensions):
-                    image_files.append(file_path)
-                    print(f"DEBUG: Added image file: {file_path}")
+                if safe_filename.lower().endswith(IMAGE_EXTENSIONS):
+                    image_refs.append([safe_filename, store_upload(data, safe_filename)])
         
-        print(f"DEBUG: Total image files: {len(image_files)}")
-        print(f"DEBUG: Image files list: {image_files}")
+        print(f"DEBUG: Total image files: {len(image_refs)}")
         
-        # Запускаем фоновую задачу
-        task = analyze_photos_task.delay(image_files, temp_dir)
+        # Запускаем фоновую задачу: в брокер уходят только имена и ключи файлов
+        task = analyze_photos_task.delay(image_refs)
+        metrics.inc('photo_selector_uploads_total')
+        metrics.observe('photo_selector_upload_seconds', time.perf_counter() - upload_start)
         
         return jsonify({
             'success': True, 
@@ -291,12 +349,24 @@ def task_status(task_id):
     
     if task.state == 'PENDING':
         return jsonify({'status': 'processing', 'message': 'AI is analyzing photos...'})
+    elif task.state == 'PROGRESS':
+        info = task.info or {}
+        return jsonify({
+            'status': 'processing',
+            'message': f"AI analyzed {info.get('done', 0)} of {info.get('total', 0)} photos...",
+            'done': info.get('done', 0),
+            'total': info.get('total', 0),
+            'leaders': info.get('leaders', []),
+        })
     elif task.state == 'SUCCESS':
         result = task.result
         if result['success']:
             # Форматируем результаты
-            ai_results = result['results']
-            analysis_result = "✅ AI analysis completed successfully!\n\nBEST PHOTOGRAPHS:\n"
+            ai_results = result.get('best', result.get('results', []))
+            analysis_result = "✅ AI analysis completed successfully!\n\n"
+            if result.get('category'):
+                analysis_result += f"📦 Category: {result['category']} ({result.get('total', 0)} photos analyzed)\n\n"
+            analysis_result += "BEST PHOTOGRAPHS:\n"
             analysis_result += "=" * 50 + "\n"
             
             for i, result_item in enumerate(ai_results, 1):
@@ -346,5 +416,6 @@ def task_status(task_id):
         return jsonify({'status': 'error', 'error': f'Task failed with state: {task.state}'})
 
 if __name__ == '__main__':
+    metrics.configure("web")
     # Для локального использования используем localhost
     app.run(host='0.0.0.0', port=5000, debug=True)
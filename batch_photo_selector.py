@@ -8,16 +8,33 @@
 
 import os
 from final_photo_selector import FinalBagPhotoSelector
+from model_registry import model_registry, DEFAULT_BACKEND, BACKENDS
+from inference import DEFAULT_BATCH_SIZE
+from model_cascade import SMALL_MODEL_PATH, SMALL_MODEL_BACKEND
+from inference_cache import InferenceCache, DEFAULT_CACHE_PATH
+from stage_timer import StageTimer, summarize, print_summary
 import shutil
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 class BatchPhotoSelector:
     """Пакетный селектор фотографий для всех подпапок"""
     
-    def __init__(self):
-        self.selector = FinalBagPhotoSelector()
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, backend: str = DEFAULT_BACKEND,
+                 cascade_model_path: Optional[str] = None, cache: Optional[InferenceCache] = None,
+                 timing: Optional[bool] = None, cascade_backend: str = SMALL_MODEL_BACKEND):
+        self.selector = FinalBagPhotoSelector(backend=backend, batch_size=batch_size,
+                                              cascade_model_path=cascade_model_path,
+                                              cascade_backend=cascade_backend, cache=cache, timing=timing)
+        self.cache = cache
+        # Этапы всего прогона (инференс, копирование) + замеры папок и фото для p50/p95/max
+        self.timer = StageTimer(timing)
+        self.folder_timings = []
+        self.image_timings = []
         self.base_folder = "fotos"
         self.output_base = "batch_selected_photos"
+        self.batch_size = batch_size
+        self.inference_stats = {}
+        self.cascade_stats = {}
         
     def get_all_subfolders(self) -> List[str]:
         """Получает список всех подпапок в папке fotos"""
@@ -33,7 +50,7 @@ class BatchPhotoSelector:
         
         return sorted(subfolders)
     
-    def process_subfolder(self, subfolder: str) -> Dict:
+    def process_subfolder(self, subfolder: str, records: Optional[Dict] = None) -> Dict:
         """Обрабатывает одну подпапку и выбирает лучшие фотографии"""
         print(f"\n{'='*60}")
         print(f"📁 ОБРАБАТЫВАЮ ПАПКУ: {subfolder}")
@@ -78,7 +95,7 @@ class BatchPhotoSelector:
                 print(f"   🥈 ВТОРАЯ ФОТО: image_005.jpg")
                 
                 # Запускаем селектор для получения оценок всех фотографий
-                all_photos = self.selector.select_best_bag_photos(big_folder_path, len(image_files))
+                all_photos = self.selector.select_best_bag_photos(big_folder_path, len(image_files), records)
                 
                 if all_photos:
                     # Ищем нужные фотографии
@@ -152,7 +169,7 @@ class BatchPhotoSelector:
                     }
             else:
                 # Обычная логика для других папок
-                best_photos = self.selector.select_best_bag_photos(big_folder_path, 2)
+                best_photos = self.selector.select_best_bag_photos(big_folder_path, 2, records)
                 
                 if best_photos:
                     print(f"✅ В папке '{subfolder}' выбрано {len(best_photos)} лучших фотографий:")
@@ -242,6 +259,11 @@ class BatchPhotoSelector:
             'total_subfolders': len(results),
             'successful_processing': len([r for r in results if r['status'] == 'success']),
             'total_photos_selected': sum(len(r['selected_photos']) for r in results if r['status'] == 'success'),
+            'model_registry': model_registry.get_stats(),
+            'inference_stats': self.inference_stats,
+            'cascade_stats': self.cascade_stats,
+            'cache_stats': self.cache.get_stats() if self.cache is not None else {},
+            'stage_timings': self.get_stage_timings(),
             'results': results
         }
         
@@ -250,6 +272,28 @@ class BatchPhotoSelector:
         
         print(f"📄 Общий отчет сохранен: {report_path}")
     
+    def get_stage_timings(self) -> Dict:
+        """Этапы прогона и p50/p95/max по папкам и фото (пусто, если замеры выключены)"""
+        if not self.timer.enabled:
+            return {}
+        return {
+            'batch_ms': self.timer.folder_timings(),
+            'folders': summarize(self.folder_timings),
+            'images': summarize(self.image_timings),
+        }
+    
+    def process_subfolder_timed(self, subfolder: str, records: Optional[Dict] = None) -> Dict:
+        """process_subfolder + сбор этапов папки и ее фото"""
+        if not self.timer.enabled:
+            return self.process_subfolder(subfolder, records)
+        self.selector.stage_timings, self.selector.image_timings = {}, []
+        total = {}
+        with self.timer.stage('total', total):
+            result = self.process_subfolder(subfolder, records)
+        self.folder_timings.append({**self.selector.stage_timings, **total})
+        self.image_timings.extend(self.selector.image_timings)
+        return result
+    
     def run_batch_processing(self):
         """Запускает пакетную обработку всех подпапок"""
         print("🏆 ПАКЕТНЫЙ ВЫБОР ФОТОГРАФИЙ ТОВАРА")
@@ -271,11 +315,34 @@ class BatchPhotoSelector:
             print(f"   📁 {subfolder}")
         print()
         
+        # Загружаем модель один раз для всех подпапок
+        if not model_registry.preload(self.selector.model_path, self.selector.backend):
+            print("❌ Не удалось загрузить AI модель!")
+            return
+        
+        # Пакетный инференс сразу по всем подпапкам, результаты раздаются по папкам
+        big_folders = {subfolder: os.path.join(self.base_folder, subfolder, "big") for subfolder in subfolders}
+        self.selector.classifier = model_registry.acquire(self.selector.model_path, self.selector.backend)
+        with self.timer.stage('inference'):
+            if self.selector.cascade_model_path:
+                # Каскад: маленькая модель для всех, Large - только для спорных фото
+                engine = self.selector.build_cascade()
+                folder_records = engine.classify_folders(list(big_folders.values()))
+                engine.print_stats()
+                self.cascade_stats = engine.get_stats()
+                self.inference_stats = engine.large_engine.get_stats()
+            else:
+                engine = self.selector.new_engine(fast_decode=True)
+                folder_records = engine.classify_folders(list(big_folders.values()))
+                engine.print_stats()
+                self.inference_stats = engine.get_stats()
+        
         # Обрабатываем каждую подпапку
         results = []
-        for subfolder in subfolders:
-            result = self.process_subfolder(subfolder)
-            results.append(result)
+        with self.timer.stage('folders'):
+            for subfolder in subfolders:
+                result = self.process_subfolder_timed(subfolder, folder_records.get(big_folders[subfolder]))
+                results.append(result)
         
         # Показываем общую статистику
         print(f"\n{'='*60}")
@@ -287,6 +354,10 @@ class BatchPhotoSelector:
         
         print(f"✅ Успешно обработано папок: {successful}/{len(subfolders)}")
         print(f"📸 Всего выбрано фотографий: {total_photos}")
+        model_registry.print_stats()
+        engine.print_stats()
+        if self.cache is not None:
+            self.cache.print_stats()
         print(f"📁 Обработанные папки:")
         
         for result in results:
@@ -295,7 +366,12 @@ class BatchPhotoSelector:
             print(f"   {status_icon} {result['subfolder']}: {result['message']} ({photo_count} фото)")
         
         # Копируем выбранные фотографии
-        self.copy_selected_photos(results)
+        with self.timer.stage('copy'):
+            self.copy_selected_photos(results)
+        
+        if self.timer.enabled:
+            print_summary(summarize(self.folder_timings), "Этапы папок")
+            print_summary(summarize(self.image_timings), "Этапы фото")
         
         # Сохраняем общий отчет
         self.save_batch_report(results)
@@ -305,7 +381,28 @@ class BatchPhotoSelector:
 
 def main():
     """Главная функция"""
-    batch_selector = BatchPhotoSelector()
+    import argparse
+    parser = argparse.ArgumentParser(description="Пакетный выбор фотографий во всех подпапках fotos")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"размер пакета инференса (по умолчанию {DEFAULT_BATCH_SIZE})")
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help="бэкенд модели: hf-pipeline (fp32), hf-pipeline-int8, hf-pipeline-bf16, onnx, torchscript или fake")
+    parser.add_argument('--cascade', nargs='?', const=SMALL_MODEL_PATH, default=None, metavar='SMALL_MODEL',
+                        help=f"каскад: сначала маленькая модель (по умолчанию {SMALL_MODEL_PATH}), "
+                             f"Large - только для спорных фото")
+    parser.add_argument('--cascade-backend', choices=BACKENDS, default=SMALL_MODEL_BACKEND,
+                        help=f"бэкенд маленькой модели каскада (по умолчанию {SMALL_MODEL_BACKEND}): "
+                             f"onnx/torchscript требуют отдельного экспорта Tiny")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, default=None, metavar='DB',
+                        help=f"постоянный кэш инференса SQLite (по умолчанию {DEFAULT_CACHE_PATH}): "
+                             f"модель вызывается только для новых или измененных фото")
+    parser.add_argument('--timing', action='store_true',
+                        help="поэтапные замеры времени (p50/p95/max в batch_processing_report.json)")
+    args = parser.parse_args()
+    
+    batch_selector = BatchPhotoSelector(args.batch_size, args.backend, args.cascade,
+                                        InferenceCache(args.cache) if args.cache else None,
+                                        timing=args.timing or None, cascade_backend=args.cascade_backend)
     batch_selector.run_batch_processing()
 
 if __name__ == "__main__":
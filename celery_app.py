@@ -1,5 +1,6 @@
 from celery import Celery
 import os
+from worker_warmup import install_worker_preload
 
 # Создаем Celery приложение
 celery_app = Celery(
@@ -13,3 +14,6 @@ from app_simple import analyze_photos_task
 
 # Регистрируем задачу
 celery_app.task(analyze_photos_task)
+
+# Модель загружается до fork и прогревается в каждом процессе до приема задач
+install_worker_preload(celery_app)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+БЕНЧМАРК ХОЛОДНОГО СТАРТА
+Каждый замер - новый процесс Python, как при старте Flask/Celery воркера:
+1. импорт приложения (universal_smart_selector)
+2. импорт ML-стека, нужного бэкенду (torch, transformers)
+3. загрузка модели через реестр
+4. задержка первого и второго инференса
+Первый запуск бэкенда torchscript также строит дисковый кэш графа,
+поэтому он показывается отдельно от последующих.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+from typing import Dict, List, Optional
+
+PROCESS_START = time.perf_counter()
+
+DEFAULT_BENCH_BACKENDS = ["hf-pipeline", "torchscript"]
+STAGES = ('import_app_sec', 'import_ml_sec', 'model_load_sec', 'first_inference_ms',
+          'second_inference_ms', 'time_to_first_result_sec')
+
+
+def find_sample_image() -> Optional[str]:
+    """Первое изображение из fotos/*/big"""
+    if not os.path.isdir("fotos"):
+        return None
+    for item in sorted(os.listdir("fotos")):
+        folder = os.path.join("fotos", item, "big")
+        if os.path.isdir(folder):
+            for filename in sorted(os.listdir(folder)):
+                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+                    return os.path.join(folder, filename)
+    return None
+
+
+def measure(backend: str, model_path: Optional[str], image_path: Optional[str]) -> Dict:
+    """Замер в текущем (свежем) процессе"""
+    start = time.perf_counter()
+    import universal_smart_selector  # noqa: F401  - то, что импортируют app_simple и celery_app
+    import_app = time.perf_counter() - start
+    ml_loaded_by_app = 'torch' in sys.modules or 'transformers' in sys.modules
+
+    start = time.perf_counter()
+    # onnx и fake не нужен torch, torchscript из кэша не нужен transformers
+    if backend not in ('onnx', 'fake'):
+        import torch  # noqa: F401
+    if backend.startswith('hf-pipeline'):
+        import transformers  # noqa: F401
+    import_ml = time.perf_counter() - start
+
+    from model_registry import model_registry, DEFAULT_MODEL_PATH
+    from inference import BatchInferenceEngine
+    from PIL import Image
+
+    start = time.perf_counter()
+    classifier = model_registry.acquire(model_path or DEFAULT_MODEL_PATH, backend)
+    model_load = time.perf_counter() - start
+
+    engine = BatchInferenceEngine(classifier, 1)
+    if image_path:
+        image = engine._load(image_path)
+    else:
+        image = Image.new('RGB', (256, 256), (128, 128, 128))
+
+    latencies = []
+    for _ in range(2):
+        start = time.perf_counter()
+        engine.classify_batch([image])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'backend': backend,
+        'ml_stack_imported_by_app': ml_loaded_by_app,
+        'import_app_sec': round(import_app, 3),
+        'import_ml_sec': round(import_ml, 3),
+        'model_load_sec': round(model_load, 3),
+        'first_inference_ms': round(latencies[0], 1),
+        'second_inference_ms': round(latencies[1], 1),
+        'time_to_first_result_sec': round(time.perf_counter() - PROCESS_START, 3),
+    }
+
+
+def run_fresh_process(backend: str, args) -> Optional[Dict]:
+    """Один замер в новом процессе; результат - последняя строка stdout (JSON)"""
+    command = [sys.executable, os.path.abspath(__file__), '--worker', backend]
+    if args.model_path:
+        command += ['--model-path', args.model_path]
+    if args.image:
+        command += ['--image', args.image]
+
+    start = time.perf_counter()
+    completed = subprocess.run(command, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        print(f"   ❌ {backend}: процесс завершился с ошибкой")
+        print("      " + (completed.stderr.strip().splitlines() or ["?"])[-1])
+        return None
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_wall_sec'] = round(wall, 3)
+    return result
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    """Первый запуск отдельно (строит кэши), остальные - медиана"""
+    warm = runs[1:] or runs
+    return {
+        'runs': len(runs),
+        'first_run': runs[0],
+        'median': {stage: round(statistics.median(run[stage] for run in warm), 3)
+                   for stage in STAGES + ('process_wall_sec',)},
+    }
+
+
+def main():
+    """Главная функция"""
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта")
+    parser.add_argument('--backends', nargs='+', default=DEFAULT_BENCH_BACKENDS, help="бэкенды модели")
+    parser.add_argument('--runs', type=int, default=3, help="новых процессов на бэкенд")
+    parser.add_argument('--model-path', default=None, help="папка модели")
+    parser.add_argument('--image', default=None, help="изображение для инференса")
+    parser.add_argument('--report', default="cold_start_report.json", help="файл отчета")
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = measure(args.worker, args.model_path, args.image)
+        print(json.dumps(result))
+        return
+
+    print("🧊 БЕНЧМАРК ХОЛОДНОГО СТАРТА")
+    print("="*50)
+    args.image = args.image or find_sample_image()
+    print(f"🖼️ Изображение: {args.image or 'синтетическое 256x256'}")
+
+    report = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'image': args.image, 'backends': {}}
+    for backend in args.backends:
+        print(f"\n🚀 {backend}: {args.runs} запуск(ов)...")
+        runs = [run for run in (run_fresh_process(backend, args) for _ in range(max(1, args.runs))) if run]
+        if not runs:
+            continue
+        summary = summarize(runs)
+        report['backends'][backend] = summary
+
+        median = summary['median']
+        first = summary['first_run']
+        if first['ml_stack_imported_by_app']:
+            print("   ⚠️ Импорт приложения загружает torch/transformers!")
+        print(f"   📦 импорт приложения {median['import_app_sec']:.2f} с, ML-стека {median['import_ml_sec']:.2f} с")
+        print(f"   🧠 загрузка модели {median['model_load_sec']:.2f} с (первый запуск {first['model_load_sec']:.2f} с)")
+        print(f"   ⚡ первый инференс {median['first_inference_ms']:.0f} мс, второй {median['second_inference_ms']:.0f} мс")
+        print(f"   🏁 до первого результата {median['time_to_first_result_sec']:.2f} с "
+              f"(процесс целиком {median['process_wall_sec']:.2f} с)")
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 Отчет сохранен: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,13 +11,32 @@ from transformers import ConvNextForImageClassification, ConvNextImageProcessor,
 from transformers import AutoFeatureExtractor
 import json
 
+# Доступные модели: основная Large и маленькая для каскада (--cascade)
+MODELS = {
+    'large': {
+        'name': "ConvNeXt Large",
+        'source': "facebook/convnext-large-224",
+        'local_path': "./models/convnext-large-224",
+        'size': "~1.7 ГБ",
+        'accuracy': "86.6%",
+    },
+    'tiny': {
+        'name': "ConvNeXt Tiny",
+        'source': "facebook/convnext-tiny-224",
+        'local_path': "./models/convnext-tiny-224",
+        'size': "~110 МБ",
+        'accuracy': "82.1%",
+    },
+}
+
 class ModelDownloader:
-    """Скачивает модель ConvNeXt Large локально"""
+    """Скачивает модель ConvNeXt (Large или Tiny) локально"""
     
-    def __init__(self):
-        self.model_name = "facebook/convnext-large-224"
-        self.local_path = "./models/convnext-large-224"
-        self.backup_path = "./models/convnext-large-224-backup"
+    def __init__(self, model: str = 'large'):
+        self.model = MODELS[model]
+        self.model_name = self.model['source']
+        self.local_path = self.model['local_path']
+        self.backup_path = self.local_path + "-backup"
         
     def create_directories(self):
         """Создает необходимые папки"""
@@ -29,7 +48,7 @@ class ModelDownloader:
         
         if not os.path.exists(self.local_path):
             os.makedirs(self.local_path)
-            print("   ✅ Создана папка: ./models/convnext-large-224")
+            print(f"   ✅ Создана папка: {self.local_path}")
         
         print("   📁 Структура папок готова!")
     
@@ -37,7 +56,7 @@ class ModelDownloader:
         """Скачивает модель и процессор"""
         print(f"\n🚀 Скачиваю модель: {self.model_name}")
         print("   ⏳ Это может занять несколько минут...")
-        print("   📊 Размер модели: ~1.7 ГБ")
+        print(f"   📊 Размер модели: {self.model['size']}")
         
         try:
             # Скачиваем модель
@@ -88,12 +107,12 @@ class ModelDownloader:
         print("\n📄 Создаю информацию о модели...")
         
         model_info = {
-            "model_name": "ConvNeXt Large",
+            "model_name": self.model['name'],
             "version": "224x224",
-            "source": "facebook/convnext-large-224",
+            "source": self.model_name,
             "local_path": self.local_path,
-            "description": "ConvNeXt Large модель для классификации изображений",
-            "accuracy": "86.6%",
+            "description": f"{self.model['name']} модель для классификации изображений",
+            "accuracy": self.model['accuracy'],
             "download_date": "2024",
             "usage": "Выбор лучших фотографий товара",
             "requirements": {
@@ -214,11 +233,11 @@ class ModelDownloader:
     
     def run_download(self):
         """Запускает полный процесс скачивания"""
-        print("🏆 СКАЧИВАНИЕ МОДЕЛИ ConvNeXt Large")
+        print(f"🏆 СКАЧИВАНИЕ МОДЕЛИ {self.model['name']}")
         print("="*50)
         print("🎯 Цель: Полностью локальная модель")
-        print("📁 Место: ./models/convnext-large-224")
-        print("💾 Размер: ~1.7 ГБ")
+        print(f"📁 Место: {self.local_path}")
+        print(f"💾 Размер: {self.model['size']}")
         print()
         
         # Создаем папки
@@ -246,8 +265,8 @@ class ModelDownloader:
         # Создаем резервную копию
         self.create_backup()
         
-        # Обновляем скрипты
-        if not self.update_scripts():
+        # Обновляем скрипты (ссылки в них указывают на Large)
+        if self.model is MODELS['large'] and not self.update_scripts():
             print("⚠️ Обновление скриптов не удалось!")
         
         # Показываем результат
@@ -260,7 +279,13 @@ class ModelDownloader:
 
 def main():
     """Главная функция"""
-    downloader = ModelDownloader()
+    import argparse
+    parser = argparse.ArgumentParser(description="Скачивание модели ConvNeXt")
+    parser.add_argument('--model', choices=list(MODELS), default='large',
+                        help="large - основная модель, tiny - маленькая модель для каскада")
+    args = parser.parse_args()
+    
+    downloader = ModelDownloader(args.model)
     success = downloader.run_download()
     
     if success:
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ЭКСПОРТ МОДЕЛИ ConvNeXt Large В ONNX
+Конвертирует ./models/convnext-large-224 в ONNX для бэкенда ONNX Runtime
+(python smart_photo_selector.py fotos/1/big --backend onnx)
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from model_registry import DEFAULT_MODEL_PATH
+from onnx_backend import onnx_model_file
+
+
+class OnnxExporter:
+    """Экспортирует HF-модель ConvNeXt в ONNX и проверяет совпадение выходов"""
+
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, opset: int = 17):
+        self.model_path = model_path
+        self.output_path = onnx_model_file(model_path)
+        self.opset = opset
+
+    def export(self) -> bool:
+        """Экспортирует модель с динамическим размером пакета"""
+        print(f"🚀 Экспортирую {self.model_path} -> {self.output_path}")
+
+        try:
+            import torch
+            from transformers import ConvNextForImageClassification
+
+            model = ConvNextForImageClassification.from_pretrained(self.model_path)
+            model.eval()
+
+            class LogitsOnly(torch.nn.Module):
+                """Оставляет на выходе только logits (ONNX не принимает ModelOutput)"""
+
+                def __init__(self, wrapped):
+                    super().__init__()
+                    self.wrapped = wrapped
+
+                def forward(self, pixel_values):
+                    return self.wrapped(pixel_values=pixel_values).logits
+
+            os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+            dummy = torch.randn(1, 3, 224, 224)
+            torch.onnx.export(
+                LogitsOnly(model), (dummy,), self.output_path,
+                input_names=['pixel_values'], output_names=['logits'],
+                dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}},
+                opset_version=self.opset,
+            )
+            size_mb = os.path.getsize(self.output_path) / (1024 * 1024)
+            print(f"   ✅ ONNX-модель сохранена ({size_mb:.1f} МБ)")
+            return True
+
+        except Exception as e:
+            print(f"   ❌ Ошибка при экспорте: {e}")
+            return False
+
+    def verify(self, tolerance: float = 1e-3) -> bool:
+        """Сравнивает вероятности PyTorch и ONNX Runtime на случайном пакете"""
+        print("\n🧪 Проверяю совпадение PyTorch и ONNX Runtime...")
+
+        try:
+            import torch
+            from transformers import ConvNextForImageClassification
+            from onnx_backend import OnnxImageClassifier
+
+            pixel_values = np.random.RandomState(0).randn(2, 3, 224, 224).astype(np.float32)
+
+            model = ConvNextForImageClassification.from_pretrained(self.model_path)
+            model.eval()
+            with torch.no_grad():
+                torch_probs = torch.softmax(model(pixel_values=torch.from_numpy(pixel_values)).logits, dim=-1).numpy()
+
+            onnx_probs = OnnxImageClassifier(self.model_path).predict_probabilities(pixel_values)
+
+            max_diff = float(np.abs(torch_probs - onnx_probs).max())
+            same_top1 = bool((torch_probs.argmax(axis=-1) == onnx_probs.argmax(axis=-1)).all())
+            print(f"   📊 Макс. расхождение вероятностей: {max_diff:.2e}")
+            print(f"   🎯 Топ-1 совпадает: {'да' if same_top1 else 'НЕТ'}")
+
+            if max_diff <= tolerance and same_top1:
+                print("   ✅ ONNX-модель эквивалентна исходной!")
+                return True
+            print("   ❌ Выходы ONNX-модели отличаются от исходной!")
+            return False
+
+        except Exception as e:
+            print(f"   ❌ Ошибка при проверке: {e}")
+            return False
+
+
+def main():
+    """Главная функция"""
+    parser = argparse.ArgumentParser(description="Экспорт ConvNeXt в ONNX")
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH, help="папка HF-модели")
+    parser.add_argument('--opset', type=int, default=17, help="версия opset ONNX")
+    parser.add_argument('--skip-verify', action='store_true', help="не сравнивать с PyTorch")
+    args = parser.parse_args()
+
+    print("🏆 ЭКСПОРТ ConvNeXt Large В ONNX")
+    print("="*50)
+
+    exporter = OnnxExporter(args.model_path, args.opset)
+    if not exporter.export():
+        sys.exit(1)
+    if not args.skip_verify and not exporter.verify():
+        sys.exit(1)
+
+    print(f"\n🎉 Готово! Используйте бэкенд ONNX: --backend onnx")
+
+
+if __name__ == "__main__":
+    main()
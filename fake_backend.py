@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ДЕТЕРМИНИРОВАННЫЙ ФЕЙКОВЫЙ БЭКЕНД КЛАССИФИКАТОРА
+Не требует модели на диске: метки берутся из сценария. Нужен, чтобы
+измерять и проверять все, кроме модели (чтение, декодирование,
+нормализация, правила, выбор, отчеты), на любой машине.
+
+Сценарий (JSON-файл вместо папки модели или <папка модели>/fake_backend.json):
+{
+  "labels": ["mailbag, postbag", "buckle", ...],
+  "rules": [{"pattern": "*strap*", "labels": {"buckle": 0.6}}],
+  "scenarios": [{"mailbag, postbag": 0.8}, {"buckle": 0.5, "strap": 0.3}],
+  "latency_ms": {"batch": 0.0, "image": 0.0}
+}
+- rules: шаблон имени файла (fnmatch) -> метки; первое совпадение
+- scenarios: если правило не подошло, сценарий выбирается по хэшу пикселей
+- оставшаяся вероятность равномерно распределяется по прочим меткам
+- latency_ms: имитация времени модели на пакет и на изображение
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from inference import PixelValuesClassifier
+
+FAKE_SCRIPT_FILENAME = "fake_backend.json"
+
+DEFAULT_SCRIPT = {
+    'labels': [
+        "mailbag, postbag",
+        "backpack, back pack, knapsack, packsack, rucksack, haversack",
+        "purse",
+        "handbag",
+        "tote bag",
+        "buckle",
+        "strap",
+        "zipper",
+        "pocket",
+        "front display",
+        "back view",
+        "wallet, billfold, notecase, pocketbook",
+        "envelope",
+        "paper towel",
+    ],
+    'rules': [
+        {'pattern': "*detail*", 'labels': {"buckle": 0.45, "strap": 0.3, "zipper": 0.1}},
+        {'pattern': "*strap*", 'labels': {"strap": 0.5, "buckle": 0.3}},
+        {'pattern': "*back*", 'labels': {"back view": 0.5, "mailbag, postbag": 0.3}},
+        {'pattern': "*front*", 'labels': {"mailbag, postbag": 0.7, "front display": 0.2}},
+    ],
+    'scenarios': [
+        {"mailbag, postbag": 0.75, "front display": 0.15},
+        {"purse": 0.6, "handbag": 0.2},
+        {"mailbag, postbag": 0.45, "tote bag": 0.2, "strap": 0.1},
+        {"buckle": 0.5, "zipper": 0.2, "pocket": 0.1},
+        {"envelope": 0.4, "paper towel": 0.3},
+    ],
+    'latency_ms': {'batch': 0.0, 'image': 0.0},
+}
+
+
+def fake_script_file(model_path: str) -> Optional[str]:
+    """Файл сценария: сам путь (если это файл) или fake_backend.json в папке модели"""
+    if os.path.isfile(model_path):
+        return model_path
+    candidate = os.path.join(model_path, FAKE_SCRIPT_FILENAME)
+    return candidate if os.path.isfile(candidate) else None
+
+
+def load_fake_script(model_path: str) -> Dict:
+    script_file = fake_script_file(model_path)
+    if script_file is None:
+        return DEFAULT_SCRIPT
+    with open(script_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class FakeImageClassifier(PixelValuesClassifier):
+    """Фейковый классификатор: тот же протокол, что у ONNX/TorchScript, результат - из сценария"""
+
+    name = "fake"
+
+    def __init__(self, model_path: str = "", script: Optional[Dict] = None):
+        script = script if script is not None else load_fake_script(model_path)
+        labels = script['labels']
+        self.id2label = {index: label for index, label in enumerate(labels)}
+        self.version = hashlib.sha1(json.dumps(script, sort_keys=True).encode()).hexdigest()[:12]
+        self.rules = [(rule['pattern'], self._distribution(rule['labels'])) for rule in script.get('rules', [])]
+        self.scenarios = [self._distribution(scenario) for scenario in script.get('scenarios', [])]
+        if not self.scenarios:
+            self.scenarios = [np.full(len(labels), 1.0 / len(labels), dtype=np.float32)]
+        latency = script.get('latency_ms', {})
+        self.batch_latency = latency.get('batch', 0.0) / 1000
+        self.image_latency = latency.get('image', 0.0) / 1000
+        self.stats = {'images': 0, 'rule_matches': 0}
+
+    def _distribution(self, scripted: Dict[str, float]) -> np.ndarray:
+        """Вектор вероятностей: заданные метки + равномерный остаток по прочим"""
+        label2id = {label: index for index, label in self.id2label.items()}
+        vector = np.zeros(len(label2id), dtype=np.float32)
+        for label, score in scripted.items():
+            if label not in label2id:
+                raise ValueError(f"Метка сценария отсутствует в labels: {label}")
+            vector[label2id[label]] = score
+        rest = len(label2id) - len(scripted)
+        if rest > 0:
+            vector[vector == 0] = max(0.0, 1.0 - float(vector.sum())) / rest
+        return vector
+
+    def _scripted(self, path: Optional[str], pixels: np.ndarray) -> np.ndarray:
+        if path:
+            filename = os.path.basename(path)
+            for pattern, distribution in self.rules:
+                if fnmatch.fnmatch(filename, pattern):
+                    self.stats['rule_matches'] += 1
+                    return distribution
+        digest = hashlib.sha256(np.ascontiguousarray(pixels).tobytes()).digest()
+        return self.scenarios[int.from_bytes(digest[:8], 'little') % len(self.scenarios)]
+
+    def predict_probabilities(self, pixel_values: np.ndarray, paths: Optional[List[str]] = None) -> np.ndarray:
+        paths = paths or [None] * len(pixel_values)
+        if self.batch_latency or self.image_latency:
+            time.sleep(self.batch_latency + self.image_latency * len(pixel_values))
+        self.stats['images'] += len(pixel_values)
+        return np.stack([self._scripted(path, pixels) for path, pixels in zip(paths, pixel_values)])
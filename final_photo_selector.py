@@ -7,19 +7,51 @@
 Выбирает ТОЛЬКО фотографии основного товара одного типа
 """
 
-from transformers import pipeline
 from PIL import Image
 import os
 import numpy as np
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import shutil
 import json
 
+from model_registry import model_registry, DEFAULT_MODEL_PATH, DEFAULT_BACKEND, BACKENDS
+from inference import (InferenceRecord, BatchInferenceEngine, DEFAULT_BATCH_SIZE,
+                       as_top_k, classify_image, find_image_files, preprocess_tag, record_cache_key)
+from image_decoder import DecodedImage, reduce_for_classifier
+from photo_pipeline import StagedPipeline, PipelineConfig
+from model_cascade import ModelCascade, SMALL_MODEL_PATH, SMALL_MODEL_BACKEND, rule_ambiguity
+from inference_cache import InferenceCache, DEFAULT_CACHE_PATH, model_identity
+from stage_timer import StageTimer, rounded, summarize, print_summary
+
 class FinalBagPhotoSelector:
     """Финальный селектор фотографий сумок с полной фильтрацией"""
     
-    def __init__(self):
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND,
+                 batch_size: int = DEFAULT_BATCH_SIZE, cascade_model_path: Optional[str] = None,
+                 cascade_backend: str = SMALL_MODEL_BACKEND,
+                 cache: Optional[InferenceCache] = None, timing: Optional[bool] = None):
         self.classifier = None
+        self.model_path = model_path
+        self.backend = backend
+        self.batch_size = batch_size
+        self.fast_decode = True  # уменьшенное JPEG-декодирование перед классификатором
+        self.pipeline_config: Optional[PipelineConfig] = None  # конвейер чтение/декодирование/инференс/оценка
+        self.inference_stats = {}
+        self.pipeline_stats = {}
+        # Каскад: маленькая модель для всех фото, Large - только для спорных
+        self.cascade_model_path = cascade_model_path
+        self.cascade_backend = cascade_backend
+        self.cascade_stats = {}
+        # Постоянный кэш инференса (ключ - хэш содержимого файла + модель + препроцессинг)
+        self.cache = cache
+        # Идентичности моделей для ключей кэша: считаются один раз за load_model, а не на каждое фото
+        self.model_keys: Dict[Tuple[str, str], str] = {}
+        self.cache_stats = {}
+        self.cache_counters = None
+        # Поэтапные замеры времени (None - по переменной окружения PHOTO_SELECTOR_TIMING)
+        self.timer = StageTimer(timing)
+        self.stage_timings = {}
+        self.image_timings = []
         
         # ТОЧНАЯ КЛАССИФИКАЦИЯ ТИПОВ СУМОК (не смешиваем разные категории!)
         self.MAILBAG_KEYWORDS = {
@@ -106,11 +138,15 @@ class FinalBagPhotoSelector:
         }
     
     def load_model(self) -> bool:
-        """Загружает ConvNeXt Large модель"""
+        """Получает ConvNeXt Large из общего реестра (загрузка один раз на процесс)"""
+        self.model_keys = {}  # веса могли смениться с прошлой загрузки
         try:
-            print("🚀 Загружаю ConvNeXt Large - лучшую AI модель...")
-            self.classifier = pipeline("image-classification", model="./models/convnext-large-224")
-            print("✅ ConvNeXt Large загружена успешно!")
+            if model_registry.is_loaded(self.model_path, self.backend):
+                print("♻️ ConvNeXt Large уже загружена, используем модель из реестра")
+            else:
+                print("🚀 Загружаю ConvNeXt Large - лучшую AI модель...")
+            self.classifier = model_registry.acquire(self.model_path, self.backend)
+            print("✅ ConvNeXt Large готова к работе!")
             print("   📊 Ожидаемая точность: 86.6%")
             print("   🎯 Финальный анализ: товар + ракурс + качество!")
             return True
@@ -118,7 +154,26 @@ class FinalBagPhotoSelector:
             print(f"❌ Ошибка при загрузке модели: {e}")
             return False
     
-    def analyze_product_content(self, ai_results: List[Dict]) -> Dict:
+    def model_key(self, model_path: Optional[str] = None, backend: Optional[str] = None) -> Optional[str]:
+        """Идентичность модели для кэша инференса (None - кэш выключен)"""
+        if self.cache is None:
+            return None
+        model_path = model_path or self.model_path
+        backend = backend or self.backend
+        if (model_path, backend) not in self.model_keys:
+            self.model_keys[(model_path, backend)] = model_identity(model_path, backend)
+        return self.model_keys[(model_path, backend)]
+    
+    def new_engine(self, fast_decode: bool) -> BatchInferenceEngine:
+        """Пакетный движок Large с общим кэшем инференса"""
+        return BatchInferenceEngine(self.classifier, self.batch_size, fast_decode=fast_decode,
+                                    cache=self.cache, model_key=self.model_key())
+    
+    def classify(self, img) -> InferenceRecord:
+        """Один прогон классификатора по изображению"""
+        return classify_image(self.classifier, img)
+    
+    def analyze_product_content(self, ai_results) -> Dict:
         """Анализирует содержимое на предмет основного товара vs деталей"""
         mailbag_score = 0.0
         backpack_score = 0.0
@@ -126,7 +181,7 @@ class FinalBagPhotoSelector:
         detail_penalty = 0.0
         content_analysis = []
         
-        for result in ai_results[:5]:
+        for result in as_top_k(ai_results)[:5]:
             label = result['label'].lower()
             score = result['score']
             
@@ -211,13 +266,13 @@ class FinalBagPhotoSelector:
             'analysis': content_analysis
         }
     
-    def analyze_viewpoint(self, ai_results: List[Dict]) -> Dict:
+    def analyze_viewpoint(self, ai_results) -> Dict:
         """Анализирует ракурс фотографии"""
         front_score = 0.0
         back_score = 0.0
         viewpoint_analysis = []
         
-        for result in ai_results[:5]:
+        for result in as_top_k(ai_results)[:5]:
             label = result['label'].lower()
             score = result['score']
             
@@ -257,159 +312,235 @@ class FinalBagPhotoSelector:
             'analysis': viewpoint_analysis
         }
     
-    def assess_bag_photo(self, image_path: str) -> Optional[Dict]:
+    def cascade_ambiguity(self, record: InferenceRecord) -> List[str]:
+        """Причины, по которым решение маленькой модели нужно перепроверить Large"""
+        content_info = self.analyze_product_content(record)
+        viewpoint_info = self.analyze_viewpoint(record)
+        return rule_ambiguity(content_info['dominant_score'],
+                              viewpoint_info['front_score'], viewpoint_info['back_score'])
+    
+    def build_cascade(self) -> ModelCascade:
+        """Каскад маленькая модель -> Large (Large уже должна быть загружена)"""
+        small_classifier = model_registry.acquire(self.cascade_model_path, self.cascade_backend)
+        return ModelCascade(small_classifier, self.classifier, self.cascade_ambiguity,
+                            self.assess_bag_photo, self.batch_size, fast_decode=self.fast_decode,
+                            cache=self.cache, small_model_key=self.model_key(self.cascade_model_path, self.cascade_backend),
+                            large_model_key=self.model_key())
+    
+    def run_cascade(self, image_paths: List[str]) -> Dict[str, InferenceRecord]:
+        """Классифицирует файлы каскадом и сохраняет долю переданных в Large"""
+        cascade = self.build_cascade()
+        records = cascade.classify_paths(image_paths)
+        cascade.print_stats()
+        self.cascade_stats = cascade.get_stats()
+        self.inference_stats = cascade.large_engine.get_stats()
+        return records
+    
+    def assess_bag_photo(self, image_path: str, record: Optional[InferenceRecord] = None) -> Optional[Dict]:
         """Оценивает фотографию сумки с полным анализом"""
+        timings = self.timer.image_timings()
         try:
             with Image.open(image_path) as img:
-                # Базовая информация
-                width, height = img.size
-                file_size = os.path.getsize(image_path)
-                aspect_ratio = width / height
-                size_mb = file_size / (1024 * 1024)
+                # Базовая информация (из заголовка, до уменьшенного декодирования)
+                with self.timer.stage('header', timings):
+                    width, height = img.size
+                    img_mode, img_format = img.mode, img.format
+                    file_size = os.path.getsize(image_path)
                 
-                # 1. ОСНОВНЫЕ ТРЕБОВАНИЯ (25% веса)
-                basic_score = 0.0
+                meta = DecodedImage(image_path, None, width, height, img_mode, img_format, file_size)
                 
-                # Разрешение
-                if width >= 800 and height >= 800:
-                    basic_score += 2.0
-                if width >= 1200 and height >= 1200:
-                    basic_score += 1.0
-                if width >= 1920 and height >= 1920:
-                    basic_score += 1.0
+                # ЕДИНСТВЕННЫЙ ПРОГОН МОДЕЛИ: запись используется всеми анализами
+                # (может быть получена заранее пакетным инференсом или взята из кэша)
+                inference_error = None
+                cache_key = None
+                if self.classifier and record is None and self.cache is not None:
+                    with self.timer.stage('cache_lookup', timings):
+                        cache_key = record_cache_key(self.model_key(), preprocess_tag(False, self.fast_decode))
+                        record, _ = self.cache.lookup(image_path, cache_key)
+                if self.classifier and record is None:
+                    try:
+                        with self.timer.stage('decode', timings):
+                            image = reduce_for_classifier(img) if self.fast_decode else img
+                        with self.timer.stage('inference', timings):
+                            record = self.classify(image)
+                        if cache_key:
+                            self.cache.store(image_path, cache_key, record, meta)
+                    except Exception as e:
+                        inference_error = e
                 
-                # Соотношение сторон
-                if 0.9 <= aspect_ratio <= 1.1:  # Квадратные
-                    basic_score += 1.0
-                elif 1.2 <= aspect_ratio <= 1.5:  # Стандартные
-                    basic_score += 0.8
-                elif 0.6 <= aspect_ratio <= 0.9:  # Вертикальные
-                    basic_score += 0.7
-                else:
-                    basic_score += 0.3
+                with self.timer.stage('scoring', timings):
+                    assessment = self.score_photo(meta, record, inference_error)
+                if timings is not None:
+                    assessment['timings_ms'] = rounded(timings)
+                return assessment
                 
-                # Цветовой режим
-                if img.mode == 'RGB':
-                    basic_score += 1.0
-                elif img.mode == 'RGBA':
-                    basic_score += 0.8
-                else:
-                    basic_score += 0.5
+        except Exception as e:
+            print(f"   ❌ Ошибка при анализе {os.path.basename(image_path)}: {e}")
+            return None
+    
+    def score_photo(self, meta, record: Optional[InferenceRecord] = None,
+                    inference_error: Optional[Exception] = None) -> Dict:
+        """Считает оценки по метаданным файла и записи инференса (без чтения файла)"""
+        width, height = meta.width, meta.height
+        img_mode, img_format = meta.mode, meta.format
+        file_size = meta.file_size
+        aspect_ratio = width / height
+        size_mb = file_size / (1024 * 1024)
+        
+        # 1. ОСНОВНЫЕ ТРЕБОВАНИЯ (25% веса)
+        basic_score = 0.0
+        
+        # Разрешение
+        if width >= 800 and height >= 800:
+            basic_score += 2.0
+        if width >= 1200 and height >= 1200:
+            basic_score += 1.0
+        if width >= 1920 and height >= 1920:
+            basic_score += 1.0
+        
+        # Соотношение сторон
+        if 0.9 <= aspect_ratio <= 1.1:  # Квадратные
+            basic_score += 1.0
+        elif 1.2 <= aspect_ratio <= 1.5:  # Стандартные
+            basic_score += 0.8
+        elif 0.6 <= aspect_ratio <= 0.9:  # Вертикальные
+            basic_score += 0.7
+        else:
+            basic_score += 0.3
+        
+        # Цветовой режим
+        if img_mode == 'RGB':
+            basic_score += 1.0
+        elif img_mode == 'RGBA':
+            basic_score += 0.8
+        else:
+            basic_score += 0.5
+        
+        # Формат файла
+        if img_format in ['JPEG', 'PNG']:
+            basic_score += 1.0
+        else:
+            basic_score += 0.5
+        
+        # 2. ТЕХНИЧЕСКОЕ КАЧЕСТВО (20% веса)
+        technical_score = 0.0
+        
+        # Размер файла
+        if 0.1 <= size_mb <= 2.0:
+            technical_score += 1.0
+        elif 0.05 <= size_mb <= 5.0:
+            technical_score += 0.8
+        else:
+            technical_score += 0.3
+        
+        # Четкость
+        pixels = width * height
+        compression_ratio = pixels / file_size
+        if 100 <= compression_ratio <= 1000:
+            technical_score += 1.0
+        else:
+            technical_score += 0.5
+        
+        # 3. AI АНАЛИЗ СОДЕРЖИМОГО (35% веса)
+        content_score = 0.0
+        content_analysis = []
+        content_type = "UNKNOWN"
+        
+        if self.classifier:
+            try:
+                if inference_error:
+                    raise inference_error
                 
-                # Формат файла
-                if img.format in ['JPEG', 'PNG']:
-                    basic_score += 1.0
-                else:
-                    basic_score += 0.5
+                # Анализируем содержимое
+                content_info = self.analyze_product_content(record)
+                content_score = content_info['dominant_score'] + content_info['detail_penalty']
+                content_type = content_info['content_type']
+                content_analysis = content_info['analysis']
                 
-                # 2. ТЕХНИЧЕСКОЕ КАЧЕСТВО (20% веса)
-                technical_score = 0.0
+                # Нормализуем оценку содержимого до 3.5
+                content_score = min(max(content_score, 0.0), 3.5)
                 
-                # Размер файла
-                if 0.1 <= size_mb <= 2.0:
-                    technical_score += 1.0
-                elif 0.05 <= size_mb <= 5.0:
-                    technical_score += 0.8
-                else:
-                    technical_score += 0.3
+            except Exception as e:
+                content_analysis.append(f"⚠️ Ошибка AI анализа: {e}")
+                content_score = 1.0
+        
+        # 4. АНАЛИЗ РАКУРСА (20% веса)
+        viewpoint_score = 0.0
+        viewpoint_analysis = []
+        main_view = "UNKNOWN"
+        
+        if self.classifier:
+            try:
+                if inference_error:
+                    raise inference_error
+                viewpoint_info = self.analyze_viewpoint(record)
                 
-                # Четкость
-                pixels = width * height
-                compression_ratio = pixels / file_size
-                if 100 <= compression_ratio <= 1000:
-                    technical_score += 1.0
+                # Оценка ракурса
+                if viewpoint_info['main_view'] == 'FRONT':
+                    viewpoint_score = 2.0  # Максимум за передний вид
+                    viewpoint_analysis.append(f"🟢 ПЕРЕДНИЙ ВИД: идеально для первой фотографии!")
+                elif viewpoint_info['main_view'] == 'BACK':
+                    viewpoint_score = 0.0  # Минимум за задний вид
+                    viewpoint_analysis.append(f"🔴 ЗАДНИЙ ВИД: НЕ подходит для первой фотографии!")
                 else:
-                    technical_score += 0.5
+                    viewpoint_score = 1.0  # Среднее за боковой вид
+                    viewpoint_analysis.append(f"🟡 БОКОВОЙ ВИД: приемлемо")
                 
-                # 3. AI АНАЛИЗ СОДЕРЖИМОГО (35% веса)
-                content_score = 0.0
-                content_analysis = []
-                content_type = "UNKNOWN"
+                main_view = viewpoint_info['main_view']
+                # Добавляем детальный анализ ракурса
+                viewpoint_analysis.extend(viewpoint_info['analysis'])
                 
-                if self.classifier:
-                    try:
-                        results = self.classifier(img)
-                        top_results = results[:5]
-                        
-                        # Анализируем содержимое
-                        content_info = self.analyze_product_content(top_results)
-                        content_score = content_info['dominant_score'] + content_info['detail_penalty']
-                        content_type = content_info['content_type']
-                        content_analysis = content_info['analysis']
-                        
-                        # Нормализуем оценку содержимого до 3.5
-                        content_score = min(max(content_score, 0.0), 3.5)
-                        
-                    except Exception as e:
-                        content_analysis.append(f"⚠️ Ошибка AI анализа: {e}")
-                        content_score = 1.0
-                
-                # 4. АНАЛИЗ РАКУРСА (20% веса)
-                viewpoint_score = 0.0
-                viewpoint_analysis = []
-                main_view = "UNKNOWN"
-                
-                if self.classifier:
-                    try:
-                        results = self.classifier(img)
-                        viewpoint_info = self.analyze_viewpoint(results)
-                        
-                        # Оценка ракурса
-                        if viewpoint_info['main_view'] == 'FRONT':
-                            viewpoint_score = 2.0  # Максимум за передний вид
-                            viewpoint_analysis.append(f"🟢 ПЕРЕДНИЙ ВИД: идеально для первой фотографии!")
-                        elif viewpoint_info['main_view'] == 'BACK':
-                            viewpoint_score = 0.0  # Минимум за задний вид
-                            viewpoint_analysis.append(f"🔴 ЗАДНИЙ ВИД: НЕ подходит для первой фотографии!")
-                        else:
-                            viewpoint_score = 1.0  # Среднее за боковой вид
-                            viewpoint_analysis.append(f"🟡 БОКОВОЙ ВИД: приемлемо")
-                        
-                        main_view = viewpoint_info['main_view']
-                        # Добавляем детальный анализ ракурса
-                        viewpoint_analysis.extend(viewpoint_info['analysis'])
-                        
-                    except Exception as e:
-                        viewpoint_analysis.append(f"⚠️ Ошибка анализа ракурса: {e}")
-                        viewpoint_score = 1.0
-                
-                # 5. ИТОГОВАЯ ОЦЕНКА
-                total_score = basic_score + technical_score + content_score + viewpoint_score
-                final_score = min(total_score, 10.0)
-                
-                # Дополнительная информация
-                is_main_product = content_type in ["MAILBAG_PRODUCT", "BACKPACK_PRODUCT", "HANDBAG_PRODUCT"]
-                is_front_view = viewpoint_score >= 1.5
-                is_back_view = viewpoint_score <= 0.5
-                is_details_only = content_type == "DETAILS_ONLY"
-                
-                return {
-                    'basic_score': round(basic_score, 2),
-                    'technical_score': round(technical_score, 2),
-                    'content_score': round(content_score, 2),
-                    'viewpoint_score': round(viewpoint_score, 2),
-                    'final_score': round(final_score, 2),
-                    'content_type': content_type,
-                    'main_view': main_view,
-                    'is_main_product': is_main_product,
-                    'is_front_view': is_front_view,
-                    'is_back_view': is_back_view,
-                    'is_details_only': is_details_only,
-                    'content_analysis': content_analysis,
-                    'viewpoint_analysis': viewpoint_analysis,
-                    'width': width,
-                    'height': height,
-                    'aspect_ratio': round(aspect_ratio, 2),
-                    'file_size_mb': round(size_mb, 2),
-                    'format': img.format,
-                    'mode': img.mode
-                }
-                
-        except Exception as e:
-            print(f"   ❌ Ошибка при анализе {os.path.basename(image_path)}: {e}")
-            return None
+            except Exception as e:
+                viewpoint_analysis.append(f"⚠️ Ошибка анализа ракурса: {e}")
+                viewpoint_score = 1.0
+        
+        # 5. ИТОГОВАЯ ОЦЕНКА
+        total_score = basic_score + technical_score + content_score + viewpoint_score
+        final_score = min(total_score, 10.0)
+        
+        # Дополнительная информация
+        is_main_product = content_type in ["MAILBAG_PRODUCT", "BACKPACK_PRODUCT", "HANDBAG_PRODUCT"]
+        is_front_view = viewpoint_score >= 1.5
+        is_back_view = viewpoint_score <= 0.5
+        is_details_only = content_type == "DETAILS_ONLY"
+        
+        return {
+            'basic_score': round(basic_score, 2),
+            'technical_score': round(technical_score, 2),
+            'content_score': round(content_score, 2),
+            'viewpoint_score': round(viewpoint_score, 2),
+            'final_score': round(final_score, 2),
+            'content_type': content_type,
+            'main_view': main_view,
+            'is_main_product': is_main_product,
+            'is_front_view': is_front_view,
+            'is_back_view': is_back_view,
+            'is_details_only': is_details_only,
+            'content_analysis': content_analysis,
+            'viewpoint_analysis': viewpoint_analysis,
+            'width': width,
+            'height': height,
+            'aspect_ratio': round(aspect_ratio, 2),
+            'file_size_mb': round(size_mb, 2),
+            'format': img_format,
+            'mode': img_mode,
+            'ai_analysis': record.as_pairs() if record else [],
+            'model_invocations': record.invocations if record else 0
+        }
+    
+    def run_pipeline(self, image_paths: List[str]) -> Dict[str, Dict]:
+        """Оценивает файлы конвейером (модель уже должна быть загружена)"""
+        engine = self.new_engine(fast_decode=True)
+        pipeline = StagedPipeline(engine, self.score_photo, self.pipeline_config)
+        assessments = pipeline.run(image_paths)
+        pipeline.print_stats()
+        self.pipeline_stats = pipeline.get_stats()
+        self.inference_stats = engine.get_stats()
+        return assessments
     
-    def select_best_bag_photos(self, input_folder: str = "big", num_best: int = 2) -> List[Dict]:
+    def select_best_bag_photos(self, input_folder: str = "big", num_best: int = 2,
+                               records: Optional[Dict[str, InferenceRecord]] = None,
+                               assessments: Optional[Dict[str, Dict]] = None) -> List[Dict]:
         """Выбирает лучшие фотографии сумок с полной фильтрацией"""
         print("=== 🏆 ФИНАЛЬНЫЙ ВЫБОР ФОТОГРАФИЙ СУМОК ===")
         print("🤖 AI модель: ConvNeXt Large + полный анализ")
@@ -425,13 +556,7 @@ class FinalBagPhotoSelector:
             return []
         
         # Ищем изображения
-        image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tiff', '*.webp']
-        image_files = []
-        
-        for ext in image_extensions:
-            pattern = os.path.join(input_folder, ext)
-            image_files.extend([f for f in os.listdir(input_folder) 
-                              if f.lower().endswith(ext.replace('*', ''))])
+        image_files = find_image_files(input_folder)
         
         if not image_files:
             print(f"❌ Изображения не найдены в папке '{input_folder}'")
@@ -444,46 +569,72 @@ class FinalBagPhotoSelector:
             print("❌ Не удалось загрузить AI модель!")
             return []
         
+        image_paths = [os.path.join(input_folder, f) for f in image_files]
+        self.timer.reset()
+        # Статистика кэша в отчете папки - только за эту папку (кэш общий для прогона)
+        self.cache_counters = self.cache.counters() if self.cache is not None else None
+        
+        with self.timer.stage('inference'):
+            # Каскад: Large только для спорных фотографий и претендентов на первые места
+            if assessments is None and records is None and self.cascade_model_path:
+                records = self.run_cascade(image_paths)
+            
+            # Конвейер: чтение, декодирование, инференс и оценка идут параллельно
+            if assessments is None and records is None and self.pipeline_config:
+                assessments = self.run_pipeline(image_paths)
+            
+            # Пакетный инференс по всей папке (если записи не получены заранее по многим папкам)
+            if assessments is None and records is None:
+                engine = self.new_engine(fast_decode=self.fast_decode)
+                records = engine.classify_paths(image_paths)
+                engine.print_stats()
+                self.inference_stats = engine.get_stats()
+        
         # Анализируем фотографии
         photo_scores = []
         
-        for i, filename in enumerate(image_files, 1):
-            image_path = os.path.join(input_folder, filename)
-            print(f"🔄 Анализирую {i}/{len(image_files)}: {filename}")
+        with self.timer.stage('assess'):
+            for i, filename in enumerate(image_files, 1):
+                image_path = os.path.join(input_folder, filename)
+                print(f"🔄 Анализирую {i}/{len(image_files)}: {filename}")
             
-            assessment = self.assess_bag_photo(image_path)
+                if assessments is not None:
+                    assessment = assessments.get(image_path)
+                else:
+                    assessment = self.assess_bag_photo(image_path, records.get(image_path))
             
-            if assessment:
-                print(f"   📊 Основные требования: {assessment['basic_score']}/4.0")
-                print(f"   🔧 Техническое качество: {assessment['technical_score']}/2.0")
-                print(f"   🤖 Содержимое: {assessment['content_score']}/3.5")
-                print(f"   🎯 Ракурс: {assessment['viewpoint_score']}/2.0")
-                print(f"   ⭐ Итоговая оценка: {assessment['final_score']}/10")
-                print(f"   📏 Размеры: {assessment['width']} × {assessment['height']}")
+                if assessment:
+                    print(f"   📊 Основные требования: {assessment['basic_score']}/4.0")
+                    print(f"   🔧 Техническое качество: {assessment['technical_score']}/2.0")
+                    print(f"   🤖 Содержимое: {assessment['content_score']}/3.5")
+                    print(f"   🎯 Ракурс: {assessment['viewpoint_score']}/2.0")
+                    print(f"   ⭐ Итоговая оценка: {assessment['final_score']}/10")
+                    print(f"   📏 Размеры: {assessment['width']} × {assessment['height']}")
+                    print(f"   🔁 Вызовов модели: {assessment['model_invocations']}")
                 
-                # Показываем тип содержимого
-                content_icon = "🟢" if assessment['is_main_product'] else "🔴" if assessment['is_details_only'] else "🟡"
-                print(f"   {content_icon} Тип содержимого: {assessment['content_type']}")
+                    # Показываем тип содержимого
+                    content_icon = "🟢" if assessment['is_main_product'] else "🔴" if assessment['is_details_only'] else "🟡"
+                    print(f"   {content_icon} Тип содержимого: {assessment['content_type']}")
                 
-                # Показываем анализ содержимого
-                if assessment['content_analysis']:
-                    print("   🤖 Анализ содержимого:")
-                    for analysis in assessment['content_analysis']:
-                        print(f"      {analysis}")
+                    # Показываем анализ содержимого
+                    if assessment['content_analysis']:
+                        print("   🤖 Анализ содержимого:")
+                        for analysis in assessment['content_analysis']:
+                            print(f"      {analysis}")
                 
-                # Показываем анализ ракурса
-                if assessment['viewpoint_analysis']:
-                    print("   🎯 Анализ ракурса:")
-                    for analysis in assessment['viewpoint_analysis']:
-                        print(f"      {analysis}")
+                    # Показываем анализ ракурса
+                    if assessment['viewpoint_analysis']:
+                        print("   🎯 Анализ ракурса:")
+                        for analysis in assessment['viewpoint_analysis']:
+                            print(f"      {analysis}")
                 
-                photo_scores.append({
-                    'filename': filename,
-                    'path': image_path,
-                    **assessment
-                })
+                    photo_scores.append({
+                        'filename': filename,
+                        'path': image_path,
+                        **assessment
+                    })
             
-            print()
+                print()
         
         # Сортируем по оценке
         photo_scores.sort(key=lambda x: x['final_score'], reverse=True)
@@ -492,14 +643,29 @@ class FinalBagPhotoSelector:
         self._display_results(photo_scores)
         
         # ФИНАЛЬНЫЙ ВЫБОР: приоритет основному товару + передним ракурсам
-        best_photos = self._final_select_best(photo_scores, num_best, input_folder)
+        with self.timer.stage('select'):
+            best_photos = self._final_select_best(photo_scores, num_best, input_folder)
+        
+        # Попадания в кэш инференса за эту папку
+        if self.cache is not None:
+            self.cache_stats = self.cache.get_stats(self.cache_counters)
+            if self.cache_stats['hits'] + self.cache_stats['misses']:
+                # Записи, полученные заранее по многим папкам, в статистику папки не входят
+                self.cache.print_stats(self.cache_counters)
         
         # Копируем лучшие фотографии
         output_folder = "best_bag_photos_final"
-        self._copy_best_photos(best_photos, output_folder, input_folder)
+        with self.timer.stage('copy'):
+            self._copy_best_photos(best_photos, output_folder, input_folder)
         
-        # Сохраняем отчет
-        self._save_report(photo_scores, best_photos, output_folder)
+        # Сохраняем отчет (время записи отчета попадает в stage_timings, но не в сам отчет)
+        with self.timer.stage('report'):
+            self._save_report(photo_scores, best_photos, output_folder)
+        
+        if self.timer.enabled:
+            self.stage_timings = self.timer.folder_timings()
+            self.image_timings = [p['timings_ms'] for p in photo_scores if 'timings_ms' in p]
+            print_summary(summarize([self.stage_timings]), "Этапы папки")
         
         return best_photos
     
@@ -789,6 +955,17 @@ class FinalBagPhotoSelector:
             'analysis_date': str(np.datetime64('now')),
             'criteria': 'MAIN_PRODUCT + VIEWPOINT + QUALITY',
             'filtering': 'EXCLUDES_DETAILS_AND_BACK_VIEWS',
+            'model_registry': model_registry.get_stats(),
+            'inference_stats': self.inference_stats,
+            'pipeline_stats': self.pipeline_stats,
+            'cascade_stats': self.cascade_stats,
+            'cache_stats': self.cache_stats,
+            'model_invocations_total': sum(p.get('model_invocations', 0) for p in all_photos),
+            'max_model_invocations_per_image': max((p.get('model_invocations', 0) for p in all_photos), default=0),
+            'stage_timings': {
+                'folder_ms': self.timer.folder_timings(),
+                'images': summarize(p.get('timings_ms') for p in all_photos),
+            } if self.timer.enabled else {},
             'all_photos': all_photos,
             'best_photos': best_photos
         }
@@ -800,7 +977,21 @@ class FinalBagPhotoSelector:
 
 def main():
     """Главная функция"""
-    import sys
+    import argparse
+    parser = argparse.ArgumentParser(description="Финальный селектор фотографий товара")
+    parser.add_argument('input_folder', nargs='?', default="big", help="папка с фотографиями")
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help="бэкенд модели: hf-pipeline (fp32), hf-pipeline-int8, hf-pipeline-bf16, onnx, torchscript или fake")
+    parser.add_argument('--cascade', nargs='?', const=SMALL_MODEL_PATH, default=None, metavar='SMALL_MODEL',
+                        help=f"каскад: сначала маленькая модель (по умолчанию {SMALL_MODEL_PATH}), "
+                             f"Large - только для спорных фото")
+    parser.add_argument('--cascade-backend', choices=BACKENDS, default=SMALL_MODEL_BACKEND,
+                        help=f"бэкенд маленькой модели каскада (по умолчанию {SMALL_MODEL_BACKEND}): "
+                             f"onnx/torchscript требуют отдельного экспорта Tiny")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, default=None, metavar='DB',
+                        help=f"постоянный кэш инференса SQLite (по умолчанию {DEFAULT_CACHE_PATH})")
+    parser.add_argument('--timing', action='store_true', help="поэтапные замеры времени в отчете")
+    args = parser.parse_args()
     
     print("🏆 ФИНАЛЬНЫЙ СЕЛЕКТОР ФОТОГРАФИЙ СУМОК")
     print("="*50)
@@ -811,15 +1002,14 @@ def main():
     print()
     
     # Получаем путь к папке из аргументов командной строки
-    if len(sys.argv) > 1:
-        input_folder = sys.argv[1]
-        print(f"📁 Анализирую папку: {input_folder}")
-    else:
-        input_folder = "big"  # По умолчанию
-        print(f"📁 Использую папку по умолчанию: {input_folder}")
+    input_folder = args.input_folder
+    print(f"📁 Анализирую папку: {input_folder}")
     
     # Создаем финальный селектор
-    selector = FinalBagPhotoSelector()
+    selector = FinalBagPhotoSelector(backend=args.backend, cascade_model_path=args.cascade,
+                                    cascade_backend=args.cascade_backend,
+                                     cache=InferenceCache(args.cache) if args.cache else None,
+                                     timing=args.timing or None)
     
     # Запускаем анализ с указанной папкой
     best_photos = selector.select_best_bag_photos(input_folder, 2)
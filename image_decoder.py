@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+БЫСТРОЕ ДЕКОДИРОВАНИЕ ИЗОБРАЖЕНИЙ ДЛЯ КЛАССИФИКАТОРА
+Студийные снимки 4000x4000+ декодируются сразу в уменьшенном виде
+(JPEG draft в PIL или IMREAD_REDUCED_* в OpenCV), затем обрезка и
+нормализация ImageNet выполняются одним проходом NumPy.
+Исходные ширина/высота сохраняются для правил basic_score.
+"""
+
+import io
+import os
+from typing import Optional, Tuple
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Параметры препроцессинга ConvNeXt-224 (crop_pct = 0.875)
+CLASSIFIER_SIZE = 224
+RESIZE_SHORTEST_EDGE = 256
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# x_norm = (x / 255 - mean) / std = x * SCALE - OFFSET  (один проход)
+_SCALE = (1.0 / (255.0 * IMAGENET_STD)).astype(np.float32)
+_OFFSET = (IMAGENET_MEAN / IMAGENET_STD).astype(np.float32)
+
+# Версия препроцессинга (меняется при любом изменении параметров выше)
+PREPROCESS_VERSION = "draft-256-crop-224-v1"
+
+
+class DecodedImage:
+    """Уменьшенное изображение для модели + метаданные исходного файла"""
+
+    def __init__(self, path: str, image: Image.Image, width: int, height: int,
+                 mode: str, format: Optional[str], file_size: int):
+        self.path = path
+        self.image = image          # RGB, короткая сторона ~RESIZE_SHORTEST_EDGE
+        self.width = width          # исходная ширина (для basic_score)
+        self.height = height        # исходная высота
+        self.mode = mode            # исходный цветовой режим
+        self.format = format
+        self.file_size = file_size
+
+    def pixel_values(self) -> np.ndarray:
+        """Нормализованный тензор CHW float32 для модели"""
+        return normalize_image(self.image)
+
+
+def _shortest_edge_size(width: int, height: int, shortest: int) -> Tuple[int, int]:
+    if width <= height:
+        return shortest, max(shortest, round(height * shortest / width))
+    return max(shortest, round(width * shortest / height)), shortest
+
+
+def reduce_for_classifier(img: Image.Image, shortest: int = RESIZE_SHORTEST_EDGE) -> Image.Image:
+    """Уменьшает открытое изображение до размера, нужного модели.
+    Для JPEG используется draft: DCT-масштабирование при декодировании (1/2, 1/4, 1/8).
+    Размеры исходника нужно прочитать ДО вызова - draft меняет img.size"""
+    if img.format == 'JPEG':
+        img.draft('RGB', (shortest, shortest))
+    rgb = img.convert('RGB')
+    if min(rgb.size) != shortest:
+        rgb = rgb.resize(_shortest_edge_size(*rgb.size, shortest), Image.BICUBIC)
+    return rgb
+
+
+def _reduced_flag(width: int, height: int, shortest: int) -> int:
+    """Флаг OpenCV IMREAD_REDUCED_COLOR_{2,4,8} с наибольшим допустимым уменьшением"""
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if min(width, height) // factor >= shortest:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def _from_opencv(array: Optional[np.ndarray], shortest: int) -> Optional[Image.Image]:
+    """BGR-массив OpenCV -> RGB PIL с короткой стороной shortest"""
+    if array is None:
+        return None
+    array = np.ascontiguousarray(array[:, :, ::-1])  # BGR -> RGB
+    h, w = array.shape[:2]
+    if min(w, h) != shortest:
+        array = cv2.resize(array, _shortest_edge_size(w, h, shortest), interpolation=cv2.INTER_AREA)
+    return Image.fromarray(array)
+
+
+def decode_image(path: str, backend: str = 'pil', shortest: int = RESIZE_SHORTEST_EDGE) -> DecodedImage:
+    """Декодирует файл сразу в размер, близкий к входу модели"""
+    file_size = os.path.getsize(path)
+    with Image.open(path) as img:
+        # Заголовок читается без декодирования пикселей
+        width, height = img.size
+        mode, img_format = img.mode, img.format
+
+        if backend == 'opencv' and cv2 is not None:
+            reduced = _from_opencv(cv2.imread(path, _reduced_flag(width, height, shortest)), shortest)
+            if reduced is not None:
+                return DecodedImage(path, reduced, width, height, mode, img_format, file_size)
+
+        reduced = reduce_for_classifier(img, shortest)
+    return DecodedImage(path, reduced, width, height, mode, img_format, file_size)
+
+
+def decode_image_bytes(data: bytes, path: str = '', backend: str = 'pil',
+                       shortest: int = RESIZE_SHORTEST_EDGE) -> DecodedImage:
+    """То же, что decode_image, но из уже прочитанных байтов (загрузки, конвейер)"""
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        mode, img_format = img.mode, img.format
+
+        if backend == 'opencv' and cv2 is not None:
+            buffer = np.frombuffer(data, dtype=np.uint8)
+            reduced = _from_opencv(cv2.imdecode(buffer, _reduced_flag(width, height, shortest)), shortest)
+            if reduced is not None:
+                return DecodedImage(path, reduced, width, height, mode, img_format, len(data))
+
+        reduced = reduce_for_classifier(img, shortest)
+    return DecodedImage(path, reduced, width, height, mode, img_format, len(data))
+
+
+def pil_file_size(img: Image.Image) -> int:
+    """Размер файла для PIL-изображения: исходный файл, если он есть, иначе размер кодирования
+    в памяти в исходном формате (нужен правилам technical_score)"""
+    filename = getattr(img, 'filename', '')
+    if filename and os.path.exists(filename):
+        return os.path.getsize(filename)
+    buffer = io.BytesIO()
+    img_format = img.format if img.format in ('JPEG', 'PNG', 'WEBP') else 'PNG'
+    img.save(buffer, format=img_format)
+    return buffer.tell()
+
+
+def source_name(source, index: int) -> str:
+    """Имя фото для отчетов: имя файла, если оно есть, иначе image_NNN"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.basename(os.fspath(source))
+    filename = getattr(source, 'filename', '')
+    return os.path.basename(filename) if filename else f"image_{index:03d}"
+
+
+def decode_source(source, name: str = '', backend: str = 'pil',
+                  shortest: int = RESIZE_SHORTEST_EDGE) -> DecodedImage:
+    """Путь, байты или PIL.Image -> DecodedImage (без записи на диск)"""
+    if isinstance(source, Image.Image):
+        # Изображение вызывающего не меняется: draft не применяется, уменьшается копия
+        width, height = source.size
+        file_size = pil_file_size(source)
+        return DecodedImage(name, reduce_for_classifier(source.convert('RGB'), shortest), width, height,
+                            source.mode, source.format, file_size)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image_bytes(bytes(source), name, backend, shortest)
+    return decode_image(source, backend, shortest)
+
+
+def normalize_image(image: Image.Image, size: int = CLASSIFIER_SIZE) -> np.ndarray:
+    """Центральная обрезка + rescale + нормализация ImageNet одним проходом -> CHW float32"""
+    array = np.asarray(image, dtype=np.uint8)
+    h, w = array.shape[:2]
+    top = max(0, (h - size) // 2)
+    left = max(0, (w - size) // 2)
+    crop = array[top:top + size, left:left + size]
+    # Один векторный проход: uint8 -> float32, масштаб и сдвиг по каналам
+    normalized = crop * _SCALE - _OFFSET
+    return np.ascontiguousarray(normalized.transpose(2, 0, 1), dtype=np.float32)
+
+
+def stack_pixel_values(images) -> np.ndarray:
+    """Пакет NCHW float32 из уменьшенных изображений"""
+    return np.stack([normalize_image(image) for image in images])
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ЗАПИСЬ РЕЗУЛЬТАТА ИНФЕРЕНСА
+Один прогон классификатора на изображение: топ-k меток, оценки и
+(по желанию) полный вектор вероятностей. Анализ содержимого, ракурса и
+категории товара читают одну и ту же запись вместо повторных вызовов модели
+"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional, Tuple
+import os
+import time
+import numpy as np
+from PIL import Image
+
+from image_decoder import (DecodedImage, PREPROCESS_VERSION, decode_image, reduce_for_classifier,
+                           stack_pixel_values)
+from metrics import metrics
+
+DEFAULT_TOP_K = 5
+
+
+class InferenceRecord:
+    """Результат одного вызова классификатора для одного изображения"""
+
+    def __init__(self, top_k: List[Dict], probabilities: Optional[np.ndarray] = None,
+                 invocations: int = 1):
+        # Список словарей {'label': ..., 'score': ...} по убыванию оценки
+        self.top_k = [{'label': item['label'], 'score': float(item['score'])} for item in top_k]
+        # Полный вектор вероятностей по id2label модели (если запрошен)
+        self.probabilities = probabilities
+        # Сколько раз вызывалась модель для получения этой записи
+        self.invocations = invocations
+        # Оценки правил селектора, посчитанные пакетно по вектору вероятностей,
+        # и веса ключевых слов (LabelWeights), по которым они посчитаны
+        self.rule_scores: Optional[Dict[str, float]] = None
+        self.rule_weights = None
+
+    @property
+    def labels(self) -> List[str]:
+        return [item['label'] for item in self.top_k]
+
+    @property
+    def scores(self) -> List[float]:
+        return [item['score'] for item in self.top_k]
+
+    def as_pairs(self) -> List[Tuple[str, float]]:
+        """Пары (метка, уверенность) - формат поля 'ai_analysis'"""
+        return [(item['label'], item['score']) for item in self.top_k]
+
+    def label_terms(self) -> List[Tuple[List[str], float]]:
+        """Синонимы каждой метки ImageNet ('mailbag, postbag' -> ['mailbag', 'postbag'])"""
+        return [(split_label(item['label']), item['score']) for item in self.top_k]
+
+    def to_dict(self) -> Dict:
+        return {
+            'top_k': self.top_k,
+            'invocations': self.invocations,
+        }
+
+    @classmethod
+    def from_pairs(cls, pairs: List[Tuple[str, float]], invocations: int = 0) -> 'InferenceRecord':
+        """Восстанавливает запись из сохраненного поля 'ai_analysis'"""
+        return cls([{'label': label, 'score': score} for label, score in pairs], invocations=invocations)
+
+
+def split_label(label: str) -> List[str]:
+    """Разбивает метку ImageNet на синонимы в нижнем регистре"""
+    return [term.strip().lower() for term in label.split(',') if term.strip()]
+
+
+def as_top_k(results) -> List[Dict]:
+    """Принимает InferenceRecord или сырой вывод pipeline и возвращает топ-k"""
+    if isinstance(results, InferenceRecord):
+        return results.top_k
+    return results
+
+
+def record_inference_metrics(classifier, seconds: float, images: int):
+    """Задержка вызова модели и число классифицированных изображений (метрики процесса)"""
+    backend = getattr(classifier, 'name', None) or "hf-pipeline"
+    metrics.observe('photo_selector_inference_seconds', seconds, backend=backend)
+    metrics.inc('photo_selector_images_classified_total', images, backend=backend)
+
+
+def classify_image(classifier, image, top_k: int = DEFAULT_TOP_K,
+                   full_probabilities: bool = False) -> InferenceRecord:
+    """Единственный прогон классификатора по изображению"""
+    start = time.perf_counter()
+    if not full_probabilities:
+        record = InferenceRecord(classifier(image, top_k=top_k))
+        record_inference_metrics(classifier, time.perf_counter() - start, 1)
+        return record
+
+    # Полный вектор: запрашиваем все метки за тот же единственный прогон
+    id2label = classifier.model.config.id2label
+    results = classifier(image, top_k=len(id2label))
+    record_inference_metrics(classifier, time.perf_counter() - start, 1)
+    label2id = {label: int(idx) for idx, label in id2label.items()}
+    probabilities = np.zeros(len(id2label), dtype=np.float32)
+    for item in results:
+        probabilities[label2id[item['label']]] = item['score']
+    return InferenceRecord(results[:top_k], probabilities=probabilities)
+
+
+def supports_pixel_values(classifier) -> bool:
+    """Можно ли подать в модель готовый тензор, минуя препроцессинг pipeline"""
+    if hasattr(classifier, 'predict_probabilities'):
+        return True
+    model = getattr(classifier, 'model', None)
+    return model is not None and hasattr(getattr(model, 'config', None), 'id2label')
+
+
+def records_from_probabilities(probabilities: np.ndarray, id2label: Dict,
+                               top_k: int = DEFAULT_TOP_K) -> List[InferenceRecord]:
+    """Пакет векторов вероятностей -> записи с топ-k метками (формат pipeline)"""
+    records = []
+    for row in probabilities:
+        top = np.argsort(row)[::-1][:top_k]
+        records.append(InferenceRecord(
+            [{'label': id2label[int(i)], 'score': float(row[i])} for i in top],
+            probabilities=row,
+        ))
+    return records
+
+
+class PixelValuesClassifier(ABC):
+    """Протокол бэкенда классификатора без HF pipeline (ONNX Runtime, TorchScript, фейк):
+    пакет NCHW (и, по желанию, пути файлов) -> вероятности по id2label.
+    Топ-k и формат pipeline строятся поверх predict_probabilities.
+    name/version попадают в статистику и отчеты. Бэкенд без predict_probabilities
+    не создается (TypeError при конструировании, а не посреди пакета)"""
+
+    name: str = "pixel-values"
+    version: str = "1"
+    id2label: Dict[int, str] = {}
+
+    @abstractmethod
+    def predict_probabilities(self, pixel_values: np.ndarray, paths: Optional[List[str]] = None) -> np.ndarray:
+        """Пакет NCHW float32 -> вероятности (N, len(id2label))"""
+
+    def __call__(self, images, top_k: int = DEFAULT_TOP_K, batch_size: Optional[int] = None):
+        """Совместимо с HF pipeline: одно изображение -> список, список -> список списков"""
+        single = not isinstance(images, (list, tuple))
+        images = [images] if single else list(images)
+        batch_size = batch_size or len(images) or 1
+
+        results: List[List[Dict]] = []
+        for offset in range(0, len(images), batch_size):
+            originals = images[offset:offset + batch_size]
+            chunk = [reduce_for_classifier(image) for image in originals]
+            paths = [getattr(image, 'filename', None) for image in originals]
+            probabilities = self.predict_probabilities(stack_pixel_values(chunk), paths)
+            results.extend(record.top_k for record in records_from_probabilities(probabilities, self.id2label, top_k))
+
+        return results[0] if single else results
+
+
+def pixel_values_probabilities(classifier, pixel_values: np.ndarray,
+                               paths: Optional[List[str]] = None) -> np.ndarray:
+    """Вероятности по id2label для нормализованного пакета NCHW"""
+    if hasattr(classifier, 'predict_probabilities'):
+        # Бэкенды без HF pipeline (ONNX Runtime, TorchScript, фейк, микропакеты)
+        return classifier.predict_probabilities(pixel_values, paths)
+
+    import torch
+
+    with torch.no_grad():
+        logits = classifier.model(pixel_values=torch.from_numpy(pixel_values)).logits
+    return torch.softmax(logits.float(), dim=-1).numpy()
+
+
+def classify_pixel_values(classifier, pixel_values: np.ndarray, top_k: int = DEFAULT_TOP_K,
+                          paths: Optional[List[str]] = None) -> List[InferenceRecord]:
+    """Прогон модели на уже нормализованном пакете NCHW (препроцессинг pipeline пропускается)"""
+    id2label = classifier.id2label if hasattr(classifier, 'predict_probabilities') else classifier.model.config.id2label
+    return records_from_probabilities(pixel_values_probabilities(classifier, pixel_values, paths), id2label, top_k)
+
+
+# ПАКЕТНЫЙ ИНФЕРЕНС ПО ИЗОБРАЖЕНИЯМ И ПАПКАМ
+
+DEFAULT_BATCH_SIZE = 16
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+
+
+def classifier_version(classifier) -> str:
+    """Имя и версия бэкенда классификатора (для HF pipeline - имя модели из config)"""
+    name = getattr(classifier, 'name', None)
+    if name:
+        return f"{name}:{getattr(classifier, 'version', '?')}"
+    config = getattr(getattr(classifier, 'model', None), 'config', None)
+    return f"hf-pipeline:{getattr(config, '_name_or_path', '?')}"
+
+
+def preprocess_tag(direct_tensors: bool, fast_decode: bool) -> str:
+    """Версия препроцессинга, с которой получена запись (часть ключа кэша инференса)"""
+    if direct_tensors:
+        return PREPROCESS_VERSION
+    # Препроцессинг HF pipeline: после уменьшенного декодирования или по полному изображению
+    return f"pipeline+{PREPROCESS_VERSION}" if fast_decode else "pipeline-full"
+
+
+def record_cache_key(model_key: str, preprocess: str, top_k: int = DEFAULT_TOP_K) -> str:
+    """Ключ записи в кэше: идентичность модели + препроцессинг + размер топ-k"""
+    return f"{model_key}|{preprocess}|top{top_k}"
+
+
+def find_image_files(input_folder: str) -> List[str]:
+    """Имена файлов изображений в папке (как в select_best_photos)"""
+    return [f for f in os.listdir(input_folder) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def iter_image_files(input_folder: str) -> Iterator[str]:
+    """Имена файлов изображений по одному, без списка всей папки (порядок как у find_image_files)"""
+    with os.scandir(input_folder) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.name
+
+
+class BatchInferenceEngine:
+    """Пакетный инференс: собирает изображения из многих папок в общие пакеты
+    и раздает записи обратно по папкам"""
+
+    def __init__(self, classifier, batch_size: int = DEFAULT_BATCH_SIZE, top_k: int = DEFAULT_TOP_K,
+                 fast_decode: bool = True, decode_backend: str = 'pil',
+                 cache=None, model_key: Optional[str] = None):
+        self.classifier = classifier
+        self.batch_size = max(1, batch_size)
+        self.top_k = top_k
+        # Быстрое декодирование: уменьшенный JPEG + собственная нормализация
+        self.fast_decode = fast_decode
+        self.decode_backend = decode_backend
+        self.direct_tensors = fast_decode and supports_pixel_values(classifier)
+        self.preprocess = preprocess_tag(self.direct_tensors, fast_decode)
+        # Постоянный кэш записей (InferenceCache): модель вызывается только для новых файлов
+        self.cache = cache if model_key else None
+        self.cache_key = record_cache_key(model_key, self.preprocess, top_k) if model_key else None
+        self.stats = {'images': 0, 'batches': 0, 'errors': 0, 'cache_hits': 0, 'seconds': 0.0}
+
+    def classify_batch(self, images: List, paths: Optional[List[str]] = None) -> List[InferenceRecord]:
+        """Один прогон модели на пакет изображений (пути нужны только бэкендам, которые их читают)"""
+        start = time.perf_counter()
+        if self.direct_tensors:
+            records = classify_pixel_values(self.classifier, stack_pixel_values(images), self.top_k, paths)
+        else:
+            results = self.classifier(images, top_k=self.top_k, batch_size=self.batch_size)
+            # Для одного изображения pipeline возвращает плоский список
+            if results and isinstance(results[0], dict):
+                results = [results]
+            records = [InferenceRecord(item) for item in results]
+        record_inference_metrics(self.classifier, time.perf_counter() - start, len(records))
+        return records
+
+    def _decode(self, path: str) -> DecodedImage:
+        if self.fast_decode:
+            return decode_image(path, self.decode_backend)
+        with Image.open(path) as img:
+            width, height = img.size
+            mode, img_format = img.mode, img.format
+            return DecodedImage(path, img.convert('RGB'), width, height, mode, img_format,
+                                os.path.getsize(path))
+
+    def _load(self, path: str):
+        return self._decode(path).image
+
+    def classify_paths(self, paths: List[str]) -> Dict[str, InferenceRecord]:
+        """Классифицирует файлы пакетами; возвращает {путь: запись}"""
+        records = {}
+        start = time.perf_counter()
+
+        if self.cache is not None:
+            for path, (record, _) in self.cache.lookup_many(paths, self.cache_key).items():
+                records[path] = record
+            self.stats['cache_hits'] += len(records)
+            paths = [path for path in paths if path not in records]
+
+        for offset in range(0, len(paths), self.batch_size):
+            chunk_paths = []
+            decoded = []
+            for path in paths[offset:offset + self.batch_size]:
+                try:
+                    decoded.append(self._decode(path))
+                    chunk_paths.append(path)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    print(f"   ⚠️ Не удалось прочитать {os.path.basename(path)}: {e}")
+
+            if not decoded:
+                continue
+            images = [item.image for item in decoded]
+
+            try:
+                batch_records = self.classify_batch(images, chunk_paths)
+                self.stats['batches'] += 1
+            except Exception as e:
+                # Пакет не прошел - классифицируем по одному, чтобы изолировать ошибку
+                print(f"   ⚠️ Ошибка пакетного инференса ({e}), перехожу на поштучный режим")
+                batch_records = []
+                for path, image in zip(chunk_paths, images):
+                    try:
+                        batch_records.append(self.classify_batch([image], [path])[0])
+                        self.stats['batches'] += 1
+                    except Exception:
+                        self.stats['errors'] += 1
+                        batch_records.append(None)
+
+            classified = []
+            for path, item, record in zip(chunk_paths, decoded, batch_records):
+                if record is not None:
+                    records[path] = record
+                    classified.append((path, record, item))
+                    self.stats['images'] += 1
+            if self.cache is not None and classified:
+                self.cache.store_many(classified, self.cache_key)
+
+        self.stats['seconds'] += time.perf_counter() - start
+        return records
+
+    def classify_folders(self, folders: List[str]) -> Dict[str, Dict[str, InferenceRecord]]:
+        """Классифицирует изображения сразу из многих папок (например, fotos/*/big);
+        пакеты формируются через границы папок, результаты возвращаются по папкам"""
+        owners = {}
+        paths = []
+        for folder in folders:
+            if not os.path.isdir(folder):
+                continue
+            for filename in find_image_files(folder):
+                path = os.path.join(folder, filename)
+                owners[path] = folder
+                paths.append(path)
+
+        by_folder = {folder: {} for folder in folders}
+        for path, record in self.classify_paths(paths).items():
+            by_folder[owners[path]][path] = record
+        return by_folder
+
+    def record_run(self, images: int = 0, cache_hits: int = 0, seconds: float = 0.0):
+        """Учитывает изображения, классифицированные вне classify_paths (конвейер photo_pipeline)"""
+        self.stats['images'] += images
+        self.stats['cache_hits'] += cache_hits
+        self.stats['seconds'] += seconds
+
+    def get_stats(self) -> Dict:
+        """Статистика прогона, включая пропускную способность (изобр./с)"""
+        seconds = self.stats['seconds']
+        return {
+            'backend': classifier_version(self.classifier),
+            'batch_size': self.batch_size,
+            'fast_decode': self.fast_decode,
+            'images': self.stats['images'],
+            'batches': self.stats['batches'],
+            'cache_hits': self.stats['cache_hits'],
+            'errors': self.stats['errors'],
+            'seconds': round(seconds, 3),
+            'images_per_sec': round(self.stats['images'] / seconds, 2) if seconds > 0 else 0.0,
+        }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(f"⚡ Пакетный инференс: {stats['images']} изображений, {stats['batches']} пакетов "
+              f"(размер {stats['batch_size']}), {stats['seconds']:.2f} с, "
+              f"{stats['images_per_sec']:.2f} изобр./с"
+              + (f", из кэша {stats['cache_hits']}" if stats['cache_hits'] else ""))
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ПОСТОЯННЫЙ КЭШ РЕЗУЛЬТАТОВ КЛАССИФИКАТОРА (SQLite)
+Ключ записи: SHA-256 содержимого файла + идентичность модели (путь, бэкенд,
+отпечаток весов) + версия препроцессинга. Повторный прогон по тому же
+дереву fotos/ после правки правил не вызывает модель для неизмененных фото.
+Хэш не пересчитывается, если размер и mtime файла не изменились.
+Вместе с результатом хранятся размеры и режим исходного изображения,
+поэтому оценку можно пересчитать вообще без чтения файла.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from image_decoder import DecodedImage
+from fake_backend import fake_script_file
+from inference import InferenceRecord
+from metrics import metrics
+
+DEFAULT_CACHE_PATH = "cache/inference_cache.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    content_hash TEXT PRIMARY KEY,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    mode TEXT,
+    format TEXT,
+    file_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    content_hash TEXT NOT NULL,
+    model_key TEXT NOT NULL,
+    top_k TEXT NOT NULL,
+    probabilities BLOB,
+    created REAL NOT NULL,
+    PRIMARY KEY (content_hash, model_key)
+);
+"""
+
+
+def model_identity(model_path: str, backend: str) -> str:
+    """Идентичность модели: путь + бэкенд + отпечаток config.json и файла весов
+    (для фейкового бэкенда - отпечаток сценария)"""
+    digest = hashlib.sha1()
+    for config_file in (os.path.join(model_path, "config.json"), fake_script_file(model_path)):
+        if config_file and os.path.exists(config_file):
+            with open(config_file, 'rb') as f:
+                digest.update(f.read())
+    # Исходный .bin важнее: model.safetensors рядом с ним - конвертация model_loader, идентичность не меняется
+    for weights in ("pytorch_model.bin", "model.safetensors"):
+        weights_file = os.path.join(model_path, weights)
+        if os.path.exists(weights_file):
+            stat = os.stat(weights_file)
+            digest.update(f"{weights}:{stat.st_size}:{int(stat.st_mtime)}".encode())
+            break
+    return f"{os.path.normpath(model_path)}|{backend}|{digest.hexdigest()[:12]}"
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InferenceCache:
+    """Кэш записей InferenceRecord на диске; потокобезопасен, общий для процессов (WAL)"""
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Счетчики одного прогона"""
+        with self._lock:
+            self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'hashed': 0, 'stat_shortcuts': 0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ХЭШ СОДЕРЖИМОГО
+
+    def cached_hash(self, path: str, stat: Optional[os.stat_result] = None) -> Optional[str]:
+        """Хэш из таблицы files, если размер и mtime файла не изменились (файл не читается);
+        stat - уже полученный вызывающим os.stat(path)"""
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, content_hash FROM files WHERE path = ?",
+                                     (os.path.abspath(path),)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        return None
+
+    def content_hash(self, path: str, data: Optional[bytes] = None,
+                     stat: Optional[os.stat_result] = None) -> str:
+        """SHA-256 файла; при неизменных размере и mtime берется из таблицы files"""
+        stat = stat or os.stat(path)
+        content_hash = self.cached_hash(path, stat)
+        if content_hash is not None:
+            with self._lock:
+                self.stats['stat_shortcuts'] += 1
+            return content_hash
+
+        content_hash = hash_bytes(data) if data is not None else hash_file(path)
+        with self._lock:
+            self.stats['hashed'] += 1
+            self._conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash) "
+                               "VALUES (?, ?, ?, ?)",
+                               (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, content_hash))
+            self._conn.commit()
+        return content_hash
+
+    # ЧТЕНИЕ И ЗАПИСЬ
+
+    def lookup(self, path: str, model_key: str, data: Optional[bytes] = None,
+               stat: Optional[os.stat_result] = None) -> Tuple[Optional[InferenceRecord], Optional[DecodedImage]]:
+        """Запись и метаданные изображения из кэша (None, None при промахе)"""
+        found = self.lookup_many([path], model_key, {path: data} if data is not None else None,
+                                 {path: stat} if stat is not None else None)
+        return found.get(path, (None, None))
+
+    def lookup_many(self, paths: Iterable[str], model_key: str, data: Optional[Dict[str, bytes]] = None,
+                    stats: Optional[Dict[str, os.stat_result]] = None
+                    ) -> Dict[str, Tuple[InferenceRecord, DecodedImage]]:
+        """{путь: (запись, метаданные)} для найденных файлов; промахи учитываются в статистике"""
+        found = {}
+        paths = list(paths)
+        for path in paths:
+            try:
+                content_hash = self.content_hash(path, (data or {}).get(path), (stats or {}).get(path))
+            except OSError:
+                continue
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT r.top_k, r.probabilities, i.width, i.height, i.mode, i.format, i.file_size "
+                    "FROM records r JOIN images i ON i.content_hash = r.content_hash "
+                    "WHERE r.content_hash = ? AND r.model_key = ?", (content_hash, model_key)).fetchone()
+            if row is None:
+                continue
+            top_k, blob, width, height, mode, img_format, file_size = row
+            probabilities = np.frombuffer(blob, dtype=np.float32).copy() if blob else None
+            record = InferenceRecord(json.loads(top_k), probabilities=probabilities, invocations=0)
+            meta = DecodedImage(path, None, width, height, mode, img_format, file_size)
+            found[path] = (record, meta)
+
+        with self._lock:
+            self.stats['hits'] += len(found)
+            self.stats['misses'] += len(paths) - len(found)
+        metrics.inc('photo_selector_inference_cache_lookups_total', len(found), result="hit")
+        metrics.inc('photo_selector_inference_cache_lookups_total', len(paths) - len(found), result="miss")
+        return found
+
+    def store(self, path: str, model_key: str, record: InferenceRecord, meta: DecodedImage,
+              data: Optional[bytes] = None):
+        self.store_many([(path, record, meta)], model_key, {path: data} if data is not None else None)
+
+    def store_many(self, items: List[Tuple[str, InferenceRecord, DecodedImage]], model_key: str,
+                   data: Optional[Dict[str, bytes]] = None):
+        """Сохраняет записи одного пакета одной транзакцией"""
+        rows = []
+        for path, record, meta in items:
+            try:
+                content_hash = self.content_hash(path, (data or {}).get(path))
+            except OSError:
+                continue
+            blob = (record.probabilities.astype(np.float32).tobytes()
+                    if record.probabilities is not None else None)
+            rows.append((content_hash, meta, json.dumps(record.top_k), blob))
+
+        if not rows:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO images (content_hash, width, height, mode, format, file_size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(h, m.width, m.height, m.mode, m.format, m.file_size) for h, m, _, _ in rows])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records (content_hash, model_key, top_k, probabilities, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(h, model_key, top_k, blob, now) for h, _, top_k, blob in rows])
+            self._conn.commit()
+            self.stats['stores'] += len(rows)
+
+    # СТАТИСТИКА
+
+    def counters(self) -> Dict[str, int]:
+        """Снимок счетчиков: get_stats(since=снимок) - статистика только после него (одна папка)"""
+        with self._lock:
+            return dict(self.stats)
+
+    def get_stats(self, since: Optional[Dict[str, int]] = None) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            entries = self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        if since:
+            stats = {key: value - since.get(key, 0) for key, value in stats.items()}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['entries'] = entries
+        stats['db_path'] = self.db_path
+        return stats
+
+    def print_stats(self, since: Optional[Dict[str, int]] = None):
+        stats = self.get_stats(since)
+        print(f"🗄️ Кэш инференса: попаданий {stats['hits']}, промахов {stats['misses']} "
+              f"({stats['hit_rate'] * 100:.0f}%), сохранено {stats['stores']}, "
+              f"хэшировано файлов {stats['hashed']}, без хэширования (size+mtime) {stats['stat_shortcuts']}")
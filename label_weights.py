@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ВЕКТОРЫ ВЕСОВ КЛЮЧЕВЫХ СЛОВ ПО МЕТКАМ МОДЕЛИ
+Словари ключевых слов селектора (MAIN_PRODUCT_KEYWORDS, DETAIL_KEYWORDS,
+FRONT_VIEW_INDICATORS, BACK_VIEW_INDICATORS) один раз компилируются в
+векторы длины len(id2label): вес метки = вес первого ключевого слова,
+входящего в метку (та же логика, что у цикла `keyword in label` + break).
+После этого оценки правил (только по топ-5 меткам, как в цикле) считаются
+умножением матрицы вероятностей пакета на вектор вместо вложенных циклов.
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Скомпилированные векторы на процесс: ключ - (метки, таблицы ключевых слов)
+_cache: Dict[Tuple, 'LabelWeights'] = {}
+_cache_lock = threading.Lock()
+
+
+def compile_keyword_vector(keywords: Dict[str, float], labels: List[str]) -> np.ndarray:
+    """Вектор весов по меткам: первое совпавшее ключевое слово (порядок словаря)"""
+    vector = np.zeros(len(labels), dtype=np.float32)
+    for index, label in enumerate(labels):
+        for keyword, weight in keywords.items():
+            if keyword in label:
+                vector[index] = weight
+                break
+    return vector
+
+
+class LabelWeights:
+    """Матрица весов ключевых слов (L, T) для таблиц селектора"""
+
+    def __init__(self, id2label: Dict[int, str], tables: Dict[str, Dict[str, float]]):
+        self.labels = [id2label[index].lower() for index in range(len(id2label))]
+        self.label2id = {label: index for index, label in enumerate(self.labels)}
+        self.names = list(tables)
+        self.matrix = np.stack([compile_keyword_vector(tables[name], self.labels) for name in self.names], axis=1)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def vector(self, name: str) -> np.ndarray:
+        return self.matrix[:, self.names.index(name)]
+
+    def weight(self, name: str, label: str) -> float:
+        """Вес одной метки (для текстового анализа топ-k)"""
+        index = self.label2id.get(label.lower())
+        return round(float(self.vector(name)[index]), 4) if index is not None else 0.0
+
+    def top_k_mask(self, top_k_labels: List[List[str]]) -> np.ndarray:
+        """Маска (N, L) по спискам топ-k меток записей (при равных вероятностях - те же метки, что в цикле)"""
+        mask = np.zeros((len(top_k_labels), len(self.labels)), dtype=np.float32)
+        for row, labels in enumerate(top_k_labels):
+            for label in labels:
+                index = self.label2id.get(label.lower())
+                if index is not None:
+                    mask[row, index] = 1.0
+        return mask
+
+    def masked_scores(self, probabilities: np.ndarray,
+                      mask: np.ndarray) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        """Оценки правил только по меткам маски, как цикл правил по топ-5:
+        Σ вероятность * вес (товар, передний вид) и Σ вес (штрафы)"""
+        probabilities = np.atleast_2d(probabilities).astype(np.float32, copy=False)
+        weighted = (mask * probabilities) @ self.matrix
+        counted = mask @ self.matrix
+        return ({name: weighted[:, column] for column, name in enumerate(self.names)},
+                {name: counted[:, column] for column, name in enumerate(self.names)})
+
+
+def classifier_id2label(classifier) -> Optional[Dict[int, str]]:
+    """id2label классификатора (HF pipeline, ONNX, TorchScript) или None"""
+    id2label = getattr(classifier, 'id2label', None)
+    if id2label is None:
+        config = getattr(getattr(classifier, 'model', None), 'config', None)
+        id2label = getattr(config, 'id2label', None)
+    if not id2label:
+        return None
+    return {int(index): label for index, label in id2label.items()}
+
+
+def compiled_label_weights(id2label: Dict[int, str], tables: Dict[str, Dict[str, float]]) -> LabelWeights:
+    """Векторы весов из кэша процесса (компилируются один раз на модель и таблицы)"""
+    key = (tuple(id2label[index] for index in range(len(id2label))),
+           tuple((name, tuple(table.items())) for name, table in tables.items()))
+    with _cache_lock:
+        weights = _cache.get(key)
+        if weights is None:
+            weights = LabelWeights(id2label, tables)
+            _cache[key] = weights
+        return weights
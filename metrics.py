@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+МЕТРИКИ В ФОРМАТЕ PROMETHEUS (text exposition 0.0.4)
+Счетчики, гистограммы и датчики процесса без внешних зависимостей:
+загрузки, ожидание и выполнение задач Celery, классифицированные
+изображения, задержка инференса, попадания в кэш, загрузки моделей, RSS.
+
+Flask отдает /metrics сам; воркер Celery поднимает отдельный HTTP-экспортер
+(PHOTO_SELECTOR_METRICS_PORT, по умолчанию 9808). У prefork-воркера задачи
+выполняются в дочерних процессах: каждый периодически пишет снимок своих
+метрик в PHOTO_SELECTOR_METRICS_DIR, экспортер суммирует снимки своей роли.
+"""
+
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_DIR_ENV = "PHOTO_SELECTOR_METRICS_DIR"
+METRICS_PORT_ENV = "PHOTO_SELECTOR_METRICS_PORT"
+DEFAULT_METRICS_PORT = 9808
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы гистограмм, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TASK_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Имя -> (тип, описание, границы гистограммы)
+DEFINITIONS = {
+    'photo_selector_uploads_total': ('counter', "Запросов загрузки фото", None),
+    'photo_selector_upload_files_total': ('counter', "Загруженных файлов", None),
+    'photo_selector_upload_bytes_total': ('counter', "Загруженных байт", None),
+    'photo_selector_upload_seconds': ('histogram', "Время обработки запроса загрузки", LATENCY_BUCKETS),
+    'photo_selector_queue_depth': ('gauge', "Задач в очереди брокера", None),
+    'photo_selector_tasks_total': ('counter', "Завершенных задач анализа по статусу", None),
+    'photo_selector_task_queue_wait_seconds': ('histogram', "Ожидание задачи в очереди", TASK_BUCKETS),
+    'photo_selector_task_run_seconds': ('histogram', "Время выполнения задачи", TASK_BUCKETS),
+    'photo_selector_images_classified_total': ('counter', "Изображений, прошедших через модель", None),
+    'photo_selector_inference_seconds': ('histogram', "Задержка одного вызова модели (пакет)", LATENCY_BUCKETS),
+    'photo_selector_inference_cache_lookups_total': ('counter', "Поисков в кэше инференса по результату", None),
+    'photo_selector_model_loads_total': ('counter', "Загрузок моделей реестром", None),
+    'photo_selector_model_load_seconds_total': ('counter', "Суммарное время загрузки моделей", None),
+    'photo_selector_micro_batch_size': ('histogram', "Изображений в микропакете инференса", BATCH_BUCKETS),
+    'photo_selector_micro_batch_wait_seconds': ('histogram', "Ожидание запроса в очереди микропакетов", LATENCY_BUCKETS),
+    'photo_selector_micro_batch_images_total': ('counter', "Изображений, прошедших через микропакеты", None),
+    'photo_selector_worker_warmup_seconds': ('histogram', "Прогрев модели в процессе воркера", TASK_BUCKETS),
+    'photo_selector_worker_ready': ('gauge', "Воркер прогрет и принимает задачи", None),
+    'process_resident_memory_bytes': ('gauge', "Резидентная память процесса", None),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+
+def resident_memory_bytes() -> int:
+    """Текущий RSS из /proc (вне Linux - пиковый RSS из getrusage)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _registry_samples() -> List[Tuple[str, Dict, float]]:
+    """Загрузки моделей из реестра процесса (считываются в момент сбора)"""
+    from model_registry import model_registry
+    samples = []
+    for key, item in model_registry.get_stats().items():
+        model_path, backend = key.rsplit('|', 1)
+        labels = {'model': os.path.basename(model_path.rstrip('/')), 'backend': backend}
+        samples.append(('photo_selector_model_loads_total', labels, item['loads']))
+        samples.append(('photo_selector_model_load_seconds_total', labels, item['load_time_sec']))
+    return samples
+
+
+def _process_samples() -> List[Tuple[str, Dict, float]]:
+    return [('process_resident_memory_bytes', {}, resident_memory_bytes())]
+
+
+class MetricsRegistry:
+    """Метрики процесса; inc/observe/set потокобезопасны и дешевы (словарь под блокировкой)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], List] = {}
+        self._collectors: List[Callable[[], List[Tuple[str, Dict, float]]]] = [_registry_samples, _process_samples]
+        self.role = "main"
+        self.directory: Optional[str] = None
+        self._writer: Optional[threading.Thread] = None
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._values[(name, _label_key(labels))] = float(value)
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = DEFINITIONS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, Dict, float]]]):
+        """Функция, возвращающая [(имя, метки, значение)] в момент сбора (например, длина очереди)"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    # СНИМКИ ДЛЯ МНОГОПРОЦЕССНОГО РЕЖИМА
+
+    def snapshot(self) -> Dict:
+        """Состояние процесса в JSON-совместимом виде (вместе с собранными датчиками)"""
+        collected = []
+        for collector in list(self._collectors):
+            try:
+                collected.extend(collector())
+            except Exception:
+                pass
+        with self._lock:
+            values = [[name, list(map(list, labels)), value] for (name, labels), value in self._values.items()]
+            histograms = [[name, list(map(list, labels)), list(state[0]), state[1], state[2]]
+                          for (name, labels), state in self._histograms.items()]
+        values += [[name, sorted([key, str(value)] for key, value in labels.items()), value]
+                   for name, labels, value in collected]
+        return {'role': self.role, 'pid': os.getpid(), 'timestamp': time.time(),
+                'values': values, 'histograms': histograms}
+
+    def write_snapshot(self, directory: str):
+        """Атомарно пишет снимок в <directory>/<роль>-<pid>.json"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.role}-{os.getpid()}.json")
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def configure(self, role: str, directory: Optional[str] = None, interval: float = 15.0):
+        """Роль процесса (web/worker) и, если задана папка, периодическая запись снимков"""
+        self.role = role
+        self.directory = directory or os.environ.get(METRICS_DIR_ENV)
+        if not self.directory or self._writer is not None:
+            return
+
+        def write_forever():
+            while True:
+                self.flush()
+                time.sleep(interval)
+
+        self._writer = threading.Thread(target=write_forever, name="metrics-snapshot", daemon=True)
+        self._writer.start()
+
+    def flush(self):
+        """Внеочередная запись снимка (например, сразу после задачи)"""
+        if self.directory:
+            try:
+                self.write_snapshot(self.directory)
+            except OSError:
+                pass
+
+    @staticmethod
+    def read_snapshots(directory: Optional[str], role: str, max_gauge_age: float = 60.0) -> List[Dict]:
+        """Снимки других процессов той же роли; датчики из устаревших снимков отбрасываются"""
+        if not directory or not os.path.isdir(directory):
+            return []
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not filename.startswith(f"{role}-") or not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot.get('pid') == os.getpid():
+                continue
+            snapshot['stale'] = time.time() - snapshot.get('timestamp', 0) > max_gauge_age
+            snapshots.append(snapshot)
+        return snapshots
+
+    # ФОРМАТ PROMETHEUS
+
+    def render(self, directory: Optional[str] = None) -> str:
+        """Текст для /metrics: метрики процесса + снимки процессов той же роли.
+        Счетчики и гистограммы суммируются, датчики получают метку pid"""
+        own = self.snapshot()
+        snapshots = [own] + self.read_snapshots(directory or self.directory, self.role)
+        multiprocess = len(snapshots) > 1
+
+        values: Dict[Tuple[str, LabelKey], float] = {}
+        histograms: Dict[Tuple[str, LabelKey], List] = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['values']:
+                kind = DEFINITIONS.get(name, ('gauge',))[0]
+                if kind == 'gauge':
+                    if snapshot.get('stale'):
+                        continue
+                    if multiprocess:
+                        labels = labels + [['pid', str(snapshot['pid'])]]
+                key = (name, tuple(sorted(tuple(item) for item in labels)))
+                values[key] = values.get(key, 0.0) + value if kind != 'gauge' else value
+            for name, labels, counts, total, count in snapshot['histograms']:
+                key = (name, tuple(tuple(item) for item in labels))
+                state = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+
+        lines = []
+        for name, (kind, help_text, buckets) in DEFINITIONS.items():
+            samples = [(labels, value) for (metric, labels), value in values.items() if metric == name]
+            series = [(labels, state) for (metric, labels), state in histograms.items() if metric == name]
+            if not samples and not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(samples):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for labels, (counts, total, count) in sorted(series):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Единый реестр метрик на процесс
+metrics = MetricsRegistry()
+
+
+def serve_metrics(port: Optional[int] = None, host: str = "0.0.0.0") -> threading.Thread:
+    """HTTP-экспортер /metrics в фоновом потоке (для процессов без Flask, например воркера Celery)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    port = port if port is not None else int(os.environ.get(METRICS_PORT_ENV, DEFAULT_METRICS_PORT))
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    print(f"📈 Метрики: http://{host}:{port}/metrics")
+    return thread
+
+
+def redis_queue_depth(broker_url: str, queue: str = "celery") -> Callable[[], List[Tuple[str, Dict, float]]]:
+    """Сборщик длины очереди Celery в Redis (пусто, если redis не установлен или недоступен)"""
+    client = None
+
+    def collect():
+        nonlocal client
+        if not broker_url.startswith(('redis://', 'rediss://')):
+            return []
+        try:
+            if client is None:
+                import redis
+                client = redis.Redis.from_url(broker_url, socket_timeout=0.5)
+            return [('photo_selector_queue_depth', {'queue': queue}, client.llen(queue))]
+        except Exception:
+            return []
+
+    return collect
+
+
+def install_celery_metrics(celery_app):
+    """Сигналы Celery: метка времени постановки в очередь, ожидание и время выполнения задач,
+    экспортер метрик в воркере и запись снимков дочерними процессами"""
+    from celery import signals
+
+    started: Dict[str, float] = {}
+
+    @signals.before_task_publish.connect(weak=False)
+    def stamp_enqueue_time(headers=None, **kwargs):
+        if headers is not None:
+            headers.setdefault('enqueued_at', time.time())
+
+    @signals.task_prerun.connect(weak=False)
+    def task_started(task_id=None, task=None, **kwargs):
+        started[task_id] = time.perf_counter()
+        enqueued_at = task.request.get('enqueued_at') if task is not None else None
+        if enqueued_at:
+            metrics.observe('photo_selector_task_queue_wait_seconds', max(0.0, time.time() - float(enqueued_at)),
+                            task=task.name)
+
+    @signals.task_postrun.connect(weak=False)
+    def task_finished(task_id=None, task=None, retval=None, state=None, **kwargs):
+        start = started.pop(task_id, None)
+        name = task.name if task is not None else "unknown"
+        status = (state or "unknown").lower()
+        if isinstance(retval, dict) and retval.get('success') is False:
+            status = "error"
+        metrics.inc('photo_selector_tasks_total', task=name, status=status)
+        if start is not None:
+            metrics.observe('photo_selector_task_run_seconds', time.perf_counter() - start, task=name)
+        metrics.flush()
+
+    @signals.worker_init.connect(weak=False)
+    def start_exporter(**kwargs):
+        # Общая папка снимков для дочерних процессов; снимки прошлого запуска воркера удаляются
+        directory = os.environ.setdefault(METRICS_DIR_ENV,
+                                          os.path.join(tempfile.gettempdir(), "photo_selector_metrics"))
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.startswith("worker-"):
+                    os.remove(os.path.join(directory, filename))
+        metrics.configure("worker")
+        try:
+            serve_metrics()
+        except OSError as e:
+            print(f"⚠️ Экспортер метрик не запущен: {e}")
+
+    @signals.worker_process_init.connect(weak=False)
+    def child_snapshots(**kwargs):
+        # Дочерний процесс prefork: свои метрики пишет в общую папку, экспортер родителя их суммирует
+        metrics._writer = None
+        metrics.configure("worker", interval=5.0)
+
+    return celery_app
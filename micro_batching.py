@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+МИКРОПАКЕТЫ ИНФЕРЕНСА ДЛЯ ПАРАЛЛЕЛЬНЫХ ЗАДАЧ
+Несколько задач одного процесса (воркер Celery с --pool threads, потоки
+веб-приложения) не гоняют модель каждая своими маленькими пакетами:
+запросы встают в общую очередь, один поток собирает их в микропакет
+(до max_batch_size изображений или max_wait_ms ожидания), вызывает модель
+один раз и раздает вероятности обратно вызывающим.
+
+Включается переменной PHOTO_SELECTOR_MICRO_BATCH (размер пакета, 0 - выкл.),
+ожидание - PHOTO_SELECTOR_MICRO_BATCH_WAIT_MS. Обертка соблюдает протокол
+PixelValuesClassifier, поэтому селекторы и BatchInferenceEngine работают без изменений.
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from image_decoder import CLASSIFIER_SIZE
+from inference import PixelValuesClassifier, pixel_values_probabilities
+from label_weights import classifier_id2label
+from metrics import metrics
+
+MICRO_BATCH_ENV = "PHOTO_SELECTOR_MICRO_BATCH"
+MICRO_BATCH_WAIT_ENV = "PHOTO_SELECTOR_MICRO_BATCH_WAIT_MS"
+DEFAULT_MAX_WAIT_MS = 10.0
+REQUEST_TIMEOUT = 300.0  # секунды ожидания ответа микропакета (очередь + прогон модели)
+# Все запросы микропакета склеиваются в один тензор: формат одного изображения общий
+INPUT_SHAPE = (3, CLASSIFIER_SIZE, CLASSIFIER_SIZE)
+
+
+class _Request:
+    """Запрос одного вызывающего: пакет NCHW и место для ответа"""
+
+    __slots__ = ('pixel_values', 'paths', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, pixel_values: np.ndarray, paths: Optional[List[str]]):
+        self.pixel_values = pixel_values
+        self.paths = paths
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+
+    def __len__(self):
+        return len(self.pixel_values)
+
+
+class MicroBatchingClassifier(PixelValuesClassifier):
+    """Классификатор-обертка: общая очередь и микропакеты поверх модели процесса"""
+
+    def __init__(self, classifier, max_batch_size: int = 16, max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+                 timeout: float = REQUEST_TIMEOUT):
+        self.classifier = classifier
+        config = getattr(getattr(classifier, 'model', None), 'config', None)
+        # Имя и версия как у исходной модели: те же метки метрик и ключи кэша
+        self.name = getattr(classifier, 'name', None) or "hf-pipeline"
+        self.version = getattr(classifier, 'version', None) or getattr(config, '_name_or_path', '?')
+        self.id2label = classifier_id2label(classifier) or {}
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.timeout = timeout
+        self.stats = {'requests': 0, 'images': 0, 'batches': 0, 'errors': 0, 'queue_seconds': 0.0}
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._carry: Optional[_Request] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+
+    def __getattr__(self, name):
+        # model, config и прочее - от исходного классификатора (classify_image, отчеты)
+        classifier = self.__dict__.get('classifier')
+        if classifier is None:
+            raise AttributeError(name)
+        return getattr(classifier, name)
+
+    def _ensure_thread(self):
+        # Поток запускается лениво и заново после fork (в дочернем процессе потоков родителя нет)
+        # или если он неожиданно завершился
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._carry = None
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def predict_probabilities(self, pixel_values: np.ndarray, paths: Optional[List[str]] = None) -> np.ndarray:
+        """Ставит пакет в общую очередь и ждет свою часть результата микропакета"""
+        if pixel_values.ndim != 4 or tuple(pixel_values.shape[1:]) != INPUT_SHAPE:
+            raise ValueError(f"Пакет должен иметь форму [N, {', '.join(map(str, INPUT_SHAPE))}], "
+                             f"получено {list(pixel_values.shape)}")
+        if len(pixel_values) == 0:
+            return np.zeros((0, len(self.id2label)), dtype=np.float32)
+        self._ensure_thread()
+        request = _Request(pixel_values, paths)
+        self._queue.put(request)
+        if not request.done.wait(self.timeout):
+            raise TimeoutError(f"Микропакет не обработан за {self.timeout:.0f} с")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self) -> List[_Request]:
+        """Первый запрос - без ограничения ожидания, остальные - до заполнения пакета или max_wait"""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        batch, size = [first], len(first)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(request) > self.max_batch_size:
+                self._carry = request  # не переполняем пакет: запрос пойдет первым в следующий
+                break
+            batch.append(request)
+            size += len(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch = self._collect()
+                started = time.perf_counter()
+                for request in batch:
+                    wait = started - request.enqueued_at
+                    self.stats['queue_seconds'] += wait
+                    metrics.observe('photo_selector_micro_batch_wait_seconds', wait, backend=self.name)
+                self._run_batch(batch)
+            except Exception as e:
+                # Поток переживает любую ошибку: вызывающие получают ее, а не ждут вечно
+                self.stats['errors'] += 1
+                for request in batch:
+                    if not request.done.is_set():
+                        request.error = e
+                        request.done.set()
+
+    def _run_batch(self, batch: List[_Request]):
+        """Один вызов модели на весь микропакет, ответы - по срезам"""
+        try:
+            pixel_values = batch[0].pixel_values if len(batch) == 1 else np.concatenate(
+                [request.pixel_values for request in batch])
+            paths = []
+            for request in batch:
+                paths.extend(request.paths or [None] * len(request))
+            probabilities = pixel_values_probabilities(self.classifier, pixel_values, paths)
+        except Exception as e:
+            self.stats['errors'] += 1
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        self.stats['requests'] += len(batch)
+        self.stats['images'] += len(pixel_values)
+        self.stats['batches'] += 1
+        metrics.observe('photo_selector_micro_batch_size', len(pixel_values), backend=self.name)
+        metrics.inc('photo_selector_micro_batch_images_total', len(pixel_values), backend=self.name)
+        offset = 0
+        for request in batch:
+            request.result = probabilities[offset:offset + len(request)]
+            offset += len(request)
+            request.done.set()
+
+    def get_stats(self) -> Dict:
+        batches = self.stats['batches']
+        return {
+            **self.stats,
+            'queue_seconds': round(self.stats['queue_seconds'], 3),
+            'avg_batch_size': round(self.stats['images'] / batches, 2) if batches else 0.0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+        }
+
+
+_batchers: Dict[int, MicroBatchingClassifier] = {}
+_batchers_lock = threading.Lock()
+
+
+def micro_batch_settings() -> Optional[Dict]:
+    """Настройки из окружения или None, если микропакеты выключены"""
+    max_batch_size = int(os.environ.get(MICRO_BATCH_ENV, "0") or 0)
+    if max_batch_size <= 1:
+        return None
+    return {
+        'max_batch_size': max_batch_size,
+        'max_wait_ms': float(os.environ.get(MICRO_BATCH_WAIT_ENV, DEFAULT_MAX_WAIT_MS)),
+    }
+
+
+def micro_batched(classifier):
+    """Общая для процесса обертка над моделью (или сама модель, если микропакеты выключены)"""
+    settings = micro_batch_settings()
+    if settings is None or isinstance(classifier, MicroBatchingClassifier):
+        return classifier
+    with _batchers_lock:
+        batcher = _batchers.get(id(classifier))
+        if batcher is None or batcher.classifier is not classifier:
+            batcher = MicroBatchingClassifier(classifier, **settings)
+            _batchers[id(classifier)] = batcher
+        return batcher
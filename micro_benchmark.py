@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+МИКРОБЕНЧМАРКИ ГОРЯЧИХ ПУТЕЙ ОЦЕНКИ И ВЫБОРА
+Синтетические изображения заданных размеров/форматов + фейковый
+классификатор (1000 меток, как у ImageNet), поэтому модель не нужна.
+Каждая функция измеряется отдельно: декодирование, метаданные, оценка,
+выбор, категория товара. Базовые значения локальные: первый прогон на
+машине записывает micro_benchmark_baseline.json (в репозиторий не
+попадает), следующие печатают таблицу сравнения с ним.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from universal_smart_selector import UniversalSmartSelector
+from fake_backend import DEFAULT_SCRIPT, FakeImageClassifier
+from image_decoder import DecodedImage, decode_image, PREPROCESS_VERSION
+from inference import InferenceRecord, classify_pixel_values
+from synthetic_images import make_image, image_filename
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_benchmark_baseline.json")
+
+# Изображения: имя -> (ширина, высота, формат)
+IMAGE_SPECS = {
+    'jpeg-800': (800, 800, 'JPEG'),
+    'jpeg-2000': (2000, 2000, 'JPEG'),
+    'jpeg-4000': (4000, 4000, 'JPEG'),
+    'png-1200x900': (1200, 900, 'PNG'),
+}
+# Фотографий в папке для бенчмарков выбора
+FOLDER_PHOTOS = 10
+# Замедление относительно базы, после которого строка помечается регрессией
+REGRESSION_THRESHOLD = 1.25
+
+
+def stub_classifier(labels: int = 1000) -> FakeImageClassifier:
+    """Фейковый классификатор со словарем размера ImageNet (метки сценария + заполнители)"""
+    script = dict(DEFAULT_SCRIPT)
+    script['labels'] = DEFAULT_SCRIPT['labels'] + [f"synthetic label {index}"
+                                                   for index in range(labels - len(DEFAULT_SCRIPT['labels']))]
+    return FakeImageClassifier(script=script)
+
+
+def measure(fn: Callable, min_time: float = 0.2, repeat: int = 5) -> Dict:
+    """Медиана времени одного вызова (мкс) по repeat сериям примерно по min_time/repeat секунд"""
+    fn()  # прогрев
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 2
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number * 1e6)
+    return {'us_per_call': round(statistics.median(samples), 2), 'min_us': round(min(samples), 2),
+            'calls': number * repeat}
+
+
+def quiet(fn: Callable) -> Callable:
+    """Вызов без печати (функции выбора подробно печатают ход рассуждений)"""
+    def wrapped():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return wrapped
+
+
+class MicroBenchmarks:
+    """Набор бенчмарков: имя -> функция без аргументов"""
+
+    def __init__(self, workdir: str):
+        self.workdir = workdir
+        self.classifier = stub_classifier()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.universal = UniversalSmartSelector()
+        self.selector = self.universal.base_selector
+        self.selector.classifier = self.classifier
+        self.selector.label_weights = self.selector.compile_label_weights(self.classifier)
+
+        self.images = {name: make_image(os.path.join(workdir, f"{name}{os.path.splitext(image_filename(0, fmt))[1]}"),
+                                        width, height, fmt, seed=index)
+                       for index, (name, (width, height, fmt)) in enumerate(IMAGE_SPECS.items())}
+
+        # Записи инференса: разные сценарии фейка (по хэшу пикселей)
+        rng = np.random.default_rng(0)
+        pixel_values = rng.normal(0, 1, (FOLDER_PHOTOS, 3, 8, 8)).astype(np.float32)
+        self.records = classify_pixel_values(self.classifier, pixel_values)
+        self.record = self.records[0]
+        self.topk_record = InferenceRecord(self.record.top_k)
+
+        metas = [DecodedImage(f"image_{index:03d}.jpg", None, width, height, 'RGB', fmt, 400_000 + 50_000 * index)
+                 for index, (width, height, fmt) in enumerate(list(IMAGE_SPECS.values()) * 3)][:FOLDER_PHOTOS]
+        self.meta = metas[1]
+        self.photo_scores = [{'filename': os.path.basename(meta.path), 'path': meta.path,
+                              **self.selector.score_photo(meta, record)}
+                             for meta, record in zip(metas, self.records)]
+        self.photo_scores.sort(key=lambda photo: photo['final_score'], reverse=True)
+
+    def cases(self) -> Dict[str, Callable]:
+        selector, universal = self.selector, self.universal
+        cases = {}
+        for name, path in self.images.items():
+            cases[f"decode/{name}"] = lambda path=path: decode_image(path)
+            cases[f"decode_full/{name}"] = lambda path=path: _full_decode(path)
+            cases[f"metadata/{name}"] = lambda path=path: _metadata(path)
+            cases[f"assess_photo/{name}"] = lambda path=path: selector.assess_photo(path)
+
+        record, topk_record = self.record, self.topk_record
+        cases['analyze_photo_content/vector'] = lambda: selector.analyze_photo_content(_fresh(record))
+        cases['analyze_photo_content/top-k'] = lambda: selector.analyze_photo_content(topk_record)
+        cases['analyze_photo_viewpoint/vector'] = lambda: selector.analyze_photo_viewpoint(_fresh(record))
+        cases['analyze_photo_viewpoint/top-k'] = lambda: selector.analyze_photo_viewpoint(topk_record)
+        cases['precompute_rule_scores/batch-64'] = lambda: selector.precompute_rule_scores(
+            [_fresh(record) for _ in range(64)])
+        cases['score_photo'] = lambda: selector.score_photo(self.meta, record)
+
+        photos = self.photo_scores
+        cases[f"_smart_select_best/{len(photos)}"] = quiet(lambda: selector._smart_select_best(photos, 2, "fotos/1/big"))
+        cases[f"detect_product_category/{len(photos)}"] = quiet(lambda: universal.detect_product_category(photos))
+        cases['apply_category_rules/bags'] = quiet(lambda: universal.apply_category_rules(photos, 'bags'))
+        cases['apply_category_rules/general'] = quiet(lambda: universal.apply_category_rules(photos, 'general'))
+        return cases
+
+
+def _full_decode(path: str):
+    with Image.open(path) as img:
+        return img.convert('RGB')
+
+
+def _metadata(path: str):
+    with Image.open(path) as img:
+        return img.size, img.mode, img.format, os.path.getsize(path)
+
+
+def _fresh(record: InferenceRecord) -> InferenceRecord:
+    """Копия записи без посчитанных оценок правил (иначе замер попадает в кэш записи)"""
+    return InferenceRecord(record.top_k, probabilities=record.probabilities)
+
+
+def machine_info() -> Dict:
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'preprocess': PREPROCESS_VERSION,
+    }
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def machine_differences(baseline: Optional[Dict], machine: Dict) -> List[str]:
+    """Поля окружения, в которых база отличается от текущей машины"""
+    base_machine = (baseline or {}).get('machine', {})
+    return [f"{key}: {base_machine[key]} -> {value}" for key, value in machine.items()
+            if key in base_machine and base_machine[key] != value]
+
+
+def compare(results: Dict[str, Dict], baseline: Optional[Dict], threshold: float) -> List[Dict]:
+    """Строки таблицы сравнения с базой"""
+    rows = []
+    base_results = (baseline or {}).get('results', {})
+    for name, result in results.items():
+        base = base_results.get(name, {}).get('us_per_call')
+        ratio = result['us_per_call'] / base if base else None
+        rows.append({'name': name, 'baseline_us': base, 'current_us': result['us_per_call'],
+                     'ratio': round(ratio, 3) if ratio else None,
+                     'regression': bool(ratio and ratio > threshold)})
+    return rows
+
+
+def print_table(rows: List[Dict], threshold: float):
+    print(f"\n   {'бенчмарк':<38} {'база, мкс':>12} {'сейчас, мкс':>12} {'x':>7}")
+    for row in rows:
+        base = f"{row['baseline_us']:.1f}" if row['baseline_us'] else "-"
+        ratio = f"{row['ratio']:.2f}" if row['ratio'] else "-"
+        marker = " ⚠️ регрессия" if row['regression'] else " 🚀" if row['ratio'] and row['ratio'] < 1 / threshold else ""
+        print(f"   {row['name']:<38} {base:>12} {row['current_us']:>12.1f} {ratio:>7}{marker}")
+
+
+def main():
+    """Главная функция"""
+    parser = argparse.ArgumentParser(description="Микробенчмарки оценки и выбора фотографий")
+    parser.add_argument('--filter', default=None, help="только бенчмарки, содержащие подстроку")
+    parser.add_argument('--min-time', type=float, default=0.2, help="секунд измерения на бенчмарк")
+    parser.add_argument('--repeat', type=int, default=5, help="серий измерения")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="файл базовых значений")
+    parser.add_argument('--save-baseline', action='store_true', help="сохранить результаты как новую базу")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="замедление относительно базы, считающееся регрессией")
+    parser.add_argument('--fail-on-regression', action='store_true', help="код выхода 1 при регрессии")
+    parser.add_argument('--report', default="micro_benchmark_report.json", help="файл отчета")
+    args = parser.parse_args()
+
+    print("⏱️ МИКРОБЕНЧМАРКИ ОЦЕНКИ И ВЫБОРА")
+    print("="*50)
+    with tempfile.TemporaryDirectory(prefix="micro_bench_") as workdir:
+        benchmarks = MicroBenchmarks(workdir)
+        results = {}
+        for name, fn in benchmarks.cases().items():
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(fn, args.min_time, args.repeat)
+            print(f"   {name:<38} {results[name]['us_per_call']:>12.1f} мкс")
+
+    baseline = load_baseline(args.baseline)
+    rows = compare(results, baseline, args.threshold)
+    if baseline:
+        print(f"\n📊 Сравнение с базой ({baseline.get('timestamp', '?')}, "
+              f"{baseline.get('machine', {}).get('processor', '?')}):")
+        print_table(rows, args.threshold)
+        differences = machine_differences(baseline, machine_info())
+        if differences:
+            # Микросекунды с другой машины или другой версии numpy несопоставимы
+            print(f"\n⚠️ База снята в другом окружении ({'; '.join(differences)}): "
+                  f"сравнение ориентировочное, обновите базу --save-baseline")
+    else:
+        print(f"\nℹ️ База не найдена: {args.baseline} - первый прогон станет базой этой машины")
+
+    report = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'machine': machine_info(),
+              'results': results, 'comparison': rows}
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 Отчет сохранен: {args.report}")
+
+    if args.save_baseline or baseline is None:
+        merged = dict((baseline or {}).get('results', {}))
+        merged.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': report['timestamp'], 'machine': report['machine'], 'results': merged},
+                      f, ensure_ascii=False, indent=2)
+        print(f"💾 База обновлена: {args.baseline}")
+
+    regressions = [row['name'] for row in rows if row['regression']]
+    if regressions:
+        print(f"\n⚠️ Регрессии: {len(regressions)} - {', '.join(regressions)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+КАСКАД МОДЕЛЕЙ: МАЛЕНЬКАЯ ConvNeXt -> ConvNeXt Large
+Сначала все фотографии классифицирует маленькая модель (convnext-tiny).
+Large запускается только для фотографий, где правила селектора близки
+к порогам (тип содержимого, ракурс) или которые борются за первое/второе
+место в своей папке. Для очевидных фотографий Large не вызывается.
+"""
+
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from inference import BatchInferenceEngine, InferenceRecord, DEFAULT_BATCH_SIZE, find_image_files
+
+SMALL_MODEL_PATH = "./models/convnext-tiny-224"
+# Бэкенд маленькой модели задается отдельно от Large: экспорт onnx/torchscript
+# делается только для Large, а download_model.py --model tiny дает веса HF
+SMALL_MODEL_BACKEND = "hf-pipeline"
+
+# Пороги правил analyze_photo_content / analyze_photo_viewpoint
+CONTENT_THRESHOLDS = (1.0, 2.0)      # main_product_score: GOOD_PRODUCT / MAIN_PRODUCT
+FRONT_THRESHOLD = 1.0                # front_score -> FRONT
+BACK_THRESHOLD = -2.0                # back_score -> BACK
+
+# Насколько близко к порогу решение считается неуверенным
+CASCADE_MARGIN = 0.3
+# Отставание от второго места, при котором фото еще борется за слот
+SLOT_MARGIN = 0.5
+
+
+def near_threshold(value: float, thresholds, margin: float = CASCADE_MARGIN) -> bool:
+    return any(abs(value - threshold) <= margin for threshold in thresholds)
+
+
+def rule_ambiguity(content_score: float, front_score: float, back_score: float,
+                   margin: float = CASCADE_MARGIN) -> List[str]:
+    """Причины неуверенности правил (пустой список - решение однозначно).
+    Штрафы за детали не проверяются: они не зависят от уверенности модели"""
+    reasons = []
+    if near_threshold(content_score, CONTENT_THRESHOLDS, margin):
+        reasons.append(f"содержимое {content_score:.2f} у порога")
+    # FRONT: front_score > 1.0 и front_score > |back_score| * 1.5
+    if near_threshold(front_score, (FRONT_THRESHOLD,), margin) or (
+            back_score and front_score > FRONT_THRESHOLD - margin
+            and near_threshold(front_score, (abs(back_score) * 1.5,), margin)):
+        reasons.append(f"передний вид {front_score:.2f} у порога")
+    if back_score and near_threshold(back_score, (BACK_THRESHOLD,), margin):
+        reasons.append(f"задний вид {back_score:.1f} у порога")
+    return reasons
+
+
+class ModelCascade:
+    """Двухуровневый каскад: дешевая модель для всех, Large - только для спорных"""
+
+    def __init__(self, small_classifier, large_classifier,
+                 ambiguity_fn: Callable[[InferenceRecord], List[str]],
+                 score_fn: Callable[[str, InferenceRecord], Optional[Dict]],
+                 batch_size: int = DEFAULT_BATCH_SIZE, slot_margin: float = SLOT_MARGIN,
+                 fast_decode: bool = True, cache=None, small_model_key: Optional[str] = None,
+                 large_model_key: Optional[str] = None):
+        # ambiguity_fn(record) -> причины неуверенности правил селектора
+        # score_fn(path, record) -> оценка фотографии (нужна final_score)
+        # cache - InferenceCache; записи каждой модели хранятся под своим ключом
+        self.small_engine = BatchInferenceEngine(small_classifier, batch_size, fast_decode=fast_decode,
+                                                 cache=cache, model_key=small_model_key)
+        self.large_engine = BatchInferenceEngine(large_classifier, batch_size, fast_decode=fast_decode,
+                                                 cache=cache, model_key=large_model_key)
+        self.ambiguity_fn = ambiguity_fn
+        self.score_fn = score_fn
+        self.slot_margin = slot_margin
+        self.escalations: Dict[str, List[str]] = {}
+        self.stats = {'images': 0, 'escalated': 0, 'ambiguous': 0, 'slot_contenders': 0, 'seconds': 0.0}
+
+    def _slot_contenders(self, records: Dict[str, InferenceRecord]) -> Dict[str, str]:
+        """Фото, чья оценка близка ко второму месту в своей папке"""
+        by_folder: Dict[str, List] = {}
+        for path, record in records.items():
+            assessment = self.score_fn(path, record)
+            if assessment:
+                by_folder.setdefault(os.path.dirname(path), []).append((assessment['final_score'], path))
+
+        contenders = {}
+        for scored in by_folder.values():
+            scored.sort(reverse=True)
+            second = scored[min(1, len(scored) - 1)][0]
+            for final_score, path in scored:
+                if final_score >= second - self.slot_margin:
+                    contenders[path] = f"борется за слот ({final_score:.2f}, второе место {second:.2f})"
+        return contenders
+
+    def classify_paths(self, paths: List[str]) -> Dict[str, InferenceRecord]:
+        """Классифицирует файлы каскадом; возвращает {путь: запись}"""
+        start = time.perf_counter()
+        records = self.small_engine.classify_paths(paths)
+
+        self.escalations = {}
+        for path, record in records.items():
+            reasons = self.ambiguity_fn(record)
+            if reasons:
+                self.escalations[path] = reasons
+                self.stats['ambiguous'] += 1
+        for path, reason in self._slot_contenders(records).items():
+            if path not in self.escalations:
+                self.stats['slot_contenders'] += 1
+            self.escalations.setdefault(path, []).append(reason)
+
+        escalated = [path for path in paths if path in self.escalations]
+        for path, record in self.large_engine.classify_paths(escalated).items():
+            # Запись Large заменяет запись маленькой модели: два вызова модели на фото
+            record.invocations += records[path].invocations
+            records[path] = record
+
+        self.stats['images'] += len(records)
+        self.stats['escalated'] += len(escalated)
+        self.stats['seconds'] += time.perf_counter() - start
+        return records
+
+    def classify_folders(self, folders: List[str]) -> Dict[str, Dict[str, InferenceRecord]]:
+        """Каскад сразу по многим папкам, результаты по папкам"""
+        owners = {}
+        for folder in folders:
+            if os.path.isdir(folder):
+                for filename in find_image_files(folder):
+                    owners[os.path.join(folder, filename)] = folder
+
+        by_folder = {folder: {} for folder in folders}
+        for path, record in self.classify_paths(list(owners)).items():
+            by_folder[owners[path]][path] = record
+        return by_folder
+
+    def get_stats(self) -> Dict:
+        """Доля фотографий, переданных в Large"""
+        images = self.stats['images']
+        return {
+            'images': images,
+            'escalated': self.stats['escalated'],
+            'escalation_rate': round(self.stats['escalated'] / images, 4) if images else 0.0,
+            'ambiguous': self.stats['ambiguous'],
+            'slot_contenders': self.stats['slot_contenders'],
+            'seconds': round(self.stats['seconds'], 3),
+            'small_model': self.small_engine.get_stats(),
+            'large_model': self.large_engine.get_stats(),
+        }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(f"🪜 Каскад: {stats['escalated']}/{stats['images']} фото переданы в Large "
+              f"({stats['escalation_rate'] * 100:.0f}%): спорные правила {stats['ambiguous']}, "
+              f"борьба за слот {stats['slot_contenders']}, {stats['seconds']:.2f} с")
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+БЫСТРАЯ ЗАГРУЗКА МОДЕЛИ (ХОЛОДНЫЙ СТАРТ)
+- transformers/torch импортируются только при первой загрузке модели
+- веса читаются из model.safetensors через mmap: без pickle и без
+  случайной инициализации параметров, которые все равно перезаписываются
+- по желанию модель трассируется в TorchScript (trace + freeze) и сохраняется
+  на диск, чтобы следующие процессы загружали готовый граф без transformers
+"""
+
+import json
+import os
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+
+from image_decoder import CLASSIFIER_SIZE, PREPROCESS_VERSION
+from inference import PixelValuesClassifier
+
+SAFETENSORS_FILENAME = "model.safetensors"
+PYTORCH_FILENAME = "pytorch_model.bin"
+COMPILED_SUBDIR = "compiled"
+COMPILED_FILENAME = "model_traced.pt"
+COMPILED_META_FILENAME = "model_traced.json"
+
+
+def safetensors_file(model_path: str) -> str:
+    return os.path.join(model_path, SAFETENSORS_FILENAME)
+
+
+def compiled_model_file(model_path: str) -> str:
+    """Путь к сохраненной TorchScript-модели рядом с исходной"""
+    return os.path.join(model_path, COMPILED_SUBDIR, COMPILED_FILENAME)
+
+
+def ensure_safetensors(model_path: str) -> Optional[str]:
+    """Один раз конвертирует pytorch_model.bin в model.safetensors (нужен для mmap).
+    Файл пишется во временный в той же папке и атомарно переименовывается: процессы,
+    конвертирующие одновременно, не видят недописанный файл"""
+    target = safetensors_file(model_path)
+    if os.path.exists(target):
+        return target
+
+    source = os.path.join(model_path, PYTORCH_FILENAME)
+    if not os.path.exists(source):
+        return None
+
+    import torch
+    from safetensors.torch import save_file
+
+    print(f"💾 Конвертирую веса в safetensors: {target}")
+    state_dict = torch.load(source, map_location='cpu')
+    fd, temp_path = tempfile.mkstemp(prefix=f".{SAFETENSORS_FILENAME}.", suffix=".tmp", dir=model_path)
+    os.close(fd)
+    try:
+        save_file({name: tensor.contiguous() for name, tensor in state_dict.items()}, temp_path,
+                  metadata={'format': 'pt'})
+        os.replace(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return target
+
+
+def load_hf_model(model_path: str):
+    """ConvNeXt из model.safetensors через mmap, без инициализации параметров"""
+    import torch
+    from transformers import AutoConfig, AutoModelForImageClassification
+
+    try:
+        # Папка модели может быть только для чтения: тогда работает обычная загрузка ниже
+        weights = ensure_safetensors(model_path)
+    except Exception as e:
+        print(f"⚠️ Конвертация в safetensors не удалась ({e})")
+        weights = None
+    if weights is not None:
+        try:
+            from accelerate import init_empty_weights
+            from safetensors.torch import load_file
+
+            config = AutoConfig.from_pretrained(model_path)
+            # Параметры создаются на meta-устройстве (без памяти и случайной инициализации),
+            # затем подменяются тензорами из mmap-файла
+            with init_empty_weights():
+                model = AutoModelForImageClassification.from_config(config)
+            model.load_state_dict(load_file(weights), strict=True, assign=True)
+            return model.eval()
+        except Exception as e:
+            print(f"⚠️ Быстрая загрузка весов не удалась ({e}), использую from_pretrained")
+
+    # Есть исходный .bin - грузим его, а не safetensors, на котором быстрый путь только что упал
+    kwargs = {'use_safetensors': False} if os.path.exists(os.path.join(model_path, PYTORCH_FILENAME)) else {}
+    model = AutoModelForImageClassification.from_pretrained(model_path, low_cpu_mem_usage=True, **kwargs)
+    return model.eval()
+
+
+def load_hf_pipeline(model_path: str):
+    """HF pipeline поверх модели, загруженной через load_hf_model"""
+    from transformers import AutoImageProcessor, pipeline
+
+    return pipeline("image-classification", model=load_hf_model(model_path),
+                    image_processor=AutoImageProcessor.from_pretrained(model_path))
+
+
+class TorchScriptImageClassifier(PixelValuesClassifier):
+    """Классификатор на сохраненной TorchScript-модели.
+    Граф строится при первом запуске и переиспользуется, пока не изменятся
+    веса, версия torch или препроцессинг"""
+
+    name = "torchscript"
+
+    def __init__(self, model_path: str, compiled_file: Optional[str] = None):
+        import torch
+
+        self.model_path = model_path
+        self.compiled_file = compiled_file or compiled_model_file(model_path)
+        self.meta_file = os.path.join(os.path.dirname(self.compiled_file), COMPILED_META_FILENAME)
+        self._torch = torch
+
+        expected = self._cache_key()
+        self.version = f"torch-{torch.__version__}:{expected['weights_size']}"
+        if self._cache_valid(expected):
+            frozen = torch.jit.load(self.compiled_file, map_location='cpu')
+            with open(self.meta_file, encoding='utf-8') as f:
+                self.id2label = {int(idx): label for idx, label in json.load(f)['id2label'].items()}
+        else:
+            print(f"🛠️ Строю TorchScript-модель: {self.compiled_file}")
+            model = load_hf_model(model_path)
+            self.id2label = {int(idx): label for idx, label in model.config.id2label.items()}
+            frozen = self._trace(model)
+            self._save(frozen, expected)
+
+        # Оптимизации под CPU (слияние conv/bn, MKLDNN) не сериализуются - применяются после загрузки
+        self.module = torch.jit.optimize_for_inference(frozen)
+
+    def _cache_key(self) -> dict:
+        """Признаки, при изменении которых сохраненный граф пересобирается"""
+        weights = safetensors_file(self.model_path)
+        if not os.path.exists(weights):
+            weights = os.path.join(self.model_path, PYTORCH_FILENAME)
+        stat = os.stat(weights) if os.path.exists(weights) else None
+        return {
+            'torch': self._torch.__version__,
+            'preprocess': PREPROCESS_VERSION,
+            'weights_size': stat.st_size if stat else None,
+            'weights_mtime': int(stat.st_mtime) if stat else None,
+        }
+
+    def _cache_valid(self, expected: dict) -> bool:
+        if not (os.path.exists(self.compiled_file) and os.path.exists(self.meta_file)):
+            return False
+        try:
+            with open(self.meta_file, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return meta.get('key') == expected
+
+    def _trace(self, model):
+        torch = self._torch
+
+        class LogitsOnly(torch.nn.Module):
+            def __init__(self, wrapped):
+                super().__init__()
+                self.wrapped = wrapped
+
+            def forward(self, pixel_values):
+                return self.wrapped(pixel_values=pixel_values).logits
+
+        example = torch.zeros(1, 3, CLASSIFIER_SIZE, CLASSIFIER_SIZE)
+        with torch.no_grad():
+            traced = torch.jit.trace(LogitsOnly(model).eval(), example, strict=False)
+        return torch.jit.freeze(traced)
+
+    def _save(self, frozen, key: dict):
+        try:
+            os.makedirs(os.path.dirname(self.compiled_file), exist_ok=True)
+            frozen.save(self.compiled_file)
+            with open(self.meta_file, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'id2label': self.id2label}, f, ensure_ascii=False)
+        except OSError as e:
+            # Кэш необязателен: модель работает и без сохранения
+            print(f"⚠️ Не удалось сохранить TorchScript-модель: {e}")
+
+    def predict_probabilities(self, pixel_values: np.ndarray, paths: Optional[List[str]] = None) -> np.ndarray:
+        torch = self._torch
+        with torch.no_grad():
+            logits = self.module(torch.from_numpy(pixel_values.astype(np.float32, copy=False)))
+        return torch.softmax(logits.float(), dim=-1).numpy()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ОБЩИЙ РЕЕСТР МОДЕЛЕЙ ПРОЦЕССА
+Загружает ConvNeXt один раз на процесс и раздает его всем селекторам
+Потокобезопасен: параллельные запросы одной модели ждут единственную загрузку
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+# Модель и бэкенд по умолчанию задаются конфигурацией окружения (CLI-флаги имеют приоритет)
+MODEL_PATH_ENV = "PHOTO_SELECTOR_MODEL_PATH"
+BACKEND_ENV = "PHOTO_SELECTOR_BACKEND"
+
+DEFAULT_MODEL_PATH = os.environ.get(MODEL_PATH_ENV, "./models/convnext-large-224")
+HF_BACKEND = "hf-pipeline"
+INT8_BACKEND = "hf-pipeline-int8"
+BF16_BACKEND = "hf-pipeline-bf16"
+ONNX_BACKEND = "onnx"
+TORCHSCRIPT_BACKEND = "torchscript"
+FAKE_BACKEND = "fake"
+BACKENDS = (HF_BACKEND, INT8_BACKEND, BF16_BACKEND, ONNX_BACKEND, TORCHSCRIPT_BACKEND, FAKE_BACKEND)
+
+DEFAULT_BACKEND = os.environ.get(BACKEND_ENV, HF_BACKEND)
+
+# Режимы точности CPU-инференса -> бэкенд реестра
+PRECISION_BACKENDS = {
+    'fp32': HF_BACKEND,
+    'int8': INT8_BACKEND,
+    'bf16': BF16_BACKEND,
+}
+
+
+def _load_hf_pipeline(model_path: str):
+    """Создает HF pipeline для классификации изображений (веса из safetensors через mmap)"""
+    from model_loader import load_hf_pipeline
+    return load_hf_pipeline(model_path)
+
+
+def _load_hf_int8(model_path: str):
+    """HF pipeline с динамическим int8-квантованием линейных слоев.
+    В ConvNeXt это pwconv1/pwconv2 каждого блока и классификатор - основная часть вычислений"""
+    import torch
+    classifier = _load_hf_pipeline(model_path)
+    torch.quantization.quantize_dynamic(classifier.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return classifier
+
+
+def _load_hf_bf16(model_path: str):
+    """HF pipeline с весами bfloat16 (вдвое меньше памяти, быстрее на CPU с AVX512-BF16/AMX)"""
+    import torch
+    classifier = _load_hf_pipeline(model_path)
+    model = classifier.model.to(torch.bfloat16)
+    forward = model.forward
+
+    def forward_bf16(pixel_values=None, **kwargs):
+        # Препроцессинг отдает float32: приводим вход к bf16, logits - обратно к float32
+        outputs = forward(pixel_values=pixel_values.to(torch.bfloat16), **kwargs)
+        outputs.logits = outputs.logits.float()
+        return outputs
+
+    model.forward = forward_bf16
+    return classifier
+
+
+def _load_torchscript(model_path: str):
+    """TorchScript-модель из дискового кэша (строится при первом запуске)"""
+    from model_loader import TorchScriptImageClassifier
+    return TorchScriptImageClassifier(model_path)
+
+
+def _load_onnx(model_path: str):
+    """Классификатор ONNX Runtime (модель из export_onnx.py)"""
+    from onnx_backend import OnnxImageClassifier
+    return OnnxImageClassifier(model_path)
+
+
+def _load_fake(model_path: str):
+    """Детерминированный фейковый классификатор (сценарий вместо модели)"""
+    from fake_backend import FakeImageClassifier
+    return FakeImageClassifier(model_path)
+
+
+class ModelRegistry:
+    """Потокобезопасный реестр моделей, ключ - (путь к модели, бэкенд)"""
+
+    def __init__(self):
+        self._models: Dict[Tuple[str, str], object] = {}
+        self._stats: Dict[Tuple[str, str], Dict] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._loaders: Dict[str, Callable[[str], object]] = {
+            HF_BACKEND: _load_hf_pipeline,
+            INT8_BACKEND: _load_hf_int8,
+            BF16_BACKEND: _load_hf_bf16,
+            ONNX_BACKEND: _load_onnx,
+            TORCHSCRIPT_BACKEND: _load_torchscript,
+            FAKE_BACKEND: _load_fake,
+        }
+
+    def register_backend(self, backend: str, loader: Callable[[str], object]):
+        """Регистрирует функцию загрузки для нового бэкенда"""
+        with self._lock:
+            self._loaders[backend] = loader
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+                self._stats[key] = {'loads': 0, 'hits': 0, 'load_time_sec': 0.0}
+            return self._key_locks[key]
+
+    def acquire(self, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND):
+        """Возвращает модель из реестра, загружая ее при первом обращении"""
+        key = (model_path, backend)
+        model = self._models.get(key)
+        if model is not None:
+            with self._lock:
+                self._stats[key]['hits'] += 1
+            return model
+
+        with self._key_lock(key):
+            # Пока ждали блокировку, модель мог загрузить другой поток
+            model = self._models.get(key)
+            if model is not None:
+                with self._lock:
+                    self._stats[key]['hits'] += 1
+                return model
+
+            loader = self._loaders.get(backend)
+            if loader is None:
+                raise ValueError(f"Неизвестный бэкенд модели: {backend}")
+
+            print(f"🚀 Реестр моделей: загружаю {model_path} ({backend})...")
+            start = time.perf_counter()
+            model = loader(model_path)
+            load_time = time.perf_counter() - start
+
+            with self._lock:
+                self._models[key] = model
+                self._stats[key]['loads'] += 1
+                self._stats[key]['load_time_sec'] += load_time
+            print(f"✅ Реестр моделей: {model_path} загружена за {load_time:.2f} с")
+            return model
+
+    def preload(self, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND) -> bool:
+        """Явная предзагрузка модели (например, при старте пакетной обработки)"""
+        try:
+            self.acquire(model_path, backend)
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка предзагрузки модели {model_path}: {e}")
+            return False
+
+    def is_loaded(self, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND) -> bool:
+        """Проверяет, загружена ли модель"""
+        return (model_path, backend) in self._models
+
+    def release(self, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND):
+        """Удаляет модель из реестра (статистика сохраняется)"""
+        with self._lock:
+            self._models.pop((model_path, backend), None)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Статистика загрузок: число загрузок, попаданий и время загрузки"""
+        with self._lock:
+            return {
+                f"{path}|{backend}": {
+                    'loads': stats['loads'],
+                    'hits': stats['hits'],
+                    'load_time_sec': round(stats['load_time_sec'], 3),
+                    'loaded': (path, backend) in self._models,
+                }
+                for (path, backend), stats in self._stats.items()
+            }
+
+    def print_stats(self):
+        """Печатает статистику реестра"""
+        stats = self.get_stats()
+        if not stats:
+            print("📦 Реестр моделей: модели не загружались")
+            return
+        print("📦 Реестр моделей:")
+        for key, item in stats.items():
+            print(f"   {key}: загрузок {item['loads']}, попаданий {item['hits']}, "
+                  f"время загрузки {item['load_time_sec']:.2f} с")
+
+
+# Единый реестр на процесс
+model_registry = ModelRegistry()
+
+
+def get_classifier(model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND):
+    """Возвращает классификатор из общего реестра"""
+    return model_registry.acquire(model_path, backend)
+
+
+def preload_model(model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND) -> bool:
+    """Явно загружает модель в общий реестр"""
+    return model_registry.preload(model_path, backend)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+СЕРВЕР МОДЕЛИ НА ХОСТЕ (Unix socket)
+Один процесс держит веса ConvNeXt и обслуживает пакетную классификацию для
+всех процессов хоста: дочерних процессов Celery, app.py, запусков CLI.
+Запросы разных клиентов сливаются в микропакеты (micro_batching.py).
+
+Клиент (ModelServerClient) соблюдает протокол PixelValuesClassifier:
+селекторы подключаются к серверу, если сокет есть и на нем та же модель
+(бэкенд и отпечаток весов), иначе загружают модель в свой процесс.
+Если сервер пропал во время работы, клиент временно переходит на локальную
+модель и периодически проверяет сервер; когда тот вернулся, локальная копия освобождается.
+
+Протокол: кадр = 4 байта длины JSON-заголовка + заголовок + nbytes байт данных.
+  {"op": "info"}                                 -> имя, версия, id2label, идентичность модели
+  {"op": "predict", "shape": [N, 3, H, W], ...}  + float32 NCHW -> {"shape": [N, C]} + float32
+
+Запуск:
+    python model_server.py --backend hf-pipeline --max-batch 32 --max-wait-ms 10
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from inference import PixelValuesClassifier, pixel_values_probabilities
+from inference_cache import model_identity
+from metrics import metrics, serve_metrics
+from micro_batching import DEFAULT_MAX_WAIT_MS, INPUT_SHAPE, MicroBatchingClassifier
+from model_registry import BACKENDS, DEFAULT_BACKEND, DEFAULT_MODEL_PATH, model_registry
+
+MODEL_SOCKET_ENV = "PHOTO_SELECTOR_MODEL_SOCKET"
+DEFAULT_MODEL_SOCKET = os.path.join(tempfile.gettempdir(), "photo_selector_model.sock")
+DEFAULT_SERVER_BATCH = 32
+CLIENT_TIMEOUT = 300.0  # секунды на ответ сервера (пакет в очереди + прогон модели)
+SERVER_RETRY_INTERVAL = 30.0  # секунды между попытками вернуться на сервер после сбоя
+MAX_REQUEST_IMAGES = 256
+MAX_REQUEST_BYTES = MAX_REQUEST_IMAGES * int(np.prod(INPUT_SHAPE)) * 4
+SOCKET_MODE = 0o660  # пользователь и группа сервера
+
+_HEADER = struct.Struct('!I')
+
+
+def model_socket_path(socket_path: Optional[str] = None) -> str:
+    """Путь к сокету: аргумент, затем переменная окружения, затем путь по умолчанию"""
+    if socket_path is not None:
+        return socket_path
+    return os.environ.get(MODEL_SOCKET_ENV, DEFAULT_MODEL_SOCKET)
+
+
+def _read_exact(stream, size: int) -> bytes:
+    data = stream.read(size) if size else b''
+    if len(data) < size:
+        raise ConnectionError("соединение с сервером модели закрыто")
+    return data
+
+
+def send_frame(stream, header: Dict, payload: bytes = b''):
+    header = dict(header, nbytes=len(payload))
+    encoded = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    stream.write(_HEADER.pack(len(encoded)) + encoded)
+    if payload:
+        stream.write(payload)
+    stream.flush()
+
+
+def read_frame(stream, max_bytes: Optional[int] = None) -> Tuple[Dict, bytes]:
+    size, = _HEADER.unpack(_read_exact(stream, _HEADER.size))
+    if max_bytes is not None and size > max_bytes:
+        raise ValueError(f"Заголовок кадра слишком большой: {size} байт")
+    header = json.loads(_read_exact(stream, size).decode('utf-8'))
+    nbytes = header.get('nbytes', 0)
+    if not isinstance(nbytes, int) or nbytes < 0 or (max_bytes is not None and nbytes > max_bytes):
+        raise ValueError(f"Недопустимый размер данных кадра: {nbytes}")
+    return header, _read_exact(stream, nbytes)
+
+
+def _identity_key(identity: str) -> str:
+    """Бэкенд и отпечаток весов без пути (пути у процессов с разной рабочей папкой различаются)"""
+    return identity.split('|', 1)[-1]
+
+
+# СЕРВЕР
+
+def remove_stale_socket(socket_path: str):
+    """Удаляет сокет прошлого запуска; если на нем еще слушает сервер - RuntimeError"""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        os.remove(socket_path)  # сервер прошлого запуска завершился, сокет остался
+        return
+    except FileNotFoundError:
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"На сокете {socket_path} уже работает сервер модели")
+
+
+class _ModelRequestHandler(socketserver.StreamRequestHandler):
+    """Одно соединение клиента: запросы по очереди до закрытия"""
+
+    def handle(self):
+        while True:
+            try:
+                header, payload = read_frame(self.rfile, MAX_REQUEST_BYTES)
+            except (ConnectionError, OSError):
+                return
+            except ValueError as e:
+                # Поток кадров рассинхронизирован: отвечаем ошибкой и закрываем соединение
+                try:
+                    send_frame(self.wfile, {'error': str(e)})
+                except OSError:
+                    pass
+                return
+            try:
+                response, data = self.server.dispatch(header, payload)
+            except Exception as e:
+                response, data = {'error': str(e)}, b''
+            try:
+                send_frame(self.wfile, response, data)
+            except OSError:
+                return
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Сервер модели: поток на соединение, общий микропакетный классификатор"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND,
+                 max_batch_size: int = DEFAULT_SERVER_BATCH, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self.socket_path = socket_path
+        self.model_path = model_path
+        self.backend = backend
+        # До загрузки весов: второй сервер на том же сокете не должен стартовать вовсе
+        remove_stale_socket(socket_path)
+        self.identity = model_identity(model_path, backend)
+        self.classifier = MicroBatchingClassifier(model_registry.acquire(model_path, backend),
+                                                  max_batch_size, max_wait_ms)
+        super().__init__(socket_path, _ModelRequestHandler)
+
+    def server_bind(self):
+        # Права задаются при создании сокета: между bind и chmod не остается окна с правами по umask
+        previous = os.umask(0o777 & ~SOCKET_MODE)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(previous)
+
+    def info(self) -> Dict:
+        return {
+            'name': self.classifier.name,
+            'version': self.classifier.version,
+            'identity': self.identity,
+            'model_path': self.model_path,
+            'backend': self.backend,
+            'id2label': {str(index): label for index, label in self.classifier.id2label.items()},
+            'stats': self.classifier.get_stats(),
+        }
+
+    def dispatch(self, header: Dict, payload: bytes) -> Tuple[Dict, bytes]:
+        op = header.get('op')
+        if op == 'info':
+            return self.info(), b''
+        if op == 'predict':
+            shape = header.get('shape')
+            if (not isinstance(shape, list) or len(shape) != 4 or not all(isinstance(n, int) for n in shape)
+                    or not 0 < shape[0] <= MAX_REQUEST_IMAGES or tuple(shape[1:]) != INPUT_SHAPE):
+                raise ValueError(f"Форма пакета должна быть [N, {', '.join(map(str, INPUT_SHAPE))}], "
+                                 f"N от 1 до {MAX_REQUEST_IMAGES}; получено {shape}")
+            expected = int(np.prod(shape)) * 4
+            if header.get('nbytes') != expected or len(payload) != expected:
+                raise ValueError(f"Ожидалось {expected} байт float32, получено {len(payload)}")
+            pixel_values = np.frombuffer(payload, dtype=np.float32).reshape(shape)
+            probabilities = self.classifier.predict_probabilities(pixel_values, header.get('paths'))
+            probabilities = np.ascontiguousarray(probabilities, dtype=np.float32)
+            return {'shape': list(probabilities.shape)}, probabilities.tobytes()
+        raise ValueError(f"Неизвестная операция: {op}")
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+# КЛИЕНТ
+
+class ModelServerClient(PixelValuesClassifier):
+    """Классификатор-клиент сервера модели; соединение - своё у каждого потока и процесса"""
+
+    def __init__(self, socket_path: str, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND,
+                 timeout: float = CLIENT_TIMEOUT):
+        self.socket_path = socket_path
+        self.model_path = model_path
+        self.backend = backend
+        self.timeout = timeout
+        self._local = threading.local()
+        # Локальная модель на время недоступности сервера; состояние общее для потоков процесса
+        self._fallback_lock = threading.Lock()
+        self._fallback = None
+        self._owns_fallback = False  # модель загрузил этот клиент, а не селекторы процесса
+        self._retry_at = 0.0
+        info, _ = self._request({'op': 'info'})
+        self.name = info['name']
+        self.version = info['version']
+        self.identity = info['identity']
+        self.id2label = {int(index): label for index, label in info['id2label'].items()}
+
+    def _connection(self):
+        # После fork сокет родителя не используем: у каждого процесса свое соединение
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            connection = sock.makefile('rwb')
+            self._local.socket, self._local.connection, self._local.pid = sock, connection, os.getpid()
+        return connection
+
+    def _disconnect(self):
+        sock = getattr(self._local, 'socket', None)
+        if sock is not None and self._local.pid == os.getpid():
+            sock.close()
+        self._local.socket = self._local.connection = None
+
+    def _request(self, header: Dict, payload: bytes = b'') -> Tuple[Dict, bytes]:
+        """Запрос с одной повторной попыткой (сервер мог перезапуститься)"""
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                send_frame(connection, header, payload)
+                response, data = read_frame(connection)
+                break
+            except OSError:
+                self._disconnect()
+                if attempt:
+                    raise
+        if 'error' in response:
+            raise RuntimeError(f"Сервер модели: {response['error']}")
+        return response, data
+
+    def predict_probabilities(self, pixel_values: np.ndarray, paths: Optional[List[str]] = None) -> np.ndarray:
+        """Пакет на сервер; пока сервер недоступен - локальная модель с периодической проверкой сервера"""
+        with self._fallback_lock:
+            fallback = self._fallback
+            try_server = fallback is None or time.monotonic() >= self._retry_at
+            if fallback is not None and try_server:
+                # Сервер проверяет один поток за интервал, остальные пока считают локально
+                self._retry_at = time.monotonic() + SERVER_RETRY_INTERVAL
+        if try_server:
+            try:
+                probabilities = self._predict_on_server(pixel_values, paths)
+            except OSError as e:
+                fallback = self._use_fallback(e)
+            else:
+                if fallback is not None:
+                    self._leave_fallback()
+                return probabilities
+        return pixel_values_probabilities(fallback, pixel_values, paths)
+
+    def _use_fallback(self, error: OSError):
+        """Локальная модель до следующей проверки сервера"""
+        with self._fallback_lock:
+            self._retry_at = time.monotonic() + SERVER_RETRY_INTERVAL
+            if self._fallback is None:
+                print(f"⚠️ Сервер модели недоступен ({error}), временно перехожу на локальную модель")
+                # Уже загруженную в процессе модель (например, селектором) клиент только использует
+                self._owns_fallback = not model_registry.is_loaded(self.model_path, self.backend)
+                self._fallback = model_registry.acquire(self.model_path, self.backend)
+            return self._fallback
+
+    def _leave_fallback(self):
+        """Сервер вернулся: локальная копия весов больше не нужна"""
+        with self._fallback_lock:
+            if self._fallback is None:
+                return
+            print(f"🔌 Сервер модели {self.socket_path} снова доступен")
+            self._fallback = None
+            if self._owns_fallback:
+                # Только запись реестра: потоки, еще считающие на локальной копии, держат свою ссылку
+                model_registry.release(self.model_path, self.backend)
+            self._owns_fallback = False
+
+    def _predict_on_server(self, pixel_values: np.ndarray, paths: Optional[List[str]] = None) -> np.ndarray:
+        """Пакет любого размера: сервер принимает до MAX_REQUEST_IMAGES изображений за запрос"""
+        pixel_values = np.ascontiguousarray(pixel_values, dtype=np.float32)
+        if len(pixel_values) == 0:
+            return np.zeros((0, len(self.id2label)), dtype=np.float32)
+        parts = []
+        for offset in range(0, len(pixel_values), MAX_REQUEST_IMAGES):
+            chunk = pixel_values[offset:offset + MAX_REQUEST_IMAGES]
+            chunk_paths = list(paths[offset:offset + MAX_REQUEST_IMAGES]) if paths else None
+            header, data = self._request({'op': 'predict', 'shape': list(chunk.shape), 'paths': chunk_paths},
+                                         chunk.tobytes())
+            parts.append(np.frombuffer(data, dtype=np.float32).reshape(header['shape']))
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def info(self) -> Dict:
+        return self._request({'op': 'info'})[0]
+
+
+_clients: Dict[Tuple[str, str, str], ModelServerClient] = {}
+_clients_lock = threading.Lock()
+
+
+def connect_model_server(socket_path: Optional[str], model_path: str = DEFAULT_MODEL_PATH,
+                         backend: str = DEFAULT_BACKEND) -> Optional[ModelServerClient]:
+    """Клиент сервера модели процесса или None: сокета нет, сервер не отвечает или модель другая.
+    socket_path=None - путь из окружения, '' - сервер не используется"""
+    socket_path = model_socket_path(socket_path)
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    key = (socket_path, model_path, backend)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+        try:
+            client = ModelServerClient(socket_path, model_path, backend)
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"⚠️ Сервер модели {socket_path} не отвечает: {e}")
+            return None
+        if _identity_key(client.identity) != _identity_key(model_identity(model_path, backend)):
+            print(f"⚠️ На сервере модели {socket_path} другая модель: {client.identity}")
+            return None
+        _clients[key] = client
+        return client
+
+
+def main():
+    """Запуск сервера модели"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Сервер модели для всех процессов хоста (Unix socket)")
+    parser.add_argument('--socket', default=model_socket_path(), help="путь к Unix-сокету")
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH, help="папка модели")
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help="бэкенд модели")
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_SERVER_BATCH,
+                        help="максимум изображений в микропакете")
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help="ожидание дополнительных запросов в микропакет, мс")
+    parser.add_argument('--metrics-port', type=int, default=None, help="порт экспортера /metrics")
+    args = parser.parse_args()
+
+    print(f"🚀 Сервер модели: {args.model_path} ({args.backend})")
+    try:
+        server = ModelServer(args.socket, args.model_path, args.backend, args.max_batch, args.max_wait_ms)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if args.metrics_port:
+        metrics.configure("model-server")
+        serve_metrics(args.metrics_port)
+    # docker stop / systemd: SIGTERM тоже закрывает сервер и удаляет сокет
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"🔌 Слушаю {args.socket} (микропакет до {args.max_batch} изображений, ожидание {args.max_wait_ms} мс)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("\n⏹️ Сервер модели остановлен")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
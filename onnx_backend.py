@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+БЭКЕНД ONNX RUNTIME ДЛЯ КЛАССИФИКАТОРА ConvNeXt
+Выполняет модель, экспортированную export_onnx.py, на CPU без PyTorch.
+Вызывается так же, как HF pipeline, и возвращает тот же формат топ-k
+[{'label': ..., 'score': ...}], который ожидают analyze_photo_content
+и analyze_photo_viewpoint.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from inference import PixelValuesClassifier
+
+ONNX_SUBDIR = "onnx"
+ONNX_FILENAME = "model.onnx"
+
+
+def onnx_model_file(model_path: str) -> str:
+    """Путь к ONNX-файлу рядом с исходной моделью"""
+    return os.path.join(model_path, ONNX_SUBDIR, ONNX_FILENAME)
+
+
+def load_id2label(model_path: str) -> Dict[int, str]:
+    """Метки классов из config.json исходной модели"""
+    with open(os.path.join(model_path, "config.json"), encoding='utf-8') as f:
+        config = json.load(f)
+    return {int(idx): label for idx, label in config['id2label'].items()}
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class OnnxImageClassifier(PixelValuesClassifier):
+    """Классификатор на ONNX Runtime (CPUExecutionProvider, все оптимизации графа)"""
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, onnx_file: Optional[str] = None, threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("Для бэкенда ONNX установите onnxruntime: pip install onnxruntime")
+
+        onnx_file = onnx_file or onnx_model_file(model_path)
+        if not os.path.exists(onnx_file):
+            raise FileNotFoundError(f"ONNX-модель не найдена: {onnx_file} "
+                                    f"(сначала запустите python export_onnx.py)")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+
+        self.model_path = model_path
+        self.onnx_file = onnx_file
+        self.session = ort.InferenceSession(onnx_file, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.id2label = load_id2label(model_path)
+        self.version = f"ort-{ort.__version__}:{os.path.getsize(onnx_file)}"
+
+    def predict_probabilities(self, pixel_values: np.ndarray, paths: Optional[List[str]] = None) -> np.ndarray:
+        """Нормализованный пакет NCHW float32 -> вероятности классов"""
+        logits = self.session.run(None, {self.input_name: pixel_values.astype(np.float32, copy=False)})[0]
+        return softmax(logits)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+КОНВЕЙЕР ОБРАБОТКИ ФОТОГРАФИЙ (ПРОИЗВОДИТЕЛЬ/ПОТРЕБИТЕЛЬ)
+Чтение файла -> декодирование -> инференс -> оценка выполняются
+параллельными стадиями с ограниченными очередями между ними, поэтому
+процессор не простаивает во время чтения с NFS, а диск - во время инференса.
+Для каждой стадии считается загрузка, чтобы было видно узкое место.
+Если у движка есть кэш инференса, записи неизмененных файлов берутся
+из кэша сразу на стадии чтения и идут прямо на оценку.
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from image_decoder import decode_image_bytes
+
+# Маркер окончания потока данных
+_STOP = object()
+
+
+class PipelineConfig:
+    """Настройки конвейера: число потоков на стадию и ограничения памяти"""
+
+    def __init__(self, read_workers: int = 2, decode_workers: int = 2, inference_workers: int = 1,
+                 score_workers: int = 1, queue_size: int = 8, max_in_flight: int = 32,
+                 batch_wait: float = 0.005):
+        self.read_workers = max(1, read_workers)
+        self.decode_workers = max(1, decode_workers)
+        self.inference_workers = max(1, inference_workers)
+        self.score_workers = max(1, score_workers)
+        # Размер очереди между соседними стадиями
+        self.queue_size = max(1, queue_size)
+        # Максимум изображений, одновременно находящихся в конвейере
+        self.max_in_flight = max(1, max_in_flight)
+        # Сколько ждать добора пакета перед инференсом (секунды)
+        self.batch_wait = batch_wait
+
+
+class _StageStats:
+    """Время работы и ожидания потоков одной стадии"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float, items: int = 1, errors: int = 0):
+        with self._lock:
+            self.busy += busy
+            self.items += items
+            self.errors += errors
+
+    def to_dict(self, wall_time: float) -> Dict:
+        capacity = self.workers * wall_time
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'errors': self.errors,
+            'busy_sec': round(self.busy, 3),
+            'utilization': round(self.busy / capacity, 3) if capacity > 0 else 0.0,
+        }
+
+
+class StagedPipeline:
+    """Четырехстадийный конвейер с ограниченными очередями"""
+
+    def __init__(self, engine, score_fn: Callable, config: Optional[PipelineConfig] = None):
+        # engine - BatchInferenceEngine (пакетный прогон модели)
+        # score_fn(decoded, record, inference_error) -> оценка фотографии
+        self.engine = engine
+        self.score_fn = score_fn
+        self.config = config or PipelineConfig()
+        self.stats = {}
+        self.wall_time = 0.0
+        self.cache_hits = 0
+
+    def run(self, paths: List[str]) -> Dict[str, Dict]:
+        """Обрабатывает файлы и возвращает {путь: оценка}"""
+        config = self.config
+        read_q = queue.Queue(config.queue_size)
+        decode_q = queue.Queue(config.queue_size)
+        infer_q = queue.Queue(config.queue_size)
+        score_q = queue.Queue(config.queue_size)
+        in_flight = threading.BoundedSemaphore(config.max_in_flight)
+        results = {}
+        results_lock = threading.Lock()
+
+        stages = {
+            'read': _StageStats('read', config.read_workers),
+            'decode': _StageStats('decode', config.decode_workers),
+            'inference': _StageStats('inference', config.inference_workers),
+            'score': _StageStats('score', config.score_workers),
+        }
+
+        def finish(path: str, assessment: Optional[Dict]):
+            if assessment is not None:
+                with results_lock:
+                    results[path] = assessment
+            in_flight.release()
+
+        cache = self.engine.cache
+        cache_hits = [0]
+        classified = [0]
+
+        # Каждый элемент, взятый из очереди стадии, либо передается дальше, либо завершается
+        # через finish(path, None): иначе in_flight не освободится и производитель зависнет
+
+        def read(path: str):
+            start = time.perf_counter()
+            record, meta, checked = None, None, False
+            try:
+                # Файл не изменился (size+mtime) - запись ищется без чтения файла;
+                # один os.stat на файл для проверки и для поиска в кэше
+                stat = os.stat(path) if cache is not None else None
+                if cache is not None and cache.cached_hash(path, stat):
+                    record, meta = cache.lookup(path, self.engine.cache_key, stat=stat)
+                    checked = True
+                if record is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    if cache is not None and not checked:
+                        record, meta = cache.lookup(path, self.engine.cache_key, data, stat)
+            except Exception as e:
+                stages['read'].add(time.perf_counter() - start, errors=1)
+                print(f"   ⚠️ Не удалось прочитать {os.path.basename(path)}: {e}")
+                finish(path, None)
+                return
+            stages['read'].add(time.perf_counter() - start)
+            if record is not None:
+                # Попадание в кэш: декодирование и инференс пропускаются
+                with results_lock:
+                    cache_hits[0] += 1
+                score_q.put((meta, record, None))
+                return
+            decode_q.put((path, data))
+
+        def reader():
+            while True:
+                path = read_q.get()
+                if path is _STOP:
+                    break
+                try:
+                    read(path)
+                except Exception as e:
+                    stages['read'].add(0.0, items=0, errors=1)
+                    print(f"   ⚠️ Ошибка стадии чтения {os.path.basename(path)}: {e}")
+                    finish(path, None)
+
+        def decoder():
+            while True:
+                item = decode_q.get()
+                if item is _STOP:
+                    break
+                path, data = item
+                start = time.perf_counter()
+                try:
+                    decoded = decode_image_bytes(data, path, self.engine.decode_backend)
+                except Exception as e:
+                    stages['decode'].add(time.perf_counter() - start, errors=1)
+                    print(f"   ❌ Ошибка при анализе {os.path.basename(path)}: {e}")
+                    finish(path, None)
+                    continue
+                stages['decode'].add(time.perf_counter() - start)
+                infer_q.put(decoded)
+
+        def infer(batch: List, sent: List):
+            """Инференс пакета и передача на оценку (sent - уже переданные элементы)"""
+            start = time.perf_counter()
+            try:
+                records = self.engine.classify_batch([decoded.image for decoded in batch],
+                                                     [decoded.path for decoded in batch])
+                errors = [None] * len(batch)
+            except Exception:
+                # Изолируем сбойное изображение поштучным прогоном
+                records, errors = [], []
+                for decoded in batch:
+                    try:
+                        records.append(self.engine.classify_batch([decoded.image], [decoded.path])[0])
+                        errors.append(None)
+                    except Exception as e:
+                        records.append(None)
+                        errors.append(e)
+            failed = sum(1 for e in errors if e is not None)
+            stages['inference'].add(time.perf_counter() - start, items=len(batch), errors=failed)
+            with results_lock:
+                classified[0] += len(batch) - failed
+            if cache is not None:
+                try:
+                    cache.store_many([(decoded.path, record, decoded)
+                                      for decoded, record in zip(batch, records) if record is not None],
+                                     self.engine.cache_key)
+                except Exception as e:
+                    # Кэш - только ускорение: оценки пакета не теряются из-за ошибки записи
+                    stages['inference'].add(0.0, items=0, errors=1)
+                    print(f"   ⚠️ Не удалось сохранить пакет в кэш инференса: {e}")
+            for decoded, record, error in zip(batch, records, errors):
+                # Пиксели больше не нужны - освобождаем память до стадии оценки
+                decoded.image = None
+                score_q.put((decoded, record, error))
+                sent.append(decoded)
+
+        def inferencer():
+            stopped = False
+            while not stopped:
+                item = infer_q.get()
+                if item is _STOP:
+                    break
+                batch = [item]
+                # Добираем пакет из того, что уже декодировано
+                while len(batch) < self.engine.batch_size:
+                    try:
+                        item = infer_q.get(timeout=config.batch_wait)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopped = True
+                        break
+                    batch.append(item)
+
+                sent = []
+                try:
+                    infer(batch, sent)
+                except Exception as e:
+                    stages['inference'].add(0.0, items=0, errors=1)
+                    print(f"   ❌ Ошибка стадии инференса: {e}")
+                    for decoded in batch[len(sent):]:
+                        finish(decoded.path, None)
+
+        def scorer():
+            while True:
+                item = score_q.get()
+                if item is _STOP:
+                    break
+                decoded, record, error = item
+                start = time.perf_counter()
+                try:
+                    assessment = self.score_fn(decoded, record, error)
+                    stages['score'].add(time.perf_counter() - start)
+                except Exception as e:
+                    assessment = None
+                    stages['score'].add(time.perf_counter() - start, errors=1)
+                    print(f"   ❌ Ошибка при анализе {os.path.basename(decoded.path)}: {e}")
+                finish(decoded.path, assessment)
+
+        def start_workers(target, count: int) -> List[threading.Thread]:
+            threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+            for thread in threads:
+                thread.start()
+            return threads
+
+        def drain(threads: List[threading.Thread], next_queue: queue.Queue, next_workers: int):
+            for thread in threads:
+                thread.join()
+            for _ in range(next_workers):
+                next_queue.put(_STOP)
+
+        wall_start = time.perf_counter()
+        readers = start_workers(reader, config.read_workers)
+        decoders = start_workers(decoder, config.decode_workers)
+        inferencers = start_workers(inferencer, config.inference_workers)
+        scorers = start_workers(scorer, config.score_workers)
+
+        # Производитель: ограничиваем число изображений в конвейере
+        for path in paths:
+            in_flight.acquire()
+            read_q.put(path)
+        for _ in range(config.read_workers):
+            read_q.put(_STOP)
+
+        # Завершаем стадии по порядку, передавая маркер окончания дальше
+        drain(readers, decode_q, config.decode_workers)
+        drain(decoders, infer_q, config.inference_workers)
+        drain(inferencers, score_q, config.score_workers)
+        for thread in scorers:
+            thread.join()
+
+        self.wall_time = time.perf_counter() - wall_start
+        self.engine.record_run(images=classified[0],
+                               cache_hits=cache_hits[0], seconds=self.wall_time)
+        self.cache_hits = cache_hits[0]
+        self.stats = {name: stage.to_dict(self.wall_time) for name, stage in stages.items()}
+        return results
+
+    def get_stats(self) -> Dict:
+        """Загрузка стадий и узкое место последнего прогона"""
+        bottleneck = max(self.stats, key=lambda name: self.stats[name]['utilization']) if self.stats else None
+        return {
+            'wall_time_sec': round(self.wall_time, 3),
+            'max_in_flight': self.config.max_in_flight,
+            'queue_size': self.config.queue_size,
+            'cache_hits': self.cache_hits,
+            'stages': self.stats,
+            'bottleneck': bottleneck,
+        }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(f"🏭 Конвейер: {stats['wall_time_sec']:.2f} с, до {stats['max_in_flight']} изображений в работе"
+              + (f", из кэша {stats['cache_hits']}" if stats['cache_hits'] else ""))
+        for name, stage in stats['stages'].items():
+            marker = " ⬅️ узкое место" if name == stats['bottleneck'] else ""
+            print(f"   {name:<10} потоков {stage['workers']}, обработано {stage['items']}, "
+                  f"загрузка {stage['utilization'] * 100:.0f}%{marker}")
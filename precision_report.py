@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ОТЧЕТ ПО РЕЖИМАМ ТОЧНОСТИ CPU-ИНФЕРЕНСА (fp32 / int8 / bf16)
+Каждый режим запускается в отдельном процессе, чтобы честно измерить память.
+Для каждого режима: время загрузки, задержка на изображение, пропускная
+способность, резидентная память и расхождения с fp32 - тип содержимого
+(MAIN_PRODUCT), ракурс (FRONT) и итоговый выбор двух фотографий по папкам.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+import contextlib
+from typing import Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from model_registry import model_registry, DEFAULT_MODEL_PATH, PRECISION_BACKENDS
+from inference import BatchInferenceEngine, DEFAULT_BATCH_SIZE, find_image_files
+
+REFERENCE_MODE = 'fp32'
+
+
+def rss_mb() -> Optional[float]:
+    """Текущая резидентная память процесса (МБ)"""
+    if psutil is None:
+        return None
+    return round(psutil.Process().memory_info().rss / (1024 * 1024), 1)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковая резидентная память процесса (МБ, Linux/macOS)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает КБ, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def default_folders() -> List[str]:
+    """Все папки fotos/*/big"""
+    if not os.path.isdir("fotos"):
+        return []
+    return sorted(os.path.join("fotos", item, "big") for item in os.listdir("fotos")
+                  if os.path.isdir(os.path.join("fotos", item, "big")))
+
+
+def make_selector(selector_name: str, backend: str, batch_size: int):
+    if selector_name == 'final':
+        from final_photo_selector import FinalBagPhotoSelector
+        return FinalBagPhotoSelector(backend=backend, batch_size=batch_size)
+    from smart_photo_selector import SmartPhotoSelector
+    return SmartPhotoSelector(backend=backend, batch_size=batch_size)
+
+
+def select_two(selector, photo_scores: List[Dict], folder: str) -> List[str]:
+    """Итоговый выбор двух фотографий правилами селектора (без копирования файлов)"""
+    photo_scores = sorted(photo_scores, key=lambda x: x['final_score'], reverse=True)
+    if hasattr(selector, '_final_select_best'):
+        best = selector._final_select_best(photo_scores, 2, folder)
+    else:
+        best = selector._smart_select_best(photo_scores, 2, folder)
+    return [photo['filename'] for photo in best]
+
+
+def run_mode(mode: str, folders: List[str], selector_name: str, model_path: str,
+             batch_size: int, latency_samples: int) -> Dict:
+    """Прогон одного режима в текущем процессе"""
+    backend = PRECISION_BACKENDS[mode]
+    rss_before = rss_mb()
+
+    start = time.perf_counter()
+    classifier = model_registry.acquire(model_path, backend)
+    load_time = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    engine = BatchInferenceEngine(classifier, batch_size)
+    folder_records = engine.classify_folders(folders)
+    paths = [path for records in folder_records.values() for path in records]
+
+    # Задержка одиночного запроса (пакет из одного изображения)
+    latencies = []
+    single = BatchInferenceEngine(classifier, 1)
+    for path in paths[:latency_samples]:
+        image = single._load(path)
+        start = time.perf_counter()
+        single.classify_batch([image])
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    selector = make_selector(selector_name, backend, batch_size)
+    images = {}
+    selections = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        selector.load_model()
+        assess = getattr(selector, 'assess_bag_photo', None) or selector.assess_photo
+        for folder, records in folder_records.items():
+            photo_scores = []
+            for filename in find_image_files(folder) if os.path.isdir(folder) else []:
+                path = os.path.join(folder, filename)
+                if path not in records:
+                    continue
+                assessment = assess(path, records[path])
+                if not assessment:
+                    continue
+                photo_scores.append({'filename': filename, 'path': path, **assessment})
+                images[path] = {
+                    'top1': records[path].labels[0] if records[path].top_k else None,
+                    'content_type': assessment['content_type'],
+                    'is_main_product': assessment['is_main_product'],
+                    'main_view': assessment['main_view'],
+                    'final_score': assessment['final_score'],
+                }
+            selections[folder] = select_two(selector, photo_scores, folder)
+
+    stats = engine.get_stats()
+    return {
+        'mode': mode,
+        'backend': backend,
+        'load_time_sec': round(load_time, 3),
+        'images': stats['images'],
+        'batch_size': batch_size,
+        'images_per_sec': stats['images_per_sec'],
+        'ms_per_image': round(1000 * stats['seconds'] / stats['images'], 2) if stats['images'] else 0.0,
+        'latency_p50_ms': round(latencies[len(latencies) // 2], 2) if latencies else None,
+        'latency_max_ms': round(latencies[-1], 2) if latencies else None,
+        'rss_before_load_mb': rss_before,
+        'rss_after_load_mb': rss_loaded,
+        'model_rss_mb': round(rss_loaded - rss_before, 1) if rss_before is not None else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'per_image': images,
+        'selections': selections,
+    }
+
+
+def compare(reference: Dict, result: Dict) -> Dict:
+    """Расхождения режима с fp32"""
+    common = [path for path in reference['per_image'] if path in result['per_image']]
+    diff = {'top1': 0, 'content_type': 0, 'main_product': 0, 'front': 0}
+    changed_images = []
+    for path in common:
+        ref, cur = reference['per_image'][path], result['per_image'][path]
+        changed = False
+        if ref['top1'] != cur['top1']:
+            diff['top1'] += 1
+        if ref['content_type'] != cur['content_type']:
+            diff['content_type'] += 1
+        if ref['is_main_product'] != cur['is_main_product']:
+            diff['main_product'] += 1
+            changed = True
+        if (ref['main_view'] == 'FRONT') != (cur['main_view'] == 'FRONT'):
+            diff['front'] += 1
+            changed = True
+        if changed:
+            changed_images.append(path)
+
+    folders = [folder for folder in reference['selections'] if folder in result['selections']]
+    changed_folders = [folder for folder in folders
+                       if reference['selections'][folder] != result['selections'][folder]]
+    total = len(common) or 1
+    return {
+        'images_compared': len(common),
+        'top1_changed': diff['top1'],
+        'content_type_changed': diff['content_type'],
+        'main_product_changed': diff['main_product'],
+        'main_product_change_rate': round(diff['main_product'] / total, 4),
+        'front_changed': diff['front'],
+        'front_change_rate': round(diff['front'] / total, 4),
+        'images_with_decision_change': changed_images,
+        'folders_compared': len(folders),
+        'selection_changed': len(changed_folders),
+        'selection_change_rate': round(len(changed_folders) / (len(folders) or 1), 4),
+        'folders_with_selection_change': changed_folders,
+    }
+
+
+def run_mode_subprocess(mode: str, args) -> Optional[Dict]:
+    """Запускает режим в отдельном процессе и читает его результат"""
+    fd, output = tempfile.mkstemp(suffix=f'_{mode}.json')
+    os.close(fd)
+    command = [sys.executable, os.path.abspath(__file__), '--worker', mode, '--output', output,
+               '--selector', args.selector, '--model-path', args.model_path,
+               '--batch-size', str(args.batch_size), '--latency-samples', str(args.latency_samples),
+               *args.folders]
+    try:
+        completed = subprocess.run(command)
+        if completed.returncode != 0:
+            print(f"❌ Режим {mode} завершился с ошибкой (код {completed.returncode})")
+            return None
+        with open(output, encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def print_report(report: Dict):
+    print(f"\n📊 РЕЖИМЫ ТОЧНОСТИ (эталон - {REFERENCE_MODE}, селектор {report['selector']}):")
+    print(f"   {'режим':<6} {'загрузка':>9} {'мс/изобр':>9} {'p50 мс':>8} {'изобр/с':>8} "
+          f"{'модель МБ':>10} {'пик МБ':>8} {'MAIN':>6} {'FRONT':>6} {'выбор':>6}")
+    for mode, result in report['modes'].items():
+        cmp = report['vs_reference'].get(mode, {})
+        print(f"   {mode:<6} {result['load_time_sec']:>8.2f}с {result['ms_per_image']:>9.1f} "
+              f"{result['latency_p50_ms'] or 0:>8.1f} {result['images_per_sec']:>8.2f} "
+              f"{result['model_rss_mb'] if result['model_rss_mb'] is not None else '-':>10} "
+              f"{result['peak_rss_mb'] if result['peak_rss_mb'] is not None else '-':>8} "
+              f"{cmp.get('main_product_changed', 0):>6} {cmp.get('front_changed', 0):>6} "
+              f"{cmp.get('selection_changed', 0):>6}")
+    print("   MAIN / FRONT - изображений с другим решением, выбор - папок с другой парой фотографий")
+
+
+def main():
+    """Главная функция"""
+    parser = argparse.ArgumentParser(description="Сравнение режимов точности fp32 / int8 / bf16")
+    parser.add_argument('folders', nargs='*', help="папки с фотографиями (по умолчанию fotos/*/big)")
+    parser.add_argument('--modes', nargs='+', choices=list(PRECISION_BACKENDS),
+                        default=list(PRECISION_BACKENDS), help="режимы для сравнения")
+    parser.add_argument('--selector', choices=['smart', 'final'], default='smart',
+                        help="правила выбора: smart (SmartPhotoSelector) или final (FinalBagPhotoSelector)")
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH, help="папка модели")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="размер пакета инференса")
+    parser.add_argument('--latency-samples', type=int, default=10, help="изображений для замера задержки")
+    parser.add_argument('--report', default="precision_report.json", help="файл отчета")
+    parser.add_argument('--worker', choices=list(PRECISION_BACKENDS), help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.folders = args.folders or default_folders()
+
+    if args.worker:
+        # Дочерний процесс: один режим, результат в JSON
+        result = run_mode(args.worker, args.folders, args.selector, args.model_path,
+                          args.batch_size, args.latency_samples)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        return
+
+    print("🧪 СРАВНЕНИЕ РЕЖИМОВ ТОЧНОСТИ CPU-ИНФЕРЕНСА")
+    print("="*50)
+    if not args.folders:
+        print("❌ Папки для анализа не найдены!")
+        return
+    if psutil is None:
+        print("⚠️ psutil не установлен - резидентная память модели не измеряется")
+
+    modes = [REFERENCE_MODE] + [mode for mode in args.modes if mode != REFERENCE_MODE]
+    results = {}
+    for mode in modes:
+        print(f"\n🚀 Режим {mode} ({PRECISION_BACKENDS[mode]})...")
+        result = run_mode_subprocess(mode, args)
+        if result:
+            results[mode] = result
+
+    if REFERENCE_MODE not in results:
+        print(f"❌ Эталонный режим {REFERENCE_MODE} не выполнен - сравнение невозможно")
+        return
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'selector': args.selector,
+        'folders': args.folders,
+        'reference': REFERENCE_MODE,
+        'modes': {mode: {key: value for key, value in result.items() if key != 'per_image'}
+                  for mode, result in results.items()},
+        'vs_reference': {mode: compare(results[REFERENCE_MODE], result)
+                         for mode, result in results.items() if mode != REFERENCE_MODE},
+    }
+    print_report(report)
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 Отчет сохранен: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ОФЛАЙН ПЕРЕСЧЕТ ОЦЕНОК "ЧТО ЕСЛИ" ПО КЭШУ ИНФЕРЕНСА
+Берет сохраненные выходы классификатора и размеры изображений из кэша
+инференса (без модели и без чтения фотографий), применяет кандидатную
+конфигурацию правил SmartPhotoSelector и пересчитывает content_type,
+viewpoint_score, final_score и выбор двух фотографий для каждого SKU.
+Оценки считаются векторно по всему каталогу; результат - список SKU,
+у которых изменился выбор.
+
+Формат конфигурации (JSON): таблицы селектора, значения сливаются с
+текущими (null удаляет ключевое слово, но не порог RULE_THRESHOLDS;
+новые ключевые слова добавляются в конец):
+{
+  "MAIN_PRODUCT_KEYWORDS": {"tote": 4.0},
+  "DETAIL_KEYWORDS": {"pocket": null},
+  "RULE_THRESHOLDS": {"main_product_score": 1.8}
+}
+"""
+
+import os
+import io
+import json
+import time
+import argparse
+import contextlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from smart_photo_selector import SmartPhotoSelector
+from smart_analyze_all import get_all_folders
+from model_registry import DEFAULT_MODEL_PATH, DEFAULT_BACKEND, BACKENDS
+from inference import DEFAULT_TOP_K, find_image_files, preprocess_tag, record_cache_key
+from inference_cache import InferenceCache, DEFAULT_CACHE_PATH, model_identity
+from label_weights import LabelWeights
+
+# Таблицы селектора, которые можно менять в конфигурации
+RULE_TABLES = ('MAIN_PRODUCT_KEYWORDS', 'DETAIL_KEYWORDS', 'FRONT_VIEW_INDICATORS',
+               'BACK_VIEW_INDICATORS', 'RULE_THRESHOLDS')
+
+# Строка анализа, по которой _smart_select_best определяет типы товара на фото
+MAIN_PRODUCT_LINE = "🟢 ОСНОВНОЙ ТОВАР: {label} ({score:.3f}) * {weight} = {value:.3f}"
+
+
+def load_id2label(model_path: str) -> Dict[int, str]:
+    """id2label из config.json модели (без загрузки transformers)"""
+    with open(os.path.join(model_path, "config.json"), encoding='utf-8') as f:
+        return {int(index): label for index, label in json.load(f)['id2label'].items()}
+
+
+def apply_config(selector: SmartPhotoSelector, config: Dict,
+                 labels: Optional[List[str]] = None) -> SmartPhotoSelector:
+    """Сливает кандидатную конфигурацию с таблицами селектора
+    (labels - метки модели: новое ключевое слово должно входить хотя бы в одну)"""
+    labels = [label.lower() for label in labels] if labels is not None else None
+    for name, changes in config.items():
+        if name not in RULE_TABLES:
+            raise ValueError(f"Неизвестная таблица правил: {name}")
+        table = dict(getattr(selector, name))
+        for key, value in changes.items():
+            if name == 'RULE_THRESHOLDS':
+                # Пороги читаются правилами по имени: без ключа анализ упадет с KeyError
+                if key not in table:
+                    raise ValueError(f"Неизвестный порог: {key} (есть: {', '.join(table)})")
+                if value is None:
+                    raise ValueError(f"Порог {key} нельзя удалить (null), задайте число")
+            elif (value is not None and key not in table and labels is not None
+                  and not any(key in label for label in labels)):
+                raise ValueError(f"Ключевое слово {key} ({name}) не входит ни в одну метку модели")
+            if value is None:
+                table.pop(key, None)
+            else:
+                table[key] = float(value)
+        setattr(selector, name, table)
+    return selector
+
+
+class CatalogSnapshot:
+    """Сохраненные выходы классификатора по всему каталогу в виде массивов"""
+
+    def __init__(self, id2label: Dict[int, str]):
+        self.id2label = id2label
+        self.label2id = {label: index for index, label in id2label.items()}
+        self.skus: List[str] = []          # папка SKU (fotos/<N>/big)
+        self.paths: List[str] = []
+        self.missing: List[str] = []       # файлы без записи в кэше
+        self.sku_index = np.zeros(0, dtype=np.int32)
+        self.width = np.zeros(0)
+        self.height = np.zeros(0)
+        self.file_size = np.zeros(0)
+        self.modes = np.zeros(0, dtype=object)
+        self.probabilities = np.zeros((0, len(id2label)), dtype=np.float32)
+        self.top_index = np.zeros((0, DEFAULT_TOP_K), dtype=np.int64)
+        self.top_score = np.zeros((0, DEFAULT_TOP_K), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @classmethod
+    def from_cache(cls, cache: InferenceCache, folders: List[str], model_key: str,
+                   id2label: Dict[int, str]) -> 'CatalogSnapshot':
+        """Записи из кэша: подходит любая версия препроцессинга этой модели"""
+        snapshot = cls(id2label)
+        keys = [record_cache_key(model_key, preprocess_tag(direct, fast))
+                for direct, fast in ((True, True), (False, True), (False, False))]
+
+        rows = []
+        for sku, folder in enumerate(folders):
+            snapshot.skus.append(folder)
+            if not os.path.isdir(folder):
+                continue
+            # Порядок файлов как в обычном прогоне: от него зависит выбор при равных оценках
+            paths = [os.path.join(folder, filename) for filename in find_image_files(folder)]
+            remaining = paths
+            found = {}
+            for key in keys:
+                if not remaining:
+                    break
+                found.update(cache.lookup_many(remaining, key))
+                remaining = [path for path in remaining if path not in found]
+            snapshot.missing.extend(remaining)
+            for path in paths:
+                if path in found:
+                    rows.append((sku, path) + found[path])
+
+        count = len(rows)
+        snapshot.paths = [path for _, path, _, _ in rows]
+        snapshot.sku_index = np.array([sku for sku, _, _, _ in rows], dtype=np.int32)
+        snapshot.width = np.array([meta.width for _, _, _, meta in rows], dtype=np.float64)
+        snapshot.height = np.array([meta.height for _, _, _, meta in rows], dtype=np.float64)
+        snapshot.file_size = np.array([meta.file_size for _, _, _, meta in rows], dtype=np.float64)
+        snapshot.modes = np.array([meta.mode for _, _, _, meta in rows], dtype=object)
+        snapshot.probabilities = np.zeros((count, len(id2label)), dtype=np.float32)
+        snapshot.top_index = np.full((count, DEFAULT_TOP_K), -1, dtype=np.int64)
+        snapshot.top_score = np.zeros((count, DEFAULT_TOP_K), dtype=np.float32)
+
+        for row, (_, _, record, _) in enumerate(rows):
+            for column, item in enumerate(record.top_k[:DEFAULT_TOP_K]):
+                if item['label'] not in snapshot.label2id:
+                    raise ValueError(f"Метка {item['label']!r} из кэша ({snapshot.paths[row]}) "
+                                     f"отсутствует в id2label модели: записи другой модели?")
+                snapshot.top_index[row, column] = snapshot.label2id[item['label']]
+                snapshot.top_score[row, column] = item['score']
+            if record.probabilities is not None and len(record.probabilities) == len(id2label):
+                snapshot.probabilities[row] = record.probabilities
+            else:
+                # Только топ-k (HF pipeline): взвешенная сумма по нему совпадает с циклом правил
+                valid = snapshot.top_index[row] >= 0
+                snapshot.probabilities[row, snapshot.top_index[row, valid]] = snapshot.top_score[row, valid]
+        return snapshot
+
+    def top_k_mask(self) -> np.ndarray:
+        """Маска сохраненных топ-k меток (N, L) - правила считаются только по ним"""
+        mask = np.zeros(self.probabilities.shape, dtype=np.float32)
+        rows, columns = np.nonzero(self.top_index >= 0)
+        mask[rows, self.top_index[rows, columns]] = 1.0
+        return mask
+
+
+class WhatIfRescorer:
+    """Векторный пересчет оценок score_photo и выбор _smart_select_best"""
+
+    def __init__(self, snapshot: CatalogSnapshot, num_best: int = 2):
+        self.snapshot = snapshot
+        self.num_best = num_best
+        self._top_mask = snapshot.top_k_mask()
+
+    def score(self, selector: SmartPhotoSelector) -> Dict[str, np.ndarray]:
+        """Оценки всех фотографий каталога по правилам селектора (формулы score_photo)"""
+        snap = self.snapshot
+        width, height, file_size = snap.width, snap.height, snap.file_size
+        aspect_ratio = width / height
+        size_mb = file_size / (1024 * 1024)
+
+        # 1. Основные требования
+        basic = (2.0 * ((width >= 800) & (height >= 800)) + 1.0 * ((width >= 1200) & (height >= 1200))
+                 + 1.0 * ((width >= 1920) & (height >= 1920)))
+        basic = basic + np.select(
+            [(0.9 <= aspect_ratio) & (aspect_ratio <= 1.1), (1.2 <= aspect_ratio) & (aspect_ratio <= 1.5),
+             (0.6 <= aspect_ratio) & (aspect_ratio <= 0.9)], [1.0, 0.8, 0.7], 0.3)
+        basic = basic + np.select([snap.modes == 'RGB', snap.modes == 'RGBA'], [1.0, 0.8], 0.5)
+
+        # 2. Техническое качество
+        technical = np.select([(0.1 <= size_mb) & (size_mb <= 2.0), (0.05 <= size_mb) & (size_mb <= 5.0)],
+                              [1.0, 0.8], 0.3)
+        compression_ratio = width * height / file_size
+        technical = technical + np.where((100 <= compression_ratio) & (compression_ratio <= 1000), 1.0, 0.5)
+
+        # 3-4. Правила: одно умножение матриц на весь каталог
+        weights = LabelWeights(snap.id2label, {
+            'main': selector.MAIN_PRODUCT_KEYWORDS,
+            'detail': selector.DETAIL_KEYWORDS,
+            'front': selector.FRONT_VIEW_INDICATORS,
+            'back': selector.BACK_VIEW_INDICATORS,
+        })
+        # Как в правилах селектора: только сохраненные топ-5 метки
+        weighted, counted = weights.masked_scores(snap.probabilities, self._top_mask)
+        main = weighted['main'].astype(np.float64)
+        detail = counted['detail'].astype(np.float64)
+        front = weighted['front'].astype(np.float64)
+        back = counted['back'].astype(np.float64)
+
+        thresholds = selector.RULE_THRESHOLDS
+        content_type = np.select(
+            [(main > thresholds['main_product_score']) & (detail > thresholds['main_product_penalty']),
+             (main > thresholds['good_product_score']) & (detail > thresholds['good_product_penalty']),
+             detail < thresholds['details_only_penalty']],
+            ['MAIN_PRODUCT', 'GOOD_PRODUCT', 'DETAILS_ONLY'], 'MIXED').astype(object)
+        content = np.clip(main + detail, 0.0, 3.5)
+
+        main_view = np.select(
+            [(front > thresholds['front_score']) & (front > np.abs(back) * thresholds['front_back_ratio']),
+             back < thresholds['back_score']],
+            ['FRONT', 'BACK'], 'SIDE').astype(object)
+        viewpoint = np.select([main_view == 'FRONT', main_view == 'BACK'], [2.0, 0.0], 1.0)
+
+        final = np.minimum(basic + technical + content + viewpoint, 10.0)
+
+        # Метки топ-k, совпавшие с основным товаром (для правила "один тип товара")
+        main_vector = weights.vector('main')
+        top_weight = np.where(snap.top_index >= 0, main_vector[np.maximum(snap.top_index, 0)], 0.0)
+
+        return {
+            'basic_score': np.round(basic, 2),
+            'technical_score': np.round(technical, 2),
+            'content_score': np.round(content, 2),
+            'viewpoint_score': np.round(viewpoint, 2),
+            'final_score': np.round(final, 2),
+            'content_type': content_type,
+            'main_view': main_view,
+            'main_product_weight': top_weight,
+        }
+
+    def _photo(self, row: int, scores: Dict[str, np.ndarray]) -> Dict:
+        """Поля оценки, которые читает _smart_select_best"""
+        snap = self.snapshot
+        content_type = scores['content_type'][row]
+        content_analysis = []
+        for column, weight in enumerate(scores['main_product_weight'][row]):
+            if weight:
+                weight = round(float(weight), 4)
+                score = float(snap.top_score[row, column])
+                label = snap.id2label[int(snap.top_index[row, column])].lower()
+                content_analysis.append(MAIN_PRODUCT_LINE.format(label=label, score=score, weight=weight,
+                                                                 value=score * weight))
+        return {
+            'filename': os.path.basename(snap.paths[row]),
+            'path': snap.paths[row],
+            'final_score': float(scores['final_score'][row]),
+            'content_score': float(scores['content_score'][row]),
+            'viewpoint_score': float(scores['viewpoint_score'][row]),
+            'content_type': content_type,
+            'main_view': scores['main_view'][row],
+            'is_main_product': content_type in ("MAIN_PRODUCT", "GOOD_PRODUCT"),
+            'is_details_only': content_type == "DETAILS_ONLY",
+            'content_analysis': content_analysis,
+        }
+
+    def select(self, selector: SmartPhotoSelector, scores: Dict[str, np.ndarray]) -> Dict[str, Optional[List[str]]]:
+        """Выбор двух фотографий по каждому SKU (None - выбор не удался, как в обычном прогоне)"""
+        snap = self.snapshot
+        order = np.lexsort((-scores['final_score'], snap.sku_index))  # как сортировка по final_score
+        bounds = np.searchsorted(snap.sku_index[order], np.arange(len(snap.skus) + 1))
+
+        selections = {}
+        for sku, folder in enumerate(snap.skus):
+            rows = order[bounds[sku]:bounds[sku + 1]]
+            photos = [self._photo(row, scores) for row in rows]
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    best = selector._smart_select_best(photos, self.num_best, folder) if photos else []
+                selections[folder] = [photo['filename'] for photo in best]
+            except Exception:
+                selections[folder] = None
+        return selections
+
+    def run(self, selector: SmartPhotoSelector) -> Dict:
+        start = time.perf_counter()
+        scores = self.score(selector)
+        scored = time.perf_counter()
+        selections = self.select(selector, scores)
+        return {
+            'scores': scores,
+            'selections': selections,
+            'score_sec': scored - start,
+            'select_sec': time.perf_counter() - scored,
+        }
+
+
+def diff_runs(snapshot: CatalogSnapshot, baseline: Dict, candidate: Dict) -> Dict:
+    """Изменения выбора по SKU и изменения оценок по фотографиям"""
+    changed = []
+    for folder in snapshot.skus:
+        before = baseline['selections'].get(folder)
+        after = candidate['selections'].get(folder)
+        if before != after:
+            changed.append({'sku': folder, 'baseline': before, 'candidate': after})
+
+    old, new = baseline['scores'], candidate['scores']
+    return {
+        'images': len(snapshot),
+        'skus': len(snapshot.skus),
+        'skus_changed': len(changed),
+        'content_type_changed': int(np.sum(old['content_type'] != new['content_type'])),
+        'main_view_changed': int(np.sum(old['main_view'] != new['main_view'])),
+        'mean_final_score_delta': round(float(np.mean(new['final_score'] - old['final_score'])), 4)
+        if len(snapshot) else 0.0,
+        'changed': changed,
+    }
+
+
+def main():
+    """Главная функция"""
+    parser = argparse.ArgumentParser(description="Пересчет оценок и выбора по кэшу инференса")
+    parser.add_argument('config', help="JSON с кандидатной конфигурацией правил")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="база кэша инференса")
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH, help="модель, чьи записи пересчитываются")
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help="бэкенд, которым получены записи")
+    parser.add_argument('--report', default="rescore_report.json", help="файл отчета")
+    args = parser.parse_args()
+
+    print("🔁 ПЕРЕСЧЕТ ОЦЕНОК ПО КЭШУ ИНФЕРЕНСА (ЧТО ЕСЛИ)")
+    print("="*50)
+    with open(args.config, encoding='utf-8') as f:
+        config = json.load(f)
+
+    if not os.path.exists(args.cache):
+        print(f"❌ Кэш инференса не найден: {args.cache} (сначала прогон с --cache)")
+        return
+
+    folders = [f"fotos/{folder}/big" for folder in get_all_folders()]
+    start = time.perf_counter()
+    id2label = load_id2label(args.model_path)
+    try:
+        # Конфигурация проверяется до чтения каталога: ошибка в ней видна сразу
+        candidate_selector = apply_config(SmartPhotoSelector(), config, list(id2label.values()))
+        snapshot = CatalogSnapshot.from_cache(InferenceCache(args.cache), folders,
+                                              model_identity(args.model_path, args.backend), id2label)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    print(f"📦 Загружено {len(snapshot)} фото из {len(folders)} SKU за {time.perf_counter() - start:.2f} с")
+    if snapshot.missing:
+        print(f"⚠️ Нет записей в кэше: {len(snapshot.missing)} фото (не участвуют в пересчете)")
+
+    rescorer = WhatIfRescorer(snapshot)
+    baseline = rescorer.run(SmartPhotoSelector())
+    candidate = rescorer.run(candidate_selector)
+    diff = diff_runs(snapshot, baseline, candidate)
+    print(f"⚡ Пересчет: оценки {candidate['score_sec']:.2f} с, выбор {candidate['select_sec']:.2f} с")
+
+    print(f"\n📊 Изменился выбор: {diff['skus_changed']}/{diff['skus']} SKU")
+    print(f"   🔄 content_type изменился у {diff['content_type_changed']} фото, "
+          f"ракурс - у {diff['main_view_changed']} фото")
+    print(f"   ⭐ Среднее изменение final_score: {diff['mean_final_score_delta']:+.4f}")
+    for change in diff['changed']:
+        print(f"   📁 {change['sku']}: {change['baseline']} -> {change['candidate']}")
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': config,
+        'model': model_identity(args.model_path, args.backend),
+        'missing_images': snapshot.missing,
+        'timing_sec': {'score': round(candidate['score_sec'], 3), 'select': round(candidate['select_sec'], 3)},
+        **diff,
+    }
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 Отчет сохранен: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
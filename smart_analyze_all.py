@@ -8,7 +8,18 @@
 
 import os
 import sys
+import argparse
 from smart_photo_selector import SmartPhotoSelector
+from model_registry import model_registry, DEFAULT_BACKEND, BACKENDS
+from inference import DEFAULT_BATCH_SIZE, find_image_files
+from photo_pipeline import PipelineConfig
+from model_cascade import SMALL_MODEL_PATH, SMALL_MODEL_BACKEND
+from inference_cache import InferenceCache, DEFAULT_CACHE_PATH
+from stage_timer import summarize, print_summary
+
+# Сколько фото классифицируется одной группой папок: записи (полные вероятности
+# по 1000 меткам) держатся в памяти только для текущей группы
+FOLDER_GROUP_IMAGES = 512
 
 def get_all_folders():
     """Получает все папки для анализа"""
@@ -28,8 +39,26 @@ def get_all_folders():
     
     return sorted(folders, key=lambda x: int(x))
 
-def analyze_folder(folder_number):
-    """Анализирует одну папку"""
+def folder_groups(folder_paths, max_images=FOLDER_GROUP_IMAGES):
+    """Группы соседних папок примерно по max_images фото (папка целиком в одной группе)"""
+    group, images = [], 0
+    for folder, path in folder_paths.items():
+        count = len(find_image_files(path)) if os.path.isdir(path) else 0
+        if group and images + count > max_images:
+            yield group
+            group, images = [], 0
+        group.append(folder)
+        images += count
+    if group:
+        yield group
+
+def analyze_folder(folder_number, records=None, batch_size=DEFAULT_BATCH_SIZE, assessments=None,
+                   backend=DEFAULT_BACKEND, cache=None, timing=None, stage_samples=None, streaming=False,
+                   cascade_model_path=None, cascade_backend=SMALL_MODEL_BACKEND, pipeline_config=None):
+    """Анализирует одну папку (records/assessments - заранее полученные записи инференса или оценки).
+    stage_samples - список, куда добавляются замеры этапов (папка, фото) при включенном timing;
+    streaming - потоковый режим с ограниченной памятью; cascade_model_path/pipeline_config -
+    каскад или конвейер внутри папки (когда записи не получены заранее)"""
     print(f"\n{'='*60}")
     print(f"🧠 АНАЛИЗ ПАПКИ {folder_number}")
     print(f"{'='*60}")
@@ -43,10 +72,15 @@ def analyze_folder(folder_number):
     
     try:
         # Создаем умный селектор
-        selector = SmartPhotoSelector()
+        selector = SmartPhotoSelector(backend=backend, batch_size=batch_size, cache=cache, timing=timing,
+                                      streaming=streaming, cascade_model_path=cascade_model_path,
+                                      cascade_backend=cascade_backend)
+        selector.pipeline_config = pipeline_config
         
         # Запускаем анализ
-        best_photos = selector.select_best_photos(folder_path, 2)
+        best_photos = selector.select_best_photos(folder_path, 2, records, assessments)
+        if stage_samples is not None and selector.timer.enabled:
+            stage_samples.append((selector.stage_timings, selector.image_timings))
         
         if best_photos:
             print(f"\n✅ Папка {folder_number} проанализирована успешно!")
@@ -62,6 +96,36 @@ def analyze_folder(folder_number):
 
 def main():
     """Главная функция"""
+    parser = argparse.ArgumentParser(description="Умный анализ всех папок fotos/*/big")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"размер пакета инференса (по умолчанию {DEFAULT_BATCH_SIZE})")
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help="бэкенд модели: hf-pipeline (fp32), hf-pipeline-int8, hf-pipeline-bf16, onnx, torchscript или fake")
+    # Каскад и конвейер - разные способы инференса по всем папкам: только один за прогон
+    inference_mode = parser.add_mutually_exclusive_group()
+    inference_mode.add_argument('--cascade', nargs='?', const=SMALL_MODEL_PATH, default=None, metavar='SMALL_MODEL',
+                                help=f"каскад: сначала маленькая модель (по умолчанию {SMALL_MODEL_PATH}), "
+                                     f"Large - только для спорных фото")
+    parser.add_argument('--cascade-backend', choices=BACKENDS, default=SMALL_MODEL_BACKEND,
+                        help=f"бэкенд маленькой модели каскада (по умолчанию {SMALL_MODEL_BACKEND}): "
+                             f"onnx/torchscript требуют отдельного экспорта Tiny")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, default=None, metavar='DB',
+                        help=f"постоянный кэш инференса SQLite (по умолчанию {DEFAULT_CACHE_PATH}): "
+                             f"модель вызывается только для новых или измененных фото")
+    inference_mode.add_argument('--pipeline', action='store_true',
+                                help="конвейер: чтение, декодирование, инференс и оценка параллельно")
+    parser.add_argument('--read-workers', type=int, default=2, help="потоков чтения файлов")
+    parser.add_argument('--decode-workers', type=int, default=2, help="потоков декодирования")
+    parser.add_argument('--inference-workers', type=int, default=1, help="потоков инференса")
+    parser.add_argument('--score-workers', type=int, default=1, help="потоков оценки")
+    parser.add_argument('--max-in-flight', type=int, default=32, help="максимум изображений в конвейере")
+    parser.add_argument('--timing', action='store_true',
+                        help="поэтапные замеры времени (в smart_analysis_report.json и сводка p50/p95/max)")
+    parser.add_argument('--stream', action='store_true',
+                        help="потоковый режим для очень больших папок: инференс блоками внутри папки, "
+                             "оценки в all_photos.jsonl, в памяти только претенденты")
+    args = parser.parse_args()
+    
     print("🧠 УМНЫЙ АНАЛИЗ ВСЕХ ПАПОК С АВТОМАТИЧЕСКИМИ ПРАВИЛАМИ")
     print("="*70)
     print("🤖 AI модель: ConvNeXt Large + умные правила")
@@ -83,15 +147,68 @@ def main():
         print(f"   📁 Папка {folder}: fotos/{folder}/big")
     print()
     
+    cache = InferenceCache(args.cache) if args.cache else None
+    
+    # Загружаем модель один раз для всех папок (сервер модели, микропакеты - как у селектора)
+    base_selector = SmartPhotoSelector(backend=args.backend, batch_size=args.batch_size,
+                                       cascade_model_path=args.cascade,
+                                       cascade_backend=args.cascade_backend, cache=cache)
+    if not base_selector.load_model():
+        print("❌ Не удалось загрузить AI модель!")
+        return
+    
+    folder_paths = {folder: f"fotos/{folder}/big" for folder in folders}
+    folder_records = {}
+    folder_assessments = {}
+    engine = None
+    pipeline_config = PipelineConfig(
+        read_workers=args.read_workers, decode_workers=args.decode_workers,
+        inference_workers=args.inference_workers, score_workers=args.score_workers,
+        max_in_flight=args.max_in_flight) if args.pipeline else None
+    
+    if args.stream:
+        # Потоковый режим: каждая папка сама классифицирует свои фото блоками
+        # (каскадом или конвейером, если они заданы)
+        mode = " каскадом" if args.cascade else " конвейером" if args.pipeline else ""
+        print(f"🌊 Потоковый режим: инференс{mode} блоками внутри каждой папки, оценки в all_photos.jsonl")
+    elif args.pipeline:
+        # Конвейер сразу по всем папкам: чтение с диска перекрывается с инференсом
+        base_selector.pipeline_config = pipeline_config
+        all_paths = {folder: [os.path.join(path, f) for f in find_image_files(path)]
+                     for folder, path in folder_paths.items()}
+        assessments = base_selector.run_pipeline([p for paths in all_paths.values() for p in paths])
+        folder_assessments = {folder: {p: assessments[p] for p in paths if p in assessments}
+                              for folder, paths in all_paths.items()}
+    elif args.cascade:
+        # Каскад сразу по всем папкам: Large только для спорных фото и претендентов на слоты
+        cascade = base_selector.build_cascade()
+        folder_records = cascade.classify_folders(list(folder_paths.values()))
+        cascade.print_stats()
+    else:
+        # Пакетный инференс группами папок: пакеты не ограничены размером одной папки,
+        # а память - размером группы
+        engine = base_selector.new_engine(fast_decode=base_selector.fast_decode)
+    
     # Анализируем каждую папку
     successful = 0
     failed = 0
+    stage_samples = []
     
-    for folder in folders:
-        if analyze_folder(folder):
-            successful += 1
-        else:
-            failed += 1
+    # В потоковом режиме каскад и конвейер работают внутри папки
+    stream_settings = dict(cascade_model_path=args.cascade, cascade_backend=args.cascade_backend,
+                           pipeline_config=pipeline_config) if args.stream else {}
+    groups = folder_groups(folder_paths) if engine is not None else [folders]
+    for group in groups:
+        if engine is not None:
+            # Записи группы заменяют записи предыдущей: в памяти только текущая группа
+            folder_records = engine.classify_folders([folder_paths[folder] for folder in group])
+        for folder in group:
+            if analyze_folder(folder, folder_records.get(folder_paths[folder]), args.batch_size,
+                              folder_assessments.get(folder), args.backend, cache,
+                              args.timing or None, stage_samples, args.stream, **stream_settings):
+                successful += 1
+            else:
+                failed += 1
     
     # Итоговый отчет
     print(f"\n{'='*70}")
@@ -100,6 +217,21 @@ def main():
     print(f"✅ Успешно проанализировано: {successful} папок")
     print(f"❌ Ошибок: {failed} папок")
     print(f"📁 Всего папок: {len(folders)}")
+    model_registry.print_stats()
+    if args.stream:
+        if args.cascade or args.pipeline:
+            print("🌊 Статистика каскада/конвейера выведена по каждой папке")
+    elif args.pipeline:
+        print(f"🏭 Узкое место конвейера: {base_selector.pipeline_stats['bottleneck']}")
+    elif args.cascade:
+        cascade.print_stats()
+    else:
+        engine.print_stats()
+    if cache is not None:
+        cache.print_stats()
+    if stage_samples:
+        print_summary(summarize(folder for folder, _ in stage_samples), "Этапы папок")
+        print_summary(summarize(image for _, images in stage_samples for image in images), "Этапы фото")
     
     if successful > 0:
         print(f"\n🎉 Результаты сохранены в общей папке:")
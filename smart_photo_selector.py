@@ -6,15 +6,35 @@
 Работает с новыми папками без дополнительной настройки!
 """
 
-from transformers import pipeline
 from PIL import Image
 import os
 import numpy as np
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Sequence, Tuple
 import shutil
 import json
 import re
 
+from model_registry import model_registry, DEFAULT_MODEL_PATH, DEFAULT_BACKEND, BACKENDS
+from micro_batching import micro_batched
+from model_server import connect_model_server
+from inference import (InferenceRecord, BatchInferenceEngine, DEFAULT_BATCH_SIZE,
+                       as_top_k, classify_image, find_image_files, iter_image_files, preprocess_tag,
+                       record_cache_key)
+from image_decoder import DecodedImage, decode_source, reduce_for_classifier, source_name
+from photo_pipeline import StagedPipeline, PipelineConfig
+from model_cascade import ModelCascade, SMALL_MODEL_PATH, SMALL_MODEL_BACKEND, rule_ambiguity
+from label_weights import classifier_id2label, compiled_label_weights
+from inference_cache import InferenceCache, DEFAULT_CACHE_PATH, model_identity
+from stage_timer import StageTimer, rounded, summarize, print_summary
+from streaming_selection import (StreamingSelection, STREAM_CHUNK_SIZE, STREAM_DETAIL_FILE, chunked,
+                                 is_single_product, assessment_event, selection_event, final_event,
+                                 final_selection)
+
+# Выходы выбора по папке: копии лучших фото и JSON-отчет в smart_photos_results/folder_N
+COPY_SINK = 'copy'
+REPORT_SINK = 'report'
+DEFAULT_SINKS = (COPY_SINK, REPORT_SINK)
+
 class SmartPhotoSelector:
     """Умный селектор фотографий с автоматическими правилами
     
@@ -23,8 +43,40 @@ class SmartPhotoSelector:
     Дата: 2024
     """
     
-    def __init__(self):
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND,
+                 batch_size: int = DEFAULT_BATCH_SIZE, cascade_model_path: Optional[str] = None,
+                 cascade_backend: str = SMALL_MODEL_BACKEND,
+                 cache: Optional[InferenceCache] = None, timing: Optional[bool] = None,
+                 streaming: bool = False, model_server: Optional[str] = None):
         self.classifier = None
+        self.model_path = model_path
+        self.backend = backend
+        # Сервер модели хоста (Unix socket): None - путь из окружения, '' - только локальная модель
+        self.model_server = model_server
+        self.batch_size = batch_size
+        self.fast_decode = True  # уменьшенное JPEG-декодирование перед классификатором
+        self.pipeline_config: Optional[PipelineConfig] = None  # конвейер чтение/декодирование/инференс/оценка
+        self.inference_stats = {}
+        self.pipeline_stats = {}
+        # Каскад: маленькая модель для всех фото, Large - только для спорных
+        self.cascade_model_path = cascade_model_path
+        self.cascade_backend = cascade_backend
+        self.cascade_stats = {}
+        # Словари ключевых слов, скомпилированные в векторы по id2label модели
+        self.label_weights = None
+        # Постоянный кэш инференса (ключ - хэш содержимого файла + модель + препроцессинг)
+        self.cache = cache
+        # Идентичности моделей для ключей кэша: считаются один раз за load_model, а не на каждое фото
+        self.model_keys: Dict[Tuple[str, str], str] = {}
+        self.cache_stats = {}
+        self.cache_counters = None
+        # Поэтапные замеры времени (None - по переменной окружения PHOTO_SELECTOR_TIMING)
+        self.timer = StageTimer(timing)
+        self.stage_timings = {}
+        self.image_timings = []
+        # Потоковый режим для очень больших папок: оценки в JSONL, в памяти только претенденты
+        self.streaming = streaming
+        self.streaming_stats = {}
         
         # КЛЮЧЕВЫЕ СЛОВА ДЛЯ АНАЛИЗА
         self.MAIN_PRODUCT_KEYWORDS = {
@@ -89,13 +141,37 @@ class SmartPhotoSelector:
             'pocket': -0.1,        # карман
             'zipper': -0.2         # молния
         }
+        
+        # ПОРОГИ ПРАВИЛ (тип содержимого и ракурс)
+        self.RULE_THRESHOLDS = {
+            'main_product_score': 2.0,      # MAIN_PRODUCT: оценка товара выше
+            'main_product_penalty': -3.0,   # ... и штраф за детали выше
+            'good_product_score': 1.0,      # GOOD_PRODUCT
+            'good_product_penalty': -2.0,
+            'details_only_penalty': -3.0,   # DETAILS_ONLY: штраф ниже
+            'front_score': 1.0,             # FRONT: передний вид выше
+            'front_back_ratio': 1.5,        # ... и выше |задний вид| * коэффициент
+            'back_score': -2.0,             # BACK: задний вид ниже
+        }
     
     def load_model(self) -> bool:
-        """Загружает ConvNeXt Large модель"""
+        """Подключается к серверу модели хоста, иначе берет ConvNeXt Large из общего реестра
+        (загрузка один раз на процесс)"""
+        self.model_keys = {}  # веса могли смениться с прошлой загрузки
         try:
-            print("🚀 Загружаю ConvNeXt Large - лучшую AI модель...")
-            self.classifier = pipeline("image-classification", model="./models/convnext-large-224")
-            print("✅ ConvNeXt Large загружена успешно!")
+            client = connect_model_server(self.model_server, self.model_path, self.backend)
+            if client is not None:
+                print(f"🔌 ConvNeXt Large на сервере модели: {client.socket_path}")
+                self.classifier = client
+            else:
+                if model_registry.is_loaded(self.model_path, self.backend):
+                    print("♻️ ConvNeXt Large уже загружена, используем модель из реестра")
+                else:
+                    print("🚀 Загружаю ConvNeXt Large - лучшую AI модель...")
+                # Микропакеты (PHOTO_SELECTOR_MICRO_BATCH): общая очередь инференса для потоков процесса
+                self.classifier = micro_batched(model_registry.acquire(self.model_path, self.backend))
+            self.label_weights = self.compile_label_weights(self.classifier)
+            print("✅ ConvNeXt Large готова к работе!")
             print("   📊 Ожидаемая точность: 86.6%")
             print("   🎯 Автоматические правила: работает с любыми папками!")
             return True
@@ -103,13 +179,101 @@ class SmartPhotoSelector:
             print(f"❌ Ошибка при загрузке модели: {e}")
             return False
     
-    def analyze_photo_content(self, ai_results: List[Dict]) -> Dict:
-        """Анализирует содержимое фотографии"""
+    def model_key(self, model_path: Optional[str] = None, backend: Optional[str] = None) -> Optional[str]:
+        """Идентичность модели для кэша инференса (None - кэш выключен)"""
+        if self.cache is None:
+            return None
+        model_path = model_path or self.model_path
+        backend = backend or self.backend
+        if (model_path, backend) not in self.model_keys:
+            self.model_keys[(model_path, backend)] = model_identity(model_path, backend)
+        return self.model_keys[(model_path, backend)]
+    
+    def new_engine(self, fast_decode: bool) -> BatchInferenceEngine:
+        """Пакетный движок Large с общим кэшем инференса"""
+        return BatchInferenceEngine(self.classifier, self.batch_size, fast_decode=fast_decode,
+                                    cache=self.cache, model_key=self.model_key())
+    
+    def classify(self, img) -> InferenceRecord:
+        """Один прогон классификатора по изображению"""
+        return classify_image(self.classifier, img)
+    
+    def compile_label_weights(self, classifier):
+        """Компилирует словари ключевых слов в векторы по меткам модели (один раз на процесс)"""
+        id2label = classifier_id2label(classifier)
+        if id2label is None:
+            return None
+        return compiled_label_weights(id2label, {
+            'main': self.MAIN_PRODUCT_KEYWORDS,
+            'detail': self.DETAIL_KEYWORDS,
+            'front': self.FRONT_VIEW_INDICATORS,
+            'back': self.BACK_VIEW_INDICATORS,
+        })
+    
+    def precompute_rule_scores(self, records) -> int:
+        """Оценки правил для всего пакета записей одним умножением матриц.
+        Как в цикле правил, учитываются только топ-5 метки: взвешенные оценки (товар,
+        передний вид) - вероятность * вес, штрафы (детали, задний вид) - сумма весов.
+        Оценки пересчитываются, если записи оценены другими таблицами ключевых слов"""
+        if self.label_weights is None:
+            return 0
+        batch = [record for record in records
+                 if record is not None and record.rule_weights is not self.label_weights
+                 and record.probabilities is not None
+                 and len(record.probabilities) == len(self.label_weights)]
+        if not batch:
+            return 0
+        
+        probabilities = np.stack([record.probabilities for record in batch])
+        mask = self.label_weights.top_k_mask([record.labels[:5] for record in batch])
+        weighted, counted = self.label_weights.masked_scores(probabilities, mask)
+        for row, record in enumerate(batch):
+            record.rule_scores = {
+                'main_product_score': float(weighted['main'][row]),
+                'detail_penalty': float(counted['detail'][row]),
+                'front_score': float(weighted['front'][row]),
+                'back_score': float(counted['back'][row]),
+            }
+            record.rule_weights = self.label_weights
+        return len(batch)
+    
+    def _rule_scores(self, ai_results) -> Optional[Dict[str, float]]:
+        """Векторные оценки правил записи (None - только топ-k, считаем циклом)"""
+        if not isinstance(ai_results, InferenceRecord):
+            return None
+        if ai_results.rule_weights is not self.label_weights:
+            self.precompute_rule_scores([ai_results])
+        return ai_results.rule_scores if ai_results.rule_weights is self.label_weights else None
+    
+    def _keyword_lines(self, ai_results, name: str, weighted: bool, template: str) -> List[str]:
+        """Текстовый анализ топ-5 по скомпилированным весам (формат прежнего цикла)"""
+        lines = []
+        for result in as_top_k(ai_results)[:5]:
+            label = result['label'].lower()
+            score = result['score']
+            weight = self.label_weights.weight(name, label)
+            if weight:
+                value = score * weight if weighted else weight
+                lines.append(template.format(label=label, score=score, weight=weight, value=value))
+        return lines
+    
+    def analyze_photo_content(self, ai_results) -> Dict:
+        """Анализирует содержимое фотографии (InferenceRecord или топ-k pipeline)"""
         main_product_score = 0.0
         detail_penalty = 0.0
         content_analysis = []
         
-        for result in ai_results[:5]:
+        rule_scores = self._rule_scores(ai_results)
+        if rule_scores is not None:
+            # Векторный путь: одно скалярное произведение по всем меткам модели
+            main_product_score = rule_scores['main_product_score']
+            detail_penalty = rule_scores['detail_penalty']
+            content_analysis.extend(self._keyword_lines(
+                ai_results, 'main', True, "🟢 ОСНОВНОЙ ТОВАР: {label} ({score:.3f}) * {weight} = {value:.3f}"))
+            content_analysis.extend(self._keyword_lines(
+                ai_results, 'detail', False, "🔴 ДЕТАЛЬ: {label} ({score:.3f}) штраф {weight} = {value:.1f}"))
+        
+        for result in (as_top_k(ai_results)[:5] if rule_scores is None else []):
             label = result['label'].lower()
             score = result['score']
             
@@ -128,11 +292,14 @@ class SmartPhotoSelector:
                     break
         
         # Определяем тип содержимого
-        if main_product_score > 2.0 and detail_penalty > -3.0:
+        thresholds = self.RULE_THRESHOLDS
+        if (main_product_score > thresholds['main_product_score']
+                and detail_penalty > thresholds['main_product_penalty']):
             content_type = "MAIN_PRODUCT"
-        elif main_product_score > 1.0 and detail_penalty > -2.0:
+        elif (main_product_score > thresholds['good_product_score']
+                and detail_penalty > thresholds['good_product_penalty']):
             content_type = "GOOD_PRODUCT"
-        elif detail_penalty < -3.0:
+        elif detail_penalty < thresholds['details_only_penalty']:
             content_type = "DETAILS_ONLY"
         else:
             content_type = "MIXED"
@@ -144,13 +311,22 @@ class SmartPhotoSelector:
             'analysis': content_analysis
         }
     
-    def analyze_photo_viewpoint(self, ai_results: List[Dict]) -> Dict:
-        """Анализирует ракурс фотографии"""
+    def analyze_photo_viewpoint(self, ai_results) -> Dict:
+        """Анализирует ракурс фотографии (InferenceRecord или топ-k pipeline)"""
         front_score = 0.0
         back_score = 0.0
         viewpoint_analysis = []
         
-        for result in ai_results[:5]:
+        rule_scores = self._rule_scores(ai_results)
+        if rule_scores is not None:
+            front_score = rule_scores['front_score']
+            back_score = rule_scores['back_score']
+            viewpoint_analysis.extend(self._keyword_lines(
+                ai_results, 'front', True, "🟢 Передний вид: {label} ({score:.3f}) * {weight} = {value:.3f}"))
+            viewpoint_analysis.extend(self._keyword_lines(
+                ai_results, 'back', False, "🔴 Задний вид: {label} ({score:.3f}) штраф {weight} = {value:.1f}"))
+        
+        for result in (as_top_k(ai_results)[:5] if rule_scores is None else []):
             label = result['label'].lower()
             score = result['score']
             
@@ -169,10 +345,12 @@ class SmartPhotoSelector:
                     break
         
         # Определяем основной ракурс
-        if front_score > 1.0 and front_score > abs(back_score) * 1.5:
+        thresholds = self.RULE_THRESHOLDS
+        if (front_score > thresholds['front_score']
+                and front_score > abs(back_score) * thresholds['front_back_ratio']):
             main_view = "FRONT"
             view_score = front_score
-        elif back_score < -2.0:
+        elif back_score < thresholds['back_score']:
             main_view = "BACK"
             view_score = back_score
         else:
@@ -187,152 +365,298 @@ class SmartPhotoSelector:
             'analysis': viewpoint_analysis
         }
     
-    def assess_photo(self, image_path: str) -> Optional[Dict]:
+    def cascade_ambiguity(self, record: InferenceRecord) -> List[str]:
+        """Причины, по которым решение маленькой модели нужно перепроверить Large"""
+        content_info = self.analyze_photo_content(record)
+        viewpoint_info = self.analyze_photo_viewpoint(record)
+        return rule_ambiguity(content_info['main_product_score'],
+                              viewpoint_info['front_score'], viewpoint_info['back_score'])
+    
+    def build_cascade(self) -> ModelCascade:
+        """Каскад маленькая модель -> Large (Large уже должна быть загружена)"""
+        small_classifier = model_registry.acquire(self.cascade_model_path, self.cascade_backend)
+        return ModelCascade(small_classifier, self.classifier, self.cascade_ambiguity,
+                            self.assess_photo, self.batch_size, fast_decode=self.fast_decode,
+                            cache=self.cache, small_model_key=self.model_key(self.cascade_model_path, self.cascade_backend),
+                            large_model_key=self.model_key())
+    
+    def run_cascade(self, image_paths: List[str]) -> Dict[str, InferenceRecord]:
+        """Классифицирует файлы каскадом и сохраняет долю переданных в Large"""
+        cascade = self.build_cascade()
+        records = cascade.classify_paths(image_paths)
+        cascade.print_stats()
+        self.cascade_stats = cascade.get_stats()
+        self.inference_stats = cascade.large_engine.get_stats()
+        return records
+    
+    def assess_photo(self, image_path: str, record: Optional[InferenceRecord] = None) -> Optional[Dict]:
         """Оценивает фотографию с помощью AI анализа"""
+        timings = self.timer.image_timings()
         try:
             with Image.open(image_path) as img:
-                # Базовая информация
-                width, height = img.size
-                file_size = os.path.getsize(image_path)
-                aspect_ratio = width / height
-                size_mb = file_size / (1024 * 1024)
+                # Базовая информация (из заголовка, до уменьшенного декодирования)
+                with self.timer.stage('header', timings):
+                    width, height = img.size
+                    img_mode, img_format = img.mode, img.format
+                    file_size = os.path.getsize(image_path)
                 
-                # 1. ОСНОВНЫЕ ТРЕБОВАНИЯ (25% веса)
-                basic_score = 0.0
+                meta = DecodedImage(image_path, None, width, height, img_mode, img_format, file_size)
                 
-                # Разрешение
-                if width >= 800 and height >= 800:
-                    basic_score += 2.0
-                if width >= 1200 and height >= 1200:
-                    basic_score += 1.0
-                if width >= 1920 and height >= 1920:
-                    basic_score += 1.0
+                # ЕДИНСТВЕННЫЙ ПРОГОН МОДЕЛИ: запись используется всеми анализами
+                # (может быть получена заранее пакетным инференсом или взята из кэша)
+                inference_error = None
+                cache_key = None
+                if self.classifier and record is None and self.cache is not None:
+                    with self.timer.stage('cache_lookup', timings):
+                        cache_key = record_cache_key(self.model_key(), preprocess_tag(False, self.fast_decode))
+                        record, _ = self.cache.lookup(image_path, cache_key)
+                if self.classifier and record is None:
+                    try:
+                        with self.timer.stage('decode', timings):
+                            image = reduce_for_classifier(img) if self.fast_decode else img
+                        with self.timer.stage('inference', timings):
+                            record = self.classify(image)
+                        if cache_key:
+                            self.cache.store(image_path, cache_key, record, meta)
+                    except Exception as e:
+                        inference_error = e
                 
-                # Соотношение сторон
-                if 0.9 <= aspect_ratio <= 1.1:  # Квадратные
-                    basic_score += 1.0
-                elif 1.2 <= aspect_ratio <= 1.5:  # Стандартные
-                    basic_score += 0.8
-                elif 0.6 <= aspect_ratio <= 0.9:  # Вертикальные
-                    basic_score += 0.7
-                else:
-                    basic_score += 0.3
+                with self.timer.stage('scoring', timings):
+                    assessment = self.score_photo(meta, record, inference_error)
+                if timings is not None:
+                    assessment['timings_ms'] = rounded(timings)
+                return assessment
                 
-                # Цветовой режим
-                if img.mode == 'RGB':
-                    basic_score += 1.0
-                elif img.mode == 'RGBA':
-                    basic_score += 0.8
-                else:
-                    basic_score += 0.5
-                
-                # 2. ТЕХНИЧЕСКОЕ КАЧЕСТВО (20% веса)
-                technical_score = 0.0
+        except Exception as e:
+            print(f"   ❌ Ошибка при анализе {os.path.basename(image_path)}: {e}")
+            return None
+    
+    def score_photo(self, meta, record: Optional[InferenceRecord] = None,
+                    inference_error: Optional[Exception] = None) -> Dict:
+        """Считает оценки по метаданным файла и записи инференса (без чтения файла)"""
+        width, height = meta.width, meta.height
+        img_mode, img_format = meta.mode, meta.format
+        file_size = meta.file_size
+        aspect_ratio = width / height
+        size_mb = file_size / (1024 * 1024)
+        
+        # 1. ОСНОВНЫЕ ТРЕБОВАНИЯ (25% веса)
+        basic_score = 0.0
+        
+        # Разрешение
+        if width >= 800 and height >= 800:
+            basic_score += 2.0
+        if width >= 1200 and height >= 1200:
+            basic_score += 1.0
+        if width >= 1920 and height >= 1920:
+            basic_score += 1.0
+        
+        # Соотношение сторон
+        if 0.9 <= aspect_ratio <= 1.1:  # Квадратные
+            basic_score += 1.0
+        elif 1.2 <= aspect_ratio <= 1.5:  # Стандартные
+            basic_score += 0.8
+        elif 0.6 <= aspect_ratio <= 0.9:  # Вертикальные
+            basic_score += 0.7
+        else:
+            basic_score += 0.3
+        
+        # Цветовой режим
+        if img_mode == 'RGB':
+            basic_score += 1.0
+        elif img_mode == 'RGBA':
+            basic_score += 0.8
+        else:
+            basic_score += 0.5
+        
+        # 2. ТЕХНИЧЕСКОЕ КАЧЕСТВО (20% веса)
+        technical_score = 0.0
+        
+        # Размер файла
+        if 0.1 <= size_mb <= 2.0:
+            technical_score += 1.0
+        elif 0.05 <= size_mb <= 5.0:
+            technical_score += 0.8
+        else:
+            technical_score += 0.3
+        
+        # Четкость
+        pixels = width * height
+        compression_ratio = pixels / file_size
+        if 100 <= compression_ratio <= 1000:
+            technical_score += 1.0
+        else:
+            technical_score += 0.5
+        
+        # 3. AI АНАЛИЗ СОДЕРЖИМОГО (35% веса)
+        content_score = 0.0
+        content_analysis = []
+        content_type = "UNKNOWN"
+        
+        if self.classifier:
+            try:
+                if inference_error:
+                    raise inference_error
                 
-                # Размер файла
-                if 0.1 <= size_mb <= 2.0:
-                    technical_score += 1.0
-                elif 0.05 <= size_mb <= 5.0:
-                    technical_score += 0.8
-                else:
-                    technical_score += 0.3
+                # Анализируем содержимое
+                content_info = self.analyze_photo_content(record)
+                content_score = content_info['main_product_score'] + content_info['detail_penalty']
+                content_type = content_info['content_type']
+                content_analysis = content_info['analysis']
                 
-                # Четкость
-                pixels = width * height
-                compression_ratio = pixels / file_size
-                if 100 <= compression_ratio <= 1000:
-                    technical_score += 1.0
-                else:
-                    technical_score += 0.5
+                # Нормализуем оценку содержимого до 3.5
+                content_score = min(max(content_score, 0.0), 3.5)
                 
-                # 3. AI АНАЛИЗ СОДЕРЖИМОГО (35% веса)
-                content_score = 0.0
-                content_analysis = []
-                content_type = "UNKNOWN"
+            except Exception as e:
+                content_analysis.append(f"⚠️ Ошибка AI анализа: {e}")
+                content_score = 1.0
+        
+        # 4. АНАЛИЗ РАКУРСА (20% веса)
+        viewpoint_score = 0.0
+        viewpoint_analysis = []
+        main_view = "UNKNOWN"
+        
+        if self.classifier:
+            try:
+                if inference_error:
+                    raise inference_error
+                viewpoint_info = self.analyze_photo_viewpoint(record)
                 
-                if self.classifier:
-                    try:
-                        results = self.classifier(img)
-                        
-                        # Анализируем содержимое
-                        content_info = self.analyze_photo_content(results)
-                        content_score = content_info['main_product_score'] + content_info['detail_penalty']
-                        content_type = content_info['content_type']
-                        content_analysis = content_info['analysis']
-                        
-                        # Нормализуем оценку содержимого до 3.5
-                        content_score = min(max(content_score, 0.0), 3.5)
-                        
-                    except Exception as e:
-                        content_analysis.append(f"⚠️ Ошибка AI анализа: {e}")
-                        content_score = 1.0
+                # Оценка ракурса
+                if viewpoint_info['main_view'] == 'FRONT':
+                    viewpoint_score = 2.0  # Максимум за передний вид
+                    viewpoint_analysis.append(f"🟢 ПЕРЕДНИЙ ВИД: идеально для первой фотографии!")
+                elif viewpoint_info['main_view'] == 'BACK':
+                    viewpoint_score = 0.0  # Минимум за задний вид
+                    viewpoint_analysis.append(f"🔴 ЗАДНИЙ ВИД: НЕ подходит для первой фотографии!")
+                else:
+                    viewpoint_score = 1.0  # Среднее за боковой вид
+                    viewpoint_analysis.append(f"🟡 БОКОВОЙ ВИД: приемлемо")
                 
-                # 4. АНАЛИЗ РАКУРСА (20% веса)
-                viewpoint_score = 0.0
-                viewpoint_analysis = []
-                main_view = "UNKNOWN"
+                main_view = viewpoint_info['main_view']
+                viewpoint_analysis.extend(viewpoint_info['analysis'])
                 
-                if self.classifier:
+            except Exception as e:
+                viewpoint_analysis.append(f"⚠️ Ошибка анализа ракурса: {e}")
+                viewpoint_score = 1.0
+        
+        # 5. ИТОГОВАЯ ОЦЕНКА
+        total_score = basic_score + technical_score + content_score + viewpoint_score
+        final_score = min(total_score, 10.0)
+        
+        # Дополнительная информация
+        is_main_product = content_type in ["MAIN_PRODUCT", "GOOD_PRODUCT"]
+        is_front_view = viewpoint_score >= 1.5
+        is_back_view = viewpoint_score <= 0.5
+        is_details_only = content_type == "DETAILS_ONLY"
+        
+        return {
+            'basic_score': round(basic_score, 2),
+            'technical_score': round(technical_score, 2),
+            'content_score': round(content_score, 2),
+            'viewpoint_score': round(viewpoint_score, 2),
+            'final_score': round(final_score, 2),
+            'content_type': content_type,
+            'main_view': main_view,
+            'is_main_product': is_main_product,
+            'is_front_view': is_front_view,
+            'is_back_view': is_back_view,
+            'is_details_only': is_details_only,
+            'content_analysis': content_analysis,
+            'viewpoint_analysis': viewpoint_analysis,
+            'width': width,
+            'height': height,
+            'aspect_ratio': round(aspect_ratio, 2),
+            'file_size_mb': round(size_mb, 2),
+            'format': img_format,
+            'mode': img_mode,
+            'ai_analysis': record.as_pairs() if record else [],
+            'model_invocations': record.invocations if record else 0
+        }
+    
+    def run_pipeline(self, image_paths: List[str]) -> Dict[str, Dict]:
+        """Оценивает файлы конвейером (модель уже должна быть загружена)"""
+        engine = self.new_engine(fast_decode=True)
+        pipeline = StagedPipeline(engine, self.score_photo, self.pipeline_config)
+        assessments = pipeline.run(image_paths)
+        pipeline.print_stats()
+        self.pipeline_stats = pipeline.get_stats()
+        self.inference_stats = engine.get_stats()
+        return assessments
+    
+    def analyze(self, images: Sequence, num_best: int = 2, names: Optional[Sequence[str]] = None,
+                folder: str = "") -> Dict:
+        """Чистый анализ без записи на диск: пути, байты или PIL-изображения ->
+        {'best_photos', 'photo_scores', 'total'}"""
+        return final_event(self.iter_analyze(images, num_best, names, folder))
+    
+    def iter_analyze(self, images: Sequence, num_best: int = 2, names: Optional[Sequence[str]] = None,
+                     folder: str = "") -> Iterator[Dict]:
+        """Потоковый вариант analyze: события как у iter_best_photos, 'selection' дополнительно
+        содержит photo_scores. Декодирование и инференс пакетами, без кэша, копий и отчетов;
+        folder нужен только правилам выбора конкретных папок"""
+        images = list(images)
+        names = list(names) if names is not None else [source_name(source, i)
+                                                       for i, source in enumerate(images, 1)]
+        if not self.load_model():
+            print("❌ Не удалось загрузить AI модель!")
+            yield selection_event([], photo_scores=[])
+            return
+        
+        engine = BatchInferenceEngine(self.classifier, self.batch_size, fast_decode=True)
+        photo_scores = []
+        for offset in range(0, len(images), self.batch_size):
+            decoded = []
+            for source, name in zip(images[offset:offset + self.batch_size], names[offset:offset + self.batch_size]):
+                try:
+                    decoded.append((source, name, decode_source(source, name)))
+                except Exception as e:
+                    print(f"   ❌ Ошибка при анализе {name}: {e}")
+            if not decoded:
+                continue
+            
+            batch_names = [name for _, name, _ in decoded]
+            try:
+                batch_records = engine.classify_batch([item.image for _, _, item in decoded], batch_names)
+                errors = [None] * len(decoded)
+            except Exception:
+                # Пакет не прошел - классифицируем по одному, чтобы изолировать ошибку
+                batch_records, errors = [], []
+                for (_, name, item) in decoded:
                     try:
-                        results = self.classifier(img)
-                        viewpoint_info = self.analyze_photo_viewpoint(results)
-                        
-                        # Оценка ракурса
-                        if viewpoint_info['main_view'] == 'FRONT':
-                            viewpoint_score = 2.0  # Максимум за передний вид
-                            viewpoint_analysis.append(f"🟢 ПЕРЕДНИЙ ВИД: идеально для первой фотографии!")
-                        elif viewpoint_info['main_view'] == 'BACK':
-                            viewpoint_score = 0.0  # Минимум за задний вид
-                            viewpoint_analysis.append(f"🔴 ЗАДНИЙ ВИД: НЕ подходит для первой фотографии!")
-                        else:
-                            viewpoint_score = 1.0  # Среднее за боковой вид
-                            viewpoint_analysis.append(f"🟡 БОКОВОЙ ВИД: приемлемо")
-                        
-                        main_view = viewpoint_info['main_view']
-                        viewpoint_analysis.extend(viewpoint_info['analysis'])
-                        
+                        batch_records.append(engine.classify_batch([item.image], [name])[0])
+                        errors.append(None)
                     except Exception as e:
-                        viewpoint_analysis.append(f"⚠️ Ошибка анализа ракурса: {e}")
-                        viewpoint_score = 1.0
-                
-                # 5. ИТОГОВАЯ ОЦЕНКА
-                total_score = basic_score + technical_score + content_score + viewpoint_score
-                final_score = min(total_score, 10.0)
-                
-                # Дополнительная информация
-                is_main_product = content_type in ["MAIN_PRODUCT", "GOOD_PRODUCT"]
-                is_front_view = viewpoint_score >= 1.5
-                is_back_view = viewpoint_score <= 0.5
-                is_details_only = content_type == "DETAILS_ONLY"
-                
-                return {
-                    'basic_score': round(basic_score, 2),
-                    'technical_score': round(technical_score, 2),
-                    'content_score': round(content_score, 2),
-                    'viewpoint_score': round(viewpoint_score, 2),
-                    'final_score': round(final_score, 2),
-                    'content_type': content_type,
-                    'main_view': main_view,
-                    'is_main_product': is_main_product,
-                    'is_front_view': is_front_view,
-                    'is_back_view': is_back_view,
-                    'is_details_only': is_details_only,
-                    'content_analysis': content_analysis,
-                    'viewpoint_analysis': viewpoint_analysis,
-                    'width': width,
-                    'height': height,
-                    'aspect_ratio': round(aspect_ratio, 2),
-                    'file_size_mb': round(size_mb, 2),
-                    'format': img.format,
-                    'mode': img.mode
-                }
-                
-        except Exception as e:
-            print(f"   ❌ Ошибка при анализе {os.path.basename(image_path)}: {e}")
-            return None
+                        batch_records.append(None)
+                        errors.append(e)
+            self.precompute_rule_scores(batch_records)
+            
+            for (source, name, item), record, error in zip(decoded, batch_records, errors):
+                path = os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+                photo_scores.append({'filename': name, 'path': path, **self.score_photo(item, record, error)})
+                yield assessment_event(photo_scores[-1], len(photo_scores), len(images))
+        
+        photo_scores.sort(key=lambda x: x['final_score'], reverse=True)
+        best_photos = self._smart_select_best(photo_scores, num_best, folder) if photo_scores else []
+        yield selection_event(best_photos, len(photo_scores), photo_scores=photo_scores)
+    
+    def select_best_photos(self, input_folder: str, num_best: int = 2,
+                           records: Optional[Dict[str, InferenceRecord]] = None,
+                           assessments: Optional[Dict[str, Dict]] = None,
+                           sinks: Sequence[str] = DEFAULT_SINKS) -> List[Dict]:
+        """Автоматически выбирает лучшие фотографии для любой папки
+        (sinks - выходы: 'copy' - копии лучших фото, 'report' - JSON-отчет; () - без записи)"""
+        return final_selection(self.iter_best_photos(input_folder, num_best, records, assessments, sinks))
     
-    def select_best_photos(self, input_folder: str, num_best: int = 2) -> List[Dict]:
-        """Автоматически выбирает лучшие фотографии для любой папки"""
+    def iter_best_photos(self, input_folder: str, num_best: int = 2,
+                         records: Optional[Dict[str, InferenceRecord]] = None,
+                         assessments: Optional[Dict[str, Dict]] = None,
+                         sinks: Sequence[str] = DEFAULT_SINKS) -> Iterator[Dict]:
+        """Потоковый API выбора: событие 'assessment' для каждого фото сразу после оценки,
+        затем 'selection' (после записи в выходы sinks). Время обработки событий
+        вызывающим попадает в этап assess. Пакетный инференс идет по ходу оценки,
+        поэтому первое событие приходит после первого пакета; каскад и конвейер
+        классифицируют всю папку до первого события"""
         print("=== 🧠 УМНЫЙ ВЫБОР ФОТОГРАФИЙ С АВТОМАТИЧЕСКИМИ ПРАВИЛАМИ ===")
         print("🤖 AI модель: ConvNeXt Large + автоматический анализ")
         print("🎯 Автоматические правила: работает с любыми папками!")
@@ -343,68 +667,111 @@ class SmartPhotoSelector:
         # Проверяем входную папку
         if not os.path.exists(input_folder):
             print(f"❌ Папка '{input_folder}' не найдена!")
-            return []
+            yield selection_event([])
+            return
         
-        # Ищем изображения
-        image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tiff', '*.webp']
-        image_files = []
+        if self.streaming:
+            yield from self._iter_stream_best_photos(input_folder, num_best, records, assessments, sinks)
+            return
         
-        for ext in image_extensions:
-            pattern = os.path.join(input_folder, ext)
-            image_files.extend([f for f in os.listdir(input_folder) 
-                              if f.lower().endswith(ext.replace('*', ''))])
+        # Ищем изображения
+        image_files = find_image_files(input_folder)
         
         if not image_files:
             print(f"❌ Изображения не найдены в папке '{input_folder}'")
-            return []
+            yield selection_event([])
+            return
         
         print(f"🔍 Найдено {len(image_files)} изображений для анализа\n")
         
         # Загружаем AI модель
         if not self.load_model():
             print("❌ Не удалось загрузить AI модель!")
-            return []
+            yield selection_event([])
+            return
+        
+        image_paths = [os.path.join(input_folder, f) for f in image_files]
+        self.timer.reset()
+        # Статистика кэша в отчете папки - только за эту папку (кэш общий для прогона)
+        self.cache_counters = self.cache.counters() if self.cache is not None else None
+        
+        with self.timer.stage('inference'):
+            # Каскад: Large только для спорных фотографий и претендентов на первые места
+            if assessments is None and records is None and self.cascade_model_path:
+                records = self.run_cascade(image_paths)
+            
+            # Конвейер: чтение, декодирование, инференс и оценка идут параллельно
+            if assessments is None and records is None and self.pipeline_config:
+                assessments = self.run_pipeline(image_paths)
+        
+        # Пакетный инференс (если записи не получены заранее по многим папкам) - по пакетам
+        # прямо в цикле оценки: события 'assessment' идут после каждого пакета
+        engine = None
+        if assessments is None and records is None:
+            engine = self.new_engine(fast_decode=self.fast_decode)
+            records = {}
+        
+        # Оценки правил для всей папки сразу (векторы весов по полному распределению)
+        if records:
+            with self.timer.stage('rule_scores'):
+                self.precompute_rule_scores(records.values())
         
         # Анализируем фотографии
         photo_scores = []
-        
         for i, filename in enumerate(image_files, 1):
-            image_path = os.path.join(input_folder, filename)
-            print(f"🔄 Анализирую {i}/{len(image_files)}: {filename}")
+            if engine is not None and (i - 1) % self.batch_size == 0:
+                with self.timer.stage('inference'):
+                    batch_records = engine.classify_paths(image_paths[i - 1:i - 1 + self.batch_size])
+                with self.timer.stage('rule_scores'):
+                    self.precompute_rule_scores(batch_records.values())
+                records.update(batch_records)
             
-            assessment = self.assess_photo(image_path)
+            with self.timer.stage('assess'):
+                image_path = os.path.join(input_folder, filename)
+                print(f"🔄 Анализирую {i}/{len(image_files)}: {filename}")
             
-            if assessment:
-                print(f"   📊 Основные требования: {assessment['basic_score']}/4.0")
-                print(f"   🔧 Техническое качество: {assessment['technical_score']}/2.0")
-                print(f"   🤖 Содержимое: {assessment['content_score']}/3.5")
-                print(f"   🎯 Ракурс: {assessment['viewpoint_score']}/2.0")
-                print(f"   ⭐ Итоговая оценка: {assessment['final_score']}/10")
-                print(f"   📏 Размеры: {assessment['width']} × {assessment['height']}")
+                if assessments is not None:
+                    assessment = assessments.get(image_path)
+                else:
+                    assessment = self.assess_photo(image_path, records.get(image_path))
+            
+                if assessment:
+                    print(f"   📊 Основные требования: {assessment['basic_score']}/4.0")
+                    print(f"   🔧 Техническое качество: {assessment['technical_score']}/2.0")
+                    print(f"   🤖 Содержимое: {assessment['content_score']}/3.5")
+                    print(f"   🎯 Ракурс: {assessment['viewpoint_score']}/2.0")
+                    print(f"   ⭐ Итоговая оценка: {assessment['final_score']}/10")
+                    print(f"   📏 Размеры: {assessment['width']} × {assessment['height']}")
+                    print(f"   🔁 Вызовов модели: {assessment['model_invocations']}")
                 
-                # Показываем тип содержимого
-                content_icon = "🟢" if assessment['is_main_product'] else "🔴" if assessment['is_details_only'] else "🟡"
-                print(f"   {content_icon} Тип содержимого: {assessment['content_type']}")
+                    # Показываем тип содержимого
+                    content_icon = "🟢" if assessment['is_main_product'] else "🔴" if assessment['is_details_only'] else "🟡"
+                    print(f"   {content_icon} Тип содержимого: {assessment['content_type']}")
                 
-                # Показываем анализ содержимого
-                if assessment['content_analysis']:
-                    print("   🤖 Анализ содержимого:")
-                    for analysis in assessment['content_analysis']:
-                        print(f"      {analysis}")
+                    # Показываем анализ содержимого
+                    if assessment['content_analysis']:
+                        print("   🤖 Анализ содержимого:")
+                        for analysis in assessment['content_analysis']:
+                            print(f"      {analysis}")
                 
-                # Показываем анализ ракурса
-                if assessment['viewpoint_analysis']:
-                    print("   🎯 Анализ ракурса:")
-                    for analysis in assessment['viewpoint_analysis']:
-                        print(f"      {analysis}")
+                    # Показываем анализ ракурса
+                    if assessment['viewpoint_analysis']:
+                        print("   🎯 Анализ ракурса:")
+                        for analysis in assessment['viewpoint_analysis']:
+                            print(f"      {analysis}")
                 
-                photo_scores.append({
-                    'filename': filename,
-                    'path': image_path,
-                    **assessment
-                })
+                    photo_scores.append({
+                        'filename': filename,
+                        'path': image_path,
+                        **assessment
+                    })
+                    yield assessment_event(photo_scores[-1], len(photo_scores), len(image_files))
             
-            print()
+                print()
+        
+        if engine is not None:
+            engine.print_stats()
+            self.inference_stats = engine.get_stats()
         
         # Сортируем по оценке
         photo_scores.sort(key=lambda x: x['final_score'], reverse=True)
@@ -413,18 +780,143 @@ class SmartPhotoSelector:
         self._display_results(photo_scores)
         
         # АВТОМАТИЧЕСКИЙ ВЫБОР: умные правила для любой папки
-        best_photos = self._smart_select_best(photo_scores, num_best, input_folder)
+        with self.timer.stage('select'):
+            best_photos = self._smart_select_best(photo_scores, num_best, input_folder)
+        
+        # Попадания в кэш инференса за эту папку
+        if self.cache is not None:
+            self.cache_stats = self.cache.get_stats(self.cache_counters)
+            if self.cache_stats['hits'] + self.cache_stats['misses']:
+                # Записи, полученные заранее по многим папкам, в статистику папки не входят
+                self.cache.print_stats(self.cache_counters)
         
         # Копируем лучшие фотографии
-        self._copy_best_photos(best_photos, input_folder)
+        if COPY_SINK in sinks:
+            with self.timer.stage('copy'):
+                self._copy_best_photos(best_photos, input_folder)
         
-        # Сохраняем отчет
-        self._save_report(photo_scores, best_photos, input_folder)
+        # Сохраняем отчет (время записи отчета попадает в stage_timings, но не в сам отчет)
+        if REPORT_SINK in sinks:
+            with self.timer.stage('report'):
+                self._save_report(photo_scores, best_photos, input_folder)
         
-        return best_photos
+        if self.timer.enabled:
+            self.stage_timings = self.timer.folder_timings()
+            self.image_timings = [p['timings_ms'] for p in photo_scores if 'timings_ms' in p]
+            print_summary(summarize([self.stage_timings]), "Этапы папки")
+        
+        yield selection_event(best_photos, len(photo_scores))
     
-    def _smart_select_best(self, photo_scores: List[Dict], num_best: int, input_folder: str) -> List[Dict]:
-        """Умный выбор лучших фотографий с автоматическими правилами"""
+    def _iter_stream_best_photos(self, input_folder: str, num_best: int,
+                                 records: Optional[Dict[str, InferenceRecord]] = None,
+                                 assessments: Optional[Dict[str, Dict]] = None,
+                                 sinks: Sequence[str] = DEFAULT_SINKS) -> Iterator[Dict]:
+        """Потоковый выбор для очень больших папок: инференс и оценка блоками,
+        полные оценки пишутся в all_photos.jsonl, в памяти - только претенденты на слоты"""
+        if not self.load_model():
+            print("❌ Не удалось загрузить AI модель!")
+            yield selection_event([])
+            return
+        
+        folder_number = self._extract_folder_number(input_folder)
+        detail_path = os.path.join("smart_photos_results", f"folder_{folder_number}", STREAM_DETAIL_FILE)
+        print(f"🌊 Потоковый режим: блоки по {STREAM_CHUNK_SIZE} фото, все оценки -> {detail_path}\n")
+        self.timer.reset()
+        # Статистика кэша в отчете папки - только за эту папку (кэш общий для прогона)
+        self.cache_counters = self.cache.counters() if self.cache is not None else None
+        
+        # Источник записей создается один раз: статистика копится по всем блокам
+        cascade = engine = pipeline = None
+        if assessments is None and records is None:
+            if self.cascade_model_path:
+                # Претенденты на слоты каскада определяются внутри блока
+                cascade = self.build_cascade()
+            elif self.pipeline_config:
+                engine = self.new_engine(fast_decode=True)
+                pipeline = StagedPipeline(engine, self.score_photo, self.pipeline_config)
+            else:
+                engine = self.new_engine(fast_decode=self.fast_decode)
+        
+        with StreamingSelection(num_best, detail_path) as selection:
+            for chunk in chunked(iter_image_files(input_folder), STREAM_CHUNK_SIZE):
+                paths = [os.path.join(input_folder, filename) for filename in chunk]
+                chunk_records, chunk_assessments = records, assessments
+                
+                with self.timer.stage('inference'):
+                    if cascade is not None:
+                        chunk_records = cascade.classify_paths(paths)
+                    elif pipeline is not None:
+                        chunk_assessments = pipeline.run(paths)
+                    elif engine is not None:
+                        chunk_records = engine.classify_paths(paths)
+                
+                if chunk_assessments is None:
+                    with self.timer.stage('rule_scores'):
+                        self.precompute_rule_scores(chunk_records.get(path) for path in paths)
+                
+                with self.timer.stage('assess'):
+                    for filename, image_path in zip(chunk, paths):
+                        if chunk_assessments is not None:
+                            assessment = chunk_assessments.get(image_path)
+                        else:
+                            assessment = self.assess_photo(image_path, chunk_records.get(image_path))
+                        if assessment:
+                            photo = {'filename': filename, 'path': image_path, **assessment}
+                            selection.add(photo)
+                            yield assessment_event(photo, selection.total)
+                
+                print(f"🔄 Проанализировано {selection.total} фото")
+        
+        if not selection.total:
+            print(f"❌ Изображения не найдены в папке '{input_folder}'")
+            yield selection_event([])
+            return
+        
+        if cascade is not None:
+            cascade.print_stats()
+            self.cascade_stats = cascade.get_stats()
+            self.inference_stats = cascade.large_engine.get_stats()
+        elif engine is not None:
+            engine.print_stats()
+            self.inference_stats = engine.get_stats()
+            if pipeline is not None:
+                pipeline.print_stats()
+                self.pipeline_stats = pipeline.get_stats()  # последний блок
+        
+        self._display_results(selection.top(), selection.total)
+        
+        with self.timer.stage('select'):
+            best_photos = self._smart_select_best(selection.candidates(), num_best, input_folder,
+                                                  selection.counts)
+        self.streaming_stats = selection.get_stats()
+        
+        if self.cache is not None:
+            self.cache_stats = self.cache.get_stats(self.cache_counters)
+            if self.cache_stats['hits'] + self.cache_stats['misses']:
+                # Записи, полученные заранее по многим папкам, в статистику папки не входят
+                self.cache.print_stats(self.cache_counters)
+        
+        if COPY_SINK in sinks:
+            with self.timer.stage('copy'):
+                self._copy_best_photos(best_photos, input_folder)
+        
+        if REPORT_SINK in sinks:
+            with self.timer.stage('report'):
+                self._save_report(selection.top(), best_photos, input_folder, selection)
+        
+        if self.timer.enabled:
+            self.stage_timings = self.timer.folder_timings()
+            # Замеры фото не копятся в памяти: сводка - в отчете, значения - в JSONL
+            self.image_timings = []
+            print_summary(summarize([self.stage_timings]), "Этапы папки")
+            print_summary(selection.timing_summary(), "Этапы фото")
+        
+        yield selection_event(best_photos, selection.total)
+    
+    def _smart_select_best(self, photo_scores: List[Dict], num_best: int, input_folder: str,
+                           counts: Optional[Dict[str, int]] = None) -> List[Dict]:
+        """Умный выбор лучших фотографий с автоматическими правилами
+        (counts - численность типов по всей папке, если photo_scores - только претенденты)"""
         print("🧠 УМНЫЙ ВЫБОР С АВТОМАТИЧЕСКИМИ ПРАВИЛАМИ:")
         print("🎯 Автоматически выбираем лучшие фотографии для любой папки!")
         print("✅ Приоритет: первая фото = ОСНОВНОЙ ТОВАР, вторая фото = дополняющая")
@@ -434,11 +926,14 @@ class SmartPhotoSelector:
         good_product_photos = [p for p in photo_scores if p['content_type'] == 'GOOD_PRODUCT']
         mixed_content = [p for p in photo_scores if p['content_type'] == 'MIXED']
         details_only = [p for p in photo_scores if p['is_details_only']]
+        if counts is None:
+            counts = {'main_product': len(main_product_photos), 'good_product': len(good_product_photos),
+                      'mixed': len(mixed_content), 'details_only': len(details_only)}
         
-        print(f"   🟢 Основной товар: {len(main_product_photos)}")
-        print(f"   🟡 Хороший товар: {len(good_product_photos)}")
-        print(f"   🟡 Смешанное содержимое: {len(mixed_content)}")
-        print(f"   ❌ Только детали: {len(details_only)}")
+        print(f"   🟢 Основной товар: {counts['main_product']}")
+        print(f"   🟡 Хороший товар: {counts['good_product']}")
+        print(f"   🟡 Смешанное содержимое: {counts['mixed']}")
+        print(f"   ❌ Только детали: {counts['details_only']}")
         
         selected_photos = []
         
@@ -489,18 +984,8 @@ class SmartPhotoSelector:
                 mixed_product_photos = []
                 
                 for photo in main_product_photos:
-                    # Анализируем содержимое на смешанные типы
-                    content_analysis = photo.get('content_analysis', [])
-                    product_types = []
-                    
-                    for analysis in content_analysis:
-                        if '🟢 ОСНОВНОЙ ТОВАР:' in analysis:
-                            # Извлекаем тип товара
-                            label_part = analysis.split('🟢 ОСНОВНОЙ ТОВАР: ')[1].split(' (')[0]
-                            product_types.append(label_part)
-                    
                     # Если только один тип товара - идеально для первой фото
-                    if len(set(product_types)) == 1:
+                    if is_single_product(photo):
                         clean_single_product_photos.append(photo)
                     else:
                         mixed_product_photos.append(photo)
@@ -545,7 +1030,7 @@ class SmartPhotoSelector:
             print(f"   ⚠️ Принято: хороший товар (не основной)")
         
         # 2️⃣ ВТОРАЯ ФОТОГРАФИЯ (ДОПОЛНИТЕЛЬНАЯ)
-        if len(selected_photos) < num_best:
+        if selected_photos and len(selected_photos) < num_best:
             # Исключаем уже выбранную первую фотографию
             available_photos = [p for p in photo_scores if p['filename'] != selected_photos[0]['filename']]
             
@@ -619,10 +1104,12 @@ class SmartPhotoSelector:
     
 
     
-    def _display_results(self, photo_scores: List[Dict]):
-        """Показывает результаты анализа"""
+    def _display_results(self, photo_scores: List[Dict], total: Optional[int] = None):
+        """Показывает результаты анализа (total - всего фото, если показаны только лучшие)"""
         print("="*90)
         print("📊 РЕЗУЛЬТАТЫ УМНОГО АНАЛИЗА (товар + ракурс + качество):\n")
+        if total is not None and total > len(photo_scores):
+            print(f"   Показаны {len(photo_scores)} лучших из {total}\n")
         
         for i, photo in enumerate(photo_scores, 1):
             # Иконки для типа содержимого и ракурса
@@ -713,8 +1200,9 @@ class SmartPhotoSelector:
         # Если ничего не найдено, используем "unknown"
         return "unknown"
     
-    def _save_report(self, all_photos: List[Dict], best_photos: List[Dict], input_folder: str):
-        """Сохраняет детальный отчет"""
+    def _save_report(self, all_photos: List[Dict], best_photos: List[Dict], input_folder: str,
+                     selection: Optional[StreamingSelection] = None):
+        """Сохраняет детальный отчет (в потоковом режиме все фото - в JSONL рядом с отчетом)"""
         folder_number = self._extract_folder_number(input_folder)
         
         # Создаем общую папку результатов
@@ -724,22 +1212,41 @@ class SmartPhotoSelector:
         
         # Сохраняем отчет в подпапку
         subfolder_path = os.path.join(main_output_folder, f"folder_{folder_number}")
+        os.makedirs(subfolder_path, exist_ok=True)
         report_path = os.path.join(subfolder_path, "smart_analysis_report.json")
         
         report = {
             'category': 'smart_bag_selection',
             'model': 'ConvNeXt Large + Smart Rules',
             'method': 'AUTOMATIC_SMART_SELECTION',
-            'total_photos': len(all_photos),
+            'total_photos': selection.total if selection else len(all_photos),
             'best_photos_count': len(best_photos),
             'analysis_date': str(np.datetime64('now')),
             'criteria': 'SMART_RULES + AI_ANALYSIS',
             'filtering': 'AUTOMATIC_PRODUCT_AND_VIEWPOINT_ANALYSIS',
             'input_folder': input_folder,
             'folder_number': folder_number,
-            'all_photos': all_photos,
-            'best_photos': best_photos
+            'model_registry': model_registry.get_stats(),
+            'inference_stats': self.inference_stats,
+            'pipeline_stats': self.pipeline_stats,
+            'cascade_stats': self.cascade_stats,
+            'cache_stats': self.cache_stats,
+            'model_invocations_total': selection.invocations_total if selection else
+                                       sum(p.get('model_invocations', 0) for p in all_photos),
+            'max_model_invocations_per_image': selection.invocations_max if selection else
+                                               max((p.get('model_invocations', 0) for p in all_photos), default=0),
+            'stage_timings': {
+                'folder_ms': self.timer.folder_timings(),
+                'images': selection.timing_summary() if selection else
+                          summarize(p.get('timings_ms') for p in all_photos),
+            } if self.timer.enabled else {},
         }
+        if selection:
+            report['streaming_stats'] = self.streaming_stats
+            report['all_photos_file'] = STREAM_DETAIL_FILE
+        else:
+            report['all_photos'] = all_photos
+        report['best_photos'] = best_photos
         
         with open(report_path, 'w', encoding='utf-8') as f:
             json.dump(report, f, ensure_ascii=False, indent=2)
@@ -748,7 +1255,27 @@ class SmartPhotoSelector:
 
 def main():
     """Главная функция"""
-    import sys
+    import argparse
+    parser = argparse.ArgumentParser(description="Умный селектор фотографий товара")
+    parser.add_argument('input_folder', nargs='?', default="big", help="папка с фотографиями")
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help="бэкенд модели: hf-pipeline (fp32), hf-pipeline-int8, hf-pipeline-bf16, onnx, torchscript или fake")
+    parser.add_argument('--cascade', nargs='?', const=SMALL_MODEL_PATH, default=None, metavar='SMALL_MODEL',
+                        help=f"каскад: сначала маленькая модель (по умолчанию {SMALL_MODEL_PATH}), "
+                             f"Large - только для спорных фото")
+    parser.add_argument('--cascade-backend', choices=BACKENDS, default=SMALL_MODEL_BACKEND,
+                        help=f"бэкенд маленькой модели каскада (по умолчанию {SMALL_MODEL_BACKEND}): "
+                             f"onnx/torchscript требуют отдельного экспорта Tiny")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, default=None, metavar='DB',
+                        help=f"постоянный кэш инференса SQLite (по умолчанию {DEFAULT_CACHE_PATH})")
+    parser.add_argument('--timing', action='store_true', help="поэтапные замеры времени в отчете")
+    parser.add_argument('--stream', action='store_true',
+                        help="потоковый режим для очень больших папок: оценки в all_photos.jsonl, "
+                             "в памяти только претенденты")
+    parser.add_argument('--model-server', default=None, metavar='SOCKET',
+                        help="сокет сервера модели (по умолчанию PHOTO_SELECTOR_MODEL_SOCKET или /tmp/photo_selector_model.sock)")
+    parser.add_argument('--local-model', action='store_true', help="не подключаться к серверу модели")
+    args = parser.parse_args()
     
     print("🧠 УМНЫЙ СЕЛЕКТОР ФОТОГРАФИЙ С АВТОМАТИЧЕСКИМИ ПРАВИЛАМИ")
     print("="*60)
@@ -759,15 +1286,15 @@ def main():
     print()
     
     # Получаем путь к папке из аргументов командной строки
-    if len(sys.argv) > 1:
-        input_folder = sys.argv[1]
-        print(f"📁 Анализирую папку: {input_folder}")
-    else:
-        input_folder = "big"  # По умолчанию
-        print(f"📁 Использую папку по умолчанию: {input_folder}")
+    input_folder = args.input_folder
+    print(f"📁 Анализирую папку: {input_folder}")
     
     # Создаем умный селектор
-    selector = SmartPhotoSelector()
+    selector = SmartPhotoSelector(backend=args.backend, cascade_model_path=args.cascade,
+                                 cascade_backend=args.cascade_backend,
+                                  cache=InferenceCache(args.cache) if args.cache else None,
+                                  timing=args.timing or None, streaming=args.stream,
+                                  model_server='' if args.local_model else args.model_server)
     
     # Запускаем анализ с указанной папкой
     best_photos = selector.select_best_photos(input_folder, 2)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ПОЭТАПНЫЕ ЗАМЕРЫ ВРЕМЕНИ
+Время этапов на фото (заголовок, декодирование, инференс, оценка) и на
+папку (инференс, оценка, выбор, копирование, отчет). Выключенный таймер
+возвращает общий пустой контекст - на горячем пути остается одна проверка.
+"""
+
+import contextlib
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+TIMING_ENV = "PHOTO_SELECTOR_TIMING"
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class _Stage:
+    """Контекст одного этапа: добавляет миллисекунды в target[name]"""
+
+    __slots__ = ('target', 'name', 'start')
+
+    def __init__(self, target: Dict[str, float], name: str):
+        self.target = target
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        self.target[self.name] = self.target.get(self.name, 0.0) + elapsed
+        return False
+
+
+class StageTimer:
+    """Таймер этапов папки; этапы фото пишутся в переданный словарь"""
+
+    def __init__(self, enabled: Optional[bool] = None):
+        if enabled is None:
+            enabled = os.environ.get(TIMING_ENV, "") not in ("", "0")
+        self.enabled = enabled
+        self.folder: Dict[str, float] = {}
+
+    def reset(self):
+        """Начало новой папки"""
+        self.folder = {}
+
+    def stage(self, name: str, target: Optional[Dict[str, float]] = None):
+        """with timer.stage('copy'): ... - этап папки; с target - этап фото"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self.folder if target is None else target, name)
+
+    def image_timings(self) -> Optional[Dict[str, float]]:
+        """Словарь для этапов одного фото (None, если замеры выключены)"""
+        return {} if self.enabled else None
+
+    def folder_timings(self) -> Dict[str, float]:
+        return rounded(self.folder)
+
+
+def rounded(timings: Dict[str, float]) -> Dict[str, float]:
+    return {stage: round(ms, 3) for stage, ms in timings.items()}
+
+
+def summarize(samples: Iterable[Dict[str, float]]) -> Dict[str, Dict]:
+    """p50/p95/max/сумма по каждому этапу из набора замеров (фото или папок)"""
+    by_stage: Dict[str, List[float]] = {}
+    for timings in samples:
+        for stage, ms in (timings or {}).items():
+            by_stage.setdefault(stage, []).append(ms)
+    return summarize_columns(by_stage)
+
+
+def summarize_columns(by_stage: Dict[str, Sequence[float]]) -> Dict[str, Dict]:
+    """Та же сводка по уже собранным столбцам {этап: значения} (например, array('d'))"""
+    summary = {}
+    for stage, values in by_stage.items():
+        if not len(values):
+            continue
+        array = np.asarray(values, dtype=np.float64)
+        summary[stage] = {
+            'count': len(values),
+            'p50_ms': round(float(np.percentile(array, 50)), 3),
+            'p95_ms': round(float(np.percentile(array, 95)), 3),
+            'max_ms': round(float(array.max()), 3),
+            'total_ms': round(float(array.sum()), 3),
+        }
+    return summary
+
+
+def print_summary(summary: Dict[str, Dict], title: str):
+    """Печатает сводку этапов"""
+    if not summary:
+        return
+    print(f"⏱️ {title}:")
+    for stage, item in summary.items():
+        print(f"   {stage:<14} p50 {item['p50_ms']:>9.2f} мс   p95 {item['p95_ms']:>9.2f} мс   "
+              f"max {item['max_ms']:>9.2f} мс   всего {item['total_ms'] / 1000:>7.2f} с ({item['count']})")
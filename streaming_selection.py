@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ПОТОКОВЫЙ ВЫБОР С ОГРАНИЧЕННОЙ ПАМЯТЬЮ
+Для очень больших папок: полная оценка каждого фото сразу пишется в JSONL,
+в памяти остаются только претенденты, которые может выбрать _smart_select_best
+(top-k кучи по типам содержимого), счетчики и сводки. Выбор совпадает с
+обычным режимом, включая порядок при равных оценках.
+"""
+
+import heapq
+import json
+import os
+from array import array
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from stage_timer import summarize_columns
+
+STREAM_DETAIL_FILE = "all_photos.jsonl"
+STREAM_CHUNK_SIZE = 256
+DISPLAY_LIMIT = 10
+
+# Имена с ручным приоритетом в _smart_select_best (первая/вторая фото)
+PRIORITY_FILENAMES = ('image_003.jpg', 'image_004.jpg', 'image_005.jpg', 'image_006.jpg')
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """Блоки по size элементов из итератора"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def is_single_product(photo: Dict) -> bool:
+    """В анализе содержимого ровно один тип основного товара (идеально для первой фото)"""
+    product_types = set()
+    for analysis in photo.get('content_analysis', []):
+        if '🟢 ОСНОВНОЙ ТОВАР:' in analysis:
+            product_types.add(analysis.split('🟢 ОСНОВНОЙ ТОВАР: ')[1].split(' (')[0])
+    return len(product_types) == 1
+
+
+def first_view_key(photo: Dict) -> Tuple:
+    """Порядок выбора первой фото из основного товара"""
+    return photo['viewpoint_score'], photo['content_score'], photo['final_score']
+
+
+def good_view_key(photo: Dict) -> Tuple:
+    """Порядок выбора первой фото из хорошего товара"""
+    return photo['viewpoint_score'], photo['final_score']
+
+
+def second_view_key(photo: Dict) -> Tuple:
+    """Порядок выбора второй фото"""
+    return photo['content_score'], photo['final_score'], photo['viewpoint_score']
+
+
+def score_key(photo: Dict) -> Tuple:
+    """Порядок списка photo_scores (итоговая оценка)"""
+    return (photo['final_score'],)
+
+
+class _TopK:
+    """k лучших по ключу; при равенстве выигрывает более раннее фото (как устойчивая сортировка)"""
+
+    __slots__ = ('size', 'key', 'heap')
+
+    def __init__(self, size: int, key):
+        self.size = size
+        self.key = key
+        self.heap: List[Tuple] = []
+
+    def push(self, index: int, photo: Dict):
+        if self.size <= 0:
+            return
+        entry = (self.key(photo), -index, photo)
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, entry)
+        elif entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, entry)
+
+    def items(self) -> Iterator[Tuple[int, Dict]]:
+        for _, negative_index, photo in self.heap:
+            yield -negative_index, photo
+
+
+class StreamingSelection:
+    """Потоковый сборщик оценок одной папки.
+
+    add() пишет полную оценку строкой JSONL и обновляет ограниченные кучи:
+    память не зависит от числа фото в папке.
+    """
+
+    def __init__(self, num_best: int, detail_path: str, display_limit: int = DISPLAY_LIMIT):
+        self.num_best = num_best
+        self.detail_path = detail_path
+        self.total = 0
+        self.invocations_total = 0
+        self.invocations_max = 0
+        self.counts = {'main_product': 0, 'good_product': 0, 'mixed': 0, 'details_only': 0}
+        self.timings: Dict[str, array] = {}
+        # Претенденты: каждая ветка _smart_select_best берет не больше, чем размер кучи
+        self.first_single = _TopK(1, first_view_key)
+        self.first_mixed = _TopK(1, first_view_key)
+        self.first_good = _TopK(1, good_view_key)
+        self.second = _TopK(2, second_view_key)  # вторая фото: лучшая, кроме уже выбранной первой
+        self.mixed = _TopK(num_best, score_key)
+        self.display = _TopK(display_limit, score_key)
+        self.priority: Dict[int, Dict] = {}
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.detail_path) or '.', exist_ok=True)
+        self._file = open(self.detail_path, 'w', encoding='utf-8')
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+        self._file = None
+        return False
+
+    def add(self, photo: Dict):
+        """Принимает оценку фото ({'filename', 'path', **assessment})"""
+        index = self.total
+        self.total += 1
+        self._file.write(json.dumps(photo, ensure_ascii=False) + '\n')
+
+        invocations = photo.get('model_invocations', 0)
+        self.invocations_total += invocations
+        self.invocations_max = max(self.invocations_max, invocations)
+        for stage, ms in (photo.get('timings_ms') or {}).items():
+            self.timings.setdefault(stage, array('d')).append(ms)
+
+        if photo['is_main_product']:
+            self.counts['main_product'] += 1
+            (self.first_single if is_single_product(photo) else self.first_mixed).push(index, photo)
+        if photo['content_type'] == 'GOOD_PRODUCT':
+            self.counts['good_product'] += 1
+            self.first_good.push(index, photo)
+        if photo['content_type'] == 'MIXED':
+            self.counts['mixed'] += 1
+            self.mixed.push(index, photo)
+        if photo['is_details_only']:
+            self.counts['details_only'] += 1
+        self.second.push(index, photo)
+        self.display.push(index, photo)
+        if photo['filename'] in PRIORITY_FILENAMES:
+            self.priority[index] = photo
+
+    def candidates(self) -> List[Dict]:
+        """Все претенденты в порядке photo_scores (оценка по убыванию, затем порядок файлов)"""
+        by_index = dict(self.priority)
+        for top in (self.first_single, self.first_mixed, self.first_good, self.second, self.mixed):
+            by_index.update(top.items())
+        return [photo for _, photo in sorted(by_index.items(),
+                                             key=lambda item: (-item[1]['final_score'], item[0]))]
+
+    def top(self) -> List[Dict]:
+        """Лучшие фото для вывода на экран"""
+        return [photo for _, photo in sorted(self.display.items(),
+                                             key=lambda item: (-item[1]['final_score'], item[0]))]
+
+    def timing_summary(self) -> Dict[str, Dict]:
+        return summarize_columns(self.timings)
+
+    def get_stats(self) -> Dict:
+        return {
+            'total_photos': self.total,
+            'candidates': len(self.candidates()),
+            'detail_file': self.detail_path,
+            **self.counts,
+        }
+
+
+# События потокового API (iter_best_photos): оценка каждого фото по готовности, затем выбор
+ASSESSMENT_EVENT = 'assessment'
+SELECTION_EVENT = 'selection'
+
+
+def assessment_event(photo: Dict, done: int, total: Optional[int] = None) -> Dict:
+    """Фото оценено (total - None, если число фото заранее неизвестно)"""
+    return {'event': ASSESSMENT_EVENT, 'done': done, 'total': total, 'photo': photo}
+
+
+def selection_event(best_photos: List[Dict], total: int = 0, **extra) -> Dict:
+    """Итоговый выбор: фото скопированы, отчет записан"""
+    return {'event': SELECTION_EVENT, 'best_photos': best_photos, 'total': total, **extra}
+
+
+def final_event(events: Iterable[Dict]) -> Dict:
+    """Проходит события до конца и возвращает событие выбора"""
+    selection = selection_event([])
+    for event in events:
+        if event['event'] == SELECTION_EVENT:
+            selection = event
+    return selection
+
+
+def final_selection(events: Iterable[Dict]) -> List[Dict]:
+    """Проходит события до конца и возвращает выбранные фото"""
+    return final_event(events)['best_photos']
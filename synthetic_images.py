@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+СИНТЕТИЧЕСКИЕ ИЗОБРАЖЕНИЯ И КАТАЛОГИ ДЛЯ БЕНЧМАРКОВ
+Детерминированные (по seed) изображения заданного размера и формата:
+плавный градиент + шум, чтобы JPEG сжимался примерно как студийное фото,
+а не как однотонная заливка. CatalogGenerator строит дерево fotos/<n>/big
+с заданным числом фото, размерами, смесью форматов и долей битых файлов.
+"""
+
+import io
+import os
+import time
+import random
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Расширение файла по формату PIL
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'BMP': '.bmp', 'TIFF': '.tiff'}
+
+
+def synthetic_array(width: int, height: int, seed: int = 0, noise: float = 12.0) -> np.ndarray:
+    """RGB uint8: градиент со случайным направлением и цветом + гауссов шум"""
+    rng = np.random.default_rng(seed)
+    # Градиент считается на уменьшенной сетке и растягивается - генерация 4000x4000 остается быстрой
+    small_w, small_h = max(2, width // 16), max(2, height // 16)
+    y, x = np.mgrid[0:small_h, 0:small_w].astype(np.float32)
+    angle = rng.uniform(0, np.pi)
+    ramp = (np.cos(angle) * x / small_w + np.sin(angle) * y / small_h)
+    base = rng.uniform(40, 215, 3).astype(np.float32)
+    spread = rng.uniform(20, 60, 3).astype(np.float32)
+    small = np.clip(base + ramp[..., None] * spread, 0, 255).astype(np.uint8)
+    array = np.asarray(Image.fromarray(small).resize((width, height), Image.BILINEAR), dtype=np.float32)
+    if noise:
+        array += rng.normal(0, noise, (height, width, 1)).astype(np.float32)
+    return np.clip(array, 0, 255).astype(np.uint8)
+
+
+def make_image(path: str, width: int, height: int, image_format: str = 'JPEG', seed: int = 0,
+               mode: str = 'RGB', quality: int = 90) -> str:
+    """Сохраняет синтетическое изображение и возвращает путь"""
+    image = Image.fromarray(synthetic_array(width, height, seed))
+    if mode != 'RGB':
+        image = image.convert(mode)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    options = {'quality': quality} if image_format in ('JPEG', 'WEBP') else {}
+    image.save(path, image_format, **options)
+    return path
+
+
+def image_filename(index: int, image_format: str = 'JPEG') -> str:
+    """Имя файла в стиле каталога: image_000.jpg"""
+    return f"image_{index:03d}{FORMAT_EXTENSIONS.get(image_format, '.jpg')}"
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    """'2000x1500' -> (2000, 1500), '800' -> (800, 800)"""
+    if 'x' in value:
+        width, height = value.lower().split('x', 1)
+        return int(width), int(height)
+    return int(value), int(value)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """'jpeg:0.8,png:0.2' -> {'JPEG': 0.8, 'PNG': 0.2} (доли нормируются)"""
+    mix = {}
+    for item in value.split(','):
+        name, _, share = item.partition(':')
+        mix[name.strip().upper().replace('JPG', 'JPEG')] = float(share) if share else 1.0
+    total = sum(mix.values())
+    return {name: share / total for name, share in mix.items()}
+
+
+def parse_count(value: str) -> Tuple[int, int]:
+    """'8' -> (8, 8), '4-12' -> (4, 12)"""
+    low, _, high = value.partition('-')
+    return int(low), int(high or low)
+
+
+class CatalogGenerator:
+    """Синтетическое дерево fotos/<n>/big в формате каталога.
+
+    Кодирование JPEG 4000x4000 стоит сотни миллисекунд, поэтому для каждой пары
+    (размер, формат) кодируется пул из pool_size изображений, а каждый файл - это
+    байты из пула + уникальный хвост после конца изображения. Декодеры хвост
+    игнорируют, а хэш содержимого у каждого файла свой (кэш инференса не схлопывает
+    каталог до размера пула)."""
+
+    def __init__(self, sizes: List[Tuple[int, int]] = ((800, 800),), formats: Optional[Dict[str, float]] = None,
+                 images_per_sku: Tuple[int, int] = (8, 8), corrupt_rate: float = 0.0,
+                 pool_size: int = 16, seed: int = 0):
+        self.sizes = list(sizes)
+        self.formats = formats or {'JPEG': 1.0}
+        self.images_per_sku = images_per_sku
+        self.corrupt_rate = corrupt_rate
+        self.pool_size = pool_size
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self._pool: Dict[Tuple[int, int, str], List[bytes]] = {}
+        self.stats = {'skus': 0, 'images': 0, 'corrupt': 0, 'bytes': 0}
+
+    def _encoded(self, width: int, height: int, image_format: str) -> bytes:
+        key = (width, height, image_format)
+        pool = self._pool.setdefault(key, [])
+        if len(pool) < self.pool_size:
+            buffer = io.BytesIO()
+            image = Image.fromarray(synthetic_array(width, height, self.seed * 100003 + len(pool) * 31 + width))
+            options = {'quality': 90} if image_format in ('JPEG', 'WEBP') else {}
+            image.save(buffer, image_format, **options)
+            pool.append(buffer.getvalue())
+            return pool[-1]
+        return pool[self.rng.randrange(len(pool))]
+
+    def _corrupt(self, data: bytes) -> bytes:
+        """Битый файл: обрезанный посередине или мусор с правильным расширением"""
+        if self.rng.random() < 0.5:
+            return data[:len(data) // 3]
+        return os.urandom(min(len(data), 4096))
+
+    def write_sku(self, fotos_dir: str, sku: int) -> int:
+        """Создает fotos/<sku>/big и возвращает число файлов"""
+        big = os.path.join(fotos_dir, str(sku), "big")
+        os.makedirs(big, exist_ok=True)
+        formats, weights = zip(*self.formats.items())
+        count = self.rng.randint(*self.images_per_sku)
+        for index in range(count):
+            width, height = self.rng.choice(self.sizes)
+            image_format = self.rng.choices(formats, weights)[0]
+            data = self._encoded(width, height, image_format)
+            if self.corrupt_rate and self.rng.random() < self.corrupt_rate:
+                data = self._corrupt(data)
+                self.stats['corrupt'] += 1
+            else:
+                data += f"\n{sku}/{index}/{self.rng.getrandbits(64):016x}".encode()
+            with open(os.path.join(big, image_filename(index, image_format)), 'wb') as f:
+                f.write(data)
+            self.stats['bytes'] += len(data)
+        self.stats['skus'] += 1
+        self.stats['images'] += count
+        return count
+
+    def generate(self, root: str, skus: int) -> str:
+        """Дерево root/fotos/1..skus/big, возвращает путь к fotos"""
+        fotos_dir = os.path.join(root, "fotos")
+        for sku in range(1, skus + 1):
+            self.write_sku(fotos_dir, sku)
+        return fotos_dir
+
+
+def main():
+    """Главная функция"""
+    parser = argparse.ArgumentParser(description="Генератор синтетического каталога fotos/<n>/big")
+    parser.add_argument('root', help="папка, в которой будет создана fotos/")
+    parser.add_argument('--skus', type=int, default=10, help="число папок товаров")
+    parser.add_argument('--images', default='8', help="фото на товар: 8 или диапазон 4-12")
+    parser.add_argument('--sizes', default='800', help="размеры через запятую: 800,2000x1500")
+    parser.add_argument('--formats', default='jpeg', help="доли форматов: jpeg:0.8,png:0.2")
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help="доля битых файлов")
+    parser.add_argument('--pool-size', type=int, default=16, help="различных изображений на размер и формат")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = CatalogGenerator([parse_size(size) for size in args.sizes.split(',')], parse_mix(args.formats),
+                                 parse_count(args.images), args.corrupt_rate, args.pool_size, args.seed)
+    start = time.perf_counter()
+    fotos_dir = generator.generate(args.root, args.skus)
+    stats = generator.stats
+    print(f"✅ Каталог создан: {fotos_dir}")
+    print(f"   📁 Товаров: {stats['skus']}, 📸 фото: {stats['images']} (битых {stats['corrupt']}), "
+          f"💾 {stats['bytes'] / 1e6:.1f} МБ за {time.perf_counter() - start:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ПРОВЕРКА КОНВЕЙЕРА: ОШИБКИ СТАДИЙ НЕ ОСТАНАВЛИВАЮТ ПРОГОН
+Запуск: python -m unittest test_photo_pipeline
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from fake_backend import FakeImageClassifier
+from inference import BatchInferenceEngine
+from inference_cache import InferenceCache
+from photo_pipeline import PipelineConfig, StagedPipeline
+from synthetic_images import make_image
+
+RUN_TIMEOUT = 30.0  # секунды: дольше - конвейер завис
+
+
+class BrokenStoreCache(InferenceCache):
+    """Кэш, запись в который всегда падает (заблокированная или переполненная база)"""
+
+    def store_many(self, items, model_key, data=None):
+        raise sqlite3.OperationalError("database is locked")
+
+
+class PipelineErrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory(prefix="pipeline_test_")
+        self.paths = []
+        for index in range(12):
+            path = os.path.join(self.workdir.name, f"image_{index:03d}.jpg")
+            make_image(path, 320, 240, seed=index)
+            self.paths.append(path)
+        # Битый файл: ошибка декодирования тоже должна освобождать место в конвейере
+        broken = os.path.join(self.workdir.name, "broken.jpg")
+        with open(broken, 'wb') as f:
+            f.write(b"not an image")
+        self.paths.append(broken)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def run_pipeline(self, pipeline: StagedPipeline):
+        """Прогон в отдельном потоке: зависание - провал теста, а не вечное ожидание"""
+        outcome = {}
+        thread = threading.Thread(target=lambda: outcome.update(results=pipeline.run(self.paths)), daemon=True)
+        thread.start()
+        thread.join(RUN_TIMEOUT)
+        self.assertFalse(thread.is_alive(), "конвейер не завершился")
+        return outcome['results']
+
+    def test_cache_store_error_does_not_hang(self):
+        cache = BrokenStoreCache(os.path.join(self.workdir.name, "cache.sqlite"))
+        engine = BatchInferenceEngine(FakeImageClassifier(script={'labels': ['tote bag', 'pocket']}),
+                                      batch_size=4, cache=cache, model_key="fake|test")
+        config = PipelineConfig(queue_size=2, max_in_flight=4)
+        pipeline = StagedPipeline(engine, lambda decoded, record, error: {'ok': error is None}, config)
+
+        results = self.run_pipeline(pipeline)
+
+        self.assertEqual(len(results), len(self.paths) - 1)
+        self.assertGreater(pipeline.get_stats()['stages']['inference']['errors'], 0)
+        cache.close()
+
+    def test_score_error_does_not_hang(self):
+        engine = BatchInferenceEngine(FakeImageClassifier(script={'labels': ['tote bag', 'pocket']}),
+                                      batch_size=4)
+
+        def failing_score(decoded, record, error):
+            raise RuntimeError("score failed")
+
+        pipeline = StagedPipeline(engine, failing_score, PipelineConfig(queue_size=2, max_in_flight=4))
+
+        self.assertEqual(self.run_pipeline(pipeline), {})
+        self.assertEqual(pipeline.get_stats()['stages']['score']['errors'], len(self.paths) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
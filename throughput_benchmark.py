@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+СКВОЗНОЙ БЕНЧМАРК ПРОПУСКНОЙ СПОСОБНОСТИ КАТАЛОГА
+Генерирует синтетическое дерево fotos/<n>/big (synthetic_images.py) и
+запускает на нем пакетную точку входа - smart_analyze_all.py,
+batch_photo_selector.py или analyze_all_folders_simple.py - для ряда
+размеров каталога (10 ... 10 000 товаров).
+
+Каждый прогон - отдельный процесс (чистый реестр моделей и честный пик RSS).
+Отчет: время, изображений в секунду, пик RSS, загрузки моделей, байты,
+записанные в папки результатов.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Точка входа -> (скрипт, папки результатов относительно рабочей папки)
+ENTRY_POINTS = {
+    'smart': ('smart_analyze_all.py', ['smart_photos_results']),
+    'batch': ('batch_photo_selector.py', ['batch_selected_photos']),
+    'simple': ('analyze_all_folders_simple.py', ['best_bag_photos_final', 'selected_photos_*']),
+}
+STATS_FILENAME = "throughput_child_stats.json"
+
+
+def output_paths(workdir: str, patterns: List[str]) -> List[str]:
+    """Папки результатов точки входа (шаблоны вида selected_photos_*)"""
+    import glob
+    paths = []
+    for pattern in patterns:
+        paths.extend(glob.glob(os.path.join(workdir, pattern)))
+    return paths
+
+
+def tree_bytes(paths: List[str]) -> Dict[str, int]:
+    """Число файлов и байт в папках"""
+    files = size = 0
+    for path in paths:
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                files += 1
+                size += os.path.getsize(os.path.join(dirpath, filename))
+    return {'files': files, 'bytes': size}
+
+
+def count_images(fotos_dir: str) -> int:
+    return sum(len(os.listdir(os.path.join(fotos_dir, sku, "big"))) for sku in os.listdir(fotos_dir)
+               if os.path.isdir(os.path.join(fotos_dir, sku, "big")))
+
+
+def link_catalog(catalog_fotos: str, run_dir: str, skus: int) -> str:
+    """fotos/ прогона из первых skus товаров общего каталога (символические ссылки, без копирования)"""
+    fotos_dir = os.path.join(run_dir, "fotos")
+    os.makedirs(fotos_dir, exist_ok=True)
+    for sku in range(1, skus + 1):
+        os.symlink(os.path.join(catalog_fotos, str(sku)), os.path.join(fotos_dir, str(sku)))
+    return fotos_dir
+
+
+def run_child(script: str, argv: List[str]):
+    """Режим дочернего процесса: запускает точку входа и сохраняет статистику реестра моделей"""
+    import atexit
+    import runpy
+    sys.path.insert(0, REPO_DIR)
+    from model_registry import model_registry
+
+    def dump_stats():
+        with open(STATS_FILENAME, 'w', encoding='utf-8') as f:
+            json.dump({'model_registry': model_registry.get_stats()}, f, ensure_ascii=False, indent=2)
+
+    atexit.register(dump_stats)
+    sys.argv = [script] + argv
+    runpy.run_path(os.path.join(REPO_DIR, script), run_name="__main__")
+
+
+def run_entry_point(entry: str, run_dir: str, extra_args: List[str], env: Dict[str, str]) -> Dict:
+    """Прогон одной точки входа в run_dir: время, пик RSS, загрузки моделей, записанные байты"""
+    script, outputs = ENTRY_POINTS[entry]
+    for path in output_paths(run_dir, outputs):
+        shutil.rmtree(path)
+    log_path = os.path.join(run_dir, f"{entry}.log")
+
+    start = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', script, '--'] + extra_args,
+                                   cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 возвращает rusage именно этого процесса (RUSAGE_CHILDREN - максимум по всем прогонам)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.perf_counter() - start
+
+    stats_path = os.path.join(run_dir, STATS_FILENAME)
+    registry = {}
+    if os.path.exists(stats_path):
+        with open(stats_path, encoding='utf-8') as f:
+            registry = json.load(f)['model_registry']
+        os.remove(stats_path)
+
+    images = count_images(os.path.join(run_dir, "fotos"))
+    written = tree_bytes(output_paths(run_dir, outputs))
+    return {
+        'entry_point': entry,
+        'exit_code': process.returncode,
+        'skus': len(os.listdir(os.path.join(run_dir, "fotos"))),
+        'images': images,
+        'wall_time_sec': round(wall_time, 3),
+        'images_per_sec': round(images / wall_time, 2) if wall_time else 0.0,
+        'peak_rss_mb': round(rusage.ru_maxrss / 1024, 1),
+        'model_loads': sum(item['loads'] for item in registry.values()),
+        'model_load_time_sec': round(sum(item['load_time_sec'] for item in registry.values()), 3),
+        'files_written': written['files'],
+        'bytes_written': written['bytes'],
+        'log_bytes': os.path.getsize(log_path),
+        'log': log_path,
+    }
+
+
+def print_table(rows: List[Dict]):
+    print(f"\n   {'вход':<7} {'товары':>7} {'фото':>7} {'время, с':>9} {'фото/с':>8} "
+          f"{'RSS, МБ':>8} {'загрузок':>8} {'записано, МБ':>13}")
+    for row in rows:
+        marker = "" if row['exit_code'] == 0 else f"  ❌ код {row['exit_code']}"
+        print(f"   {row['entry_point']:<7} {row['skus']:>7} {row['images']:>7} {row['wall_time_sec']:>9.2f} "
+              f"{row['images_per_sec']:>8.1f} {row['peak_rss_mb']:>8.1f} {row['model_loads']:>8} "
+              f"{row['bytes_written'] / 1e6:>13.2f}{marker}")
+
+
+def main():
+    """Главная функция"""
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[4:])
+        return
+
+    from synthetic_images import CatalogGenerator, parse_size, parse_mix, parse_count
+
+    parser = argparse.ArgumentParser(description="Сквозная пропускная способность пакетных точек входа",
+                                     epilog="аргументы после -- передаются точке входа: "
+                                            "throughput_benchmark.py --entry smart -- --pipeline")
+    parser.add_argument('--entry', choices=list(ENTRY_POINTS), nargs='+', default=['smart'],
+                        help="точки входа для прогона")
+    parser.add_argument('--skus', default='10,100', help="размеры каталога через запятую: 10,100,1000,10000")
+    parser.add_argument('--images', default='8', help="фото на товар: 8 или диапазон 4-12")
+    parser.add_argument('--sizes', default='800', help="размеры через запятую: 800,2000x1500")
+    parser.add_argument('--formats', default='jpeg', help="доли форматов: jpeg:0.8,png:0.2")
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help="доля битых файлов")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', default='fake',
+                        help="бэкенд модели (PHOTO_SELECTOR_BACKEND), по умолчанию fake - без модели")
+    parser.add_argument('--model-path', default=None, help="путь к модели (PHOTO_SELECTOR_MODEL_PATH)")
+    parser.add_argument('--workdir', default=None, help="рабочая папка (по умолчанию временная, удаляется)")
+    parser.add_argument('--report', default="throughput_report.json", help="файл отчета")
+    args, extra_args = parser.parse_known_args()
+    if extra_args[:1] == ['--']:
+        extra_args = extra_args[1:]
+
+    scales = sorted(int(value) for value in args.skus.split(','))
+    env = dict(os.environ, PHOTO_SELECTOR_BACKEND=args.backend, PYTHONUNBUFFERED="1")
+    if args.model_path:
+        env['PHOTO_SELECTOR_MODEL_PATH'] = os.path.abspath(args.model_path)
+    elif os.path.isdir(os.path.join(REPO_DIR, "models")):
+        # Точки входа ищут ./models относительно рабочей папки
+        env.setdefault('PHOTO_SELECTOR_MODEL_PATH', os.path.join(REPO_DIR, "models", "convnext-large-224"))
+
+    print("🏁 СКВОЗНОЙ БЕНЧМАРК ПРОПУСКНОЙ СПОСОБНОСТИ")
+    print("="*50)
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="throughput_")
+    try:
+        # Каталог генерируется один раз под наибольший размер, прогоны ссылаются на его префикс
+        generator = CatalogGenerator([parse_size(size) for size in args.sizes.split(',')], parse_mix(args.formats),
+                                     parse_count(args.images), args.corrupt_rate, seed=args.seed)
+        start = time.perf_counter()
+        catalog_fotos = generator.generate(os.path.join(workdir, "catalog"), scales[-1])
+        stats = generator.stats
+        print(f"📸 Каталог: {stats['skus']} товаров, {stats['images']} фото (битых {stats['corrupt']}), "
+              f"{stats['bytes'] / 1e6:.1f} МБ за {time.perf_counter() - start:.1f} с")
+
+        rows = []
+        for skus in scales:
+            run_dir = os.path.join(workdir, f"run_{skus}")
+            link_catalog(catalog_fotos, run_dir, skus)
+            for entry in args.entry:
+                print(f"⏱️ {entry}: {skus} товаров...")
+                row = run_entry_point(entry, run_dir, extra_args, env)
+                rows.append(row)
+                print(f"   {row['wall_time_sec']:.2f} с, {row['images_per_sec']:.1f} фото/с, "
+                      f"RSS {row['peak_rss_mb']:.0f} МБ, загрузок моделей {row['model_loads']}")
+
+        print_table(rows)
+        report = {
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'catalog': {'images_per_sku': args.images, 'sizes': args.sizes, 'formats': args.formats,
+                        'corrupt_rate': args.corrupt_rate, 'seed': args.seed, **stats},
+            'backend': args.backend,
+            'entry_args': extra_args,
+            'runs': rows,
+        }
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 Отчет сохранен: {args.report}")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
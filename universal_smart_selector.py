@@ -9,13 +9,16 @@ import os
 import json
 import shutil
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import Iterator, List, Dict, Tuple, Optional, Sequence
 from PIL import Image
 import numpy as np
 
+# ML-стек (transformers/torch) импортируется лениво - при первой загрузке модели
 try:
-    from transformers import pipeline
-    from smart_photo_selector import SmartPhotoSelector
+    from smart_photo_selector import SmartPhotoSelector, DEFAULT_SINKS, COPY_SINK, REPORT_SINK
+    from model_registry import DEFAULT_MODEL_PATH, DEFAULT_BACKEND
+    from inference import InferenceRecord
+    from streaming_selection import SELECTION_EVENT, selection_event, final_event, final_selection
 except ImportError:
     print("❌ Ошибка: Не удалось импортировать необходимые модули")
     print("Установите зависимости: pip install -r requirements.txt")
@@ -25,12 +28,13 @@ except ImportError:
 class UniversalSmartSelector:
     """Универсальный умный селектор для любых категорий товаров"""
     
-    def __init__(self):
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, backend: str = DEFAULT_BACKEND,
+                 model_server: Optional[str] = None):
         """Инициализация с AI моделью и категориями товаров"""
         print("🧠 Инициализация универсального селектора...")
         
-        # Загружаем базовый селектор
-        self.base_selector = SmartPhotoSelector()
+        # Загружаем базовый селектор (модель берется из общего реестра процесса)
+        self.base_selector = SmartPhotoSelector(model_path, backend, model_server=model_server)
         
         # Определяем категории товаров и их ключевые слова
         self.product_categories = {
@@ -114,12 +118,12 @@ class UniversalSmartSelector:
         """
         print("🔍 Определение категории товара...")
         
-        # Собираем все AI метки
+        # Собираем все AI метки из записей инференса (синонимы ImageNet разделены)
         all_labels = []
         for photo in photo_scores:
-            if 'ai_analysis' in photo:
-                for label, confidence in photo['ai_analysis']:
-                    all_labels.append((label.lower(), confidence))
+            if photo.get('ai_analysis'):
+                record = InferenceRecord.from_pairs(photo['ai_analysis'])
+                all_labels.extend(record.label_terms())
         
         if not all_labels:
             print("⚠️ Не удалось получить AI анализ, используем универсальную категорию")
@@ -131,11 +135,11 @@ class UniversalSmartSelector:
             score = 0
             total_matches = 0
             
-            for label, confidence in all_labels:
-                if label in config['keywords']:
+            for terms, confidence in all_labels:
+                if any(term in config['keywords'] for term in terms):
                     score += confidence * 2.0  # Основные товары имеют больший вес
                     total_matches += 1
-                elif label in config['details']:
+                elif any(term in config['details'] for term in terms):
                     score += confidence * 0.5  # Детали имеют меньший вес
             
             if total_matches > 0:
@@ -144,7 +148,7 @@ class UniversalSmartSelector:
                 category_scores[category] = 0
         
         # Выбираем категорию с наивысшим баллом
-        if category_scores:
+        if category_scores and max(category_scores.values()) > 0:
             best_category = max(category_scores, key=category_scores.get)
             confidence = category_scores[best_category]
             
@@ -305,25 +309,74 @@ class UniversalSmartSelector:
         sorted_photos = sorted(photo_scores, key=lambda x: x.get('final_score', 0), reverse=True)
         return sorted_photos[:2]
     
-    def select_best_photos(self, input_folder: str, num_best: int = 2) -> List[Dict]:
+    def select_best_photos(self, input_folder: str, num_best: int = 2,
+                           records: Optional[Dict] = None,
+                           sinks: Sequence[str] = DEFAULT_SINKS) -> List[Dict]:
         """
         Основной метод выбора лучших фотографий с автоматическим определением категории
         
         Args:
             input_folder: Папка с фотографиями
             num_best: Количество лучших фотографий
+            records: Заранее полученные записи инференса {путь: InferenceRecord}
+            sinks: Выходы в universal_results_<категория>: 'copy' - копии, 'report' - JSON-отчет
             
         Returns:
             List[Dict]: Лучшие фотографии с метаданными
         """
+        return final_selection(self.iter_best_photos(input_folder, num_best, records, sinks))
+    
+    def iter_best_photos(self, input_folder: str, num_best: int = 2,
+                         records: Optional[Dict] = None,
+                         sinks: Sequence[str] = DEFAULT_SINKS) -> Iterator[Dict]:
+        """
+        Потоковый вариант select_best_photos
+        
+        Yields:
+            Dict: {'event': 'assessment', ...} для каждого оцененного фото, затем
+            {'event': 'selection', 'best_photos', 'category', 'confidence'}
+        """
         print(f"🚀 Универсальный анализ папки: {input_folder}")
         
-        # Используем базовый селектор для анализа
-        photo_scores = self.base_selector.select_best_photos(input_folder, 2)
+        # Базовый селектор ничего не пишет: результаты сохраняются один раз, в папку категории
+        events = self.base_selector.iter_best_photos(input_folder, 2, records, sinks=())
+        yield from self._iter_categorized(events, input_folder, sinks)
+    
+    def analyze(self, images: Sequence, num_best: int = 2, names: Optional[Sequence[str]] = None) -> Dict:
+        """
+        Чистый анализ без записи на диск (веб-запросы, задачи Celery)
+        
+        Args:
+            images: Пути, байты или PIL-изображения
+            num_best: Количество лучших фотографий
+            names: Имена фото для результатов (по умолчанию - имена файлов)
+            
+        Returns:
+            Dict: {'best_photos', 'total', 'category', 'confidence'}
+        """
+        return final_event(self.iter_analyze(images, num_best, names))
+    
+    def iter_analyze(self, images: Sequence, num_best: int = 2,
+                     names: Optional[Sequence[str]] = None) -> Iterator[Dict]:
+        """Потоковый вариант analyze (события как у iter_best_photos)"""
+        yield from self._iter_categorized(self.base_selector.iter_analyze(images, 2, names), "", ())
+    
+    def _iter_categorized(self, events: Iterator[Dict], input_folder: str,
+                          sinks: Sequence[str]) -> Iterator[Dict]:
+        """Передает оценки базового селектора дальше, затем применяет правила категории"""
+        photo_scores = []
+        total = 0
+        for event in events:
+            if event['event'] == SELECTION_EVENT:
+                photo_scores = event['best_photos']
+                total = event['total']
+            else:
+                yield event
         
         if not photo_scores:
             print("❌ Не удалось проанализировать фотографии")
-            return []
+            yield selection_event([], total)
+            return
         
         print(f"📊 Проанализировано фотографий: {len(photo_scores)}")
         
@@ -340,13 +393,14 @@ class UniversalSmartSelector:
             # Показываем результаты
             self._display_results(best_photos, category)
             
-            # Сохраняем результаты
-            self._save_results(best_photos, input_folder, category)
+            # Сохраняем результаты (только запрошенные выходы)
+            if sinks:
+                self._save_results(best_photos, input_folder, category, sinks)
             
-            return best_photos
+            yield selection_event(best_photos, total, category=category, confidence=confidence)
         else:
             print("❌ Не удалось выбрать лучшие фотографии")
-            return []
+            yield selection_event([], total, category=category, confidence=confidence)
     
     def _display_results(self, best_photos: List[Dict], category: str):
         """Отображает результаты выбора"""
@@ -365,14 +419,15 @@ class UniversalSmartSelector:
                 for label, confidence in photo['ai_analysis'][:3]:  # Показываем топ-3 метки
                     print(f"      • {label}: {confidence:.3f}")
     
-    def _save_results(self, best_photos: List[Dict], input_folder: str, category: str):
+    def _save_results(self, best_photos: List[Dict], input_folder: str, category: str,
+                      sinks: Sequence[str] = DEFAULT_SINKS):
         """Сохраняет результаты в папку"""
         output_dir = f"universal_results_{category}"
         os.makedirs(output_dir, exist_ok=True)
         
         print(f"\n💾 Сохранение результатов в: {output_dir}")
         
-        for i, photo in enumerate(best_photos, 1):
+        for i, photo in enumerate(best_photos if COPY_SINK in sinks else [], 1):
             src_path = photo['path']
             filename = photo['filename']
             new_filename = f"{i:02d}_{category}_{filename}"
@@ -384,6 +439,9 @@ class UniversalSmartSelector:
             except Exception as e:
                 print(f"   ❌ Ошибка копирования {filename}: {e}")
         
+        if REPORT_SINK not in sinks:
+            return
+        
         # Сохраняем отчет
         report = {
             'category': category,
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ПРЕДЗАГРУЗКА И ПРОГРЕВ МОДЕЛИ В ВОРКЕРАХ CELERY
+worker_init (главный процесс): ConvNeXt Large загружается в реестр моделей
+один раз до fork, затем gc.freeze() - сборщик мусора больше не трогает
+объекты модели, и страницы весов остаются общими (copy-on-write) для всех
+дочерних процессов prefork. Инференс в главном процессе не выполняется:
+потоки OpenMP, запущенные до fork, не переживают его. Если на хосте запущен
+сервер модели (model_server.py), воркер весов не грузит и подключается к нему.
+
+worker_process_init (каждый дочерний процесс): пробный анализ синтетического
+фото - первый вызов модели, векторы правил, категории. Пул не отдает задачи
+процессу, пока тот не закончил прогрев (worker_proc_alive_timeout увеличен).
+
+worker_ready: фоновый поток главного процесса ждет, пока прогреются все живые
+дочерние процессы пула (отметки warm-<pid> сверяются с PID пула), и только
+тогда пишет файл готовности (healthcheck docker-compose) и метрику.
+"""
+
+import contextlib
+import gc
+import io
+import os
+import tempfile
+import threading
+import time
+from typing import Optional, Set
+
+from PIL import Image
+
+from metrics import metrics
+from model_server import ModelServerClient
+
+READY_FILE_ENV = "PHOTO_SELECTOR_READY_FILE"
+DEFAULT_READY_FILE = os.path.join(tempfile.gettempdir(), "photo_selector_worker_ready")
+WARMUP_TIMEOUT = 300.0  # секунды на загрузку и прогрев одного процесса
+WARMUP_IMAGE_SIZE = 224
+
+_selector = None
+_state = {'prefork': True, 'concurrency': 1}
+
+
+def ready_file() -> str:
+    return os.environ.get(READY_FILE_ENV, DEFAULT_READY_FILE)
+
+
+def _marker_dir() -> str:
+    """Папка отметок о прогреве дочерних процессов (рядом с файлом готовности)"""
+    return f"{ready_file()}.d"
+
+
+def get_selector():
+    """Универсальный селектор процесса: создается при прогреве и переиспользуется задачами"""
+    global _selector
+    if _selector is None:
+        from universal_smart_selector import UniversalSmartSelector
+        _selector = UniversalSmartSelector()
+    return _selector
+
+
+def warm_up(selector=None) -> Optional[float]:
+    """Пробный анализ синтетического фото; время прогрева в секундах или None при ошибке"""
+    selector = selector or get_selector()
+    image = Image.linear_gradient('L').resize((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE)).convert('RGB')
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            selector.analyze([image], 1, ['warmup.png'])
+    except Exception as e:
+        print(f"⚠️ Прогрев модели не удался (pid {os.getpid()}): {e}")
+        return None
+    elapsed = time.perf_counter() - start
+    metrics.observe('photo_selector_worker_warmup_seconds', elapsed)
+    return elapsed
+
+
+def _remove_ready_markers():
+    directory = _marker_dir()
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+    if os.path.exists(ready_file()):
+        os.remove(ready_file())
+
+
+def _mark_process_warm():
+    os.makedirs(_marker_dir(), exist_ok=True)
+    with open(os.path.join(_marker_dir(), f"warm-{os.getpid()}"), 'w') as f:
+        f.write(str(time.time()))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _pool_pids(consumer) -> Optional[Set[int]]:
+    """PID текущих дочерних процессов пула prefork (None, если пул их не сообщает)"""
+    try:
+        processes = consumer.pool.info.get('processes')
+    except Exception:
+        return None
+    return set(processes) if processes else None
+
+
+def _warm_pids(pool_pids: Optional[Set[int]]) -> Set[int]:
+    """Прогретые живые процессы пула; отметки умерших и замененных процессов удаляются"""
+    directory = _marker_dir()
+    if not os.path.isdir(directory):
+        return set()
+    warm = set()
+    for filename in os.listdir(directory):
+        try:
+            pid = int(filename.rsplit('-', 1)[-1])
+        except ValueError:
+            continue
+        live = pid in pool_pids if pool_pids is not None else _pid_alive(pid)
+        if live:
+            warm.add(pid)
+        elif not _pid_alive(pid):
+            # Процесс завершился (сбой, max_tasks_per_child): его прогрев больше не в счет
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(directory, filename))
+    return warm
+
+
+def _wait_for_children(expected: int, consumer=None, timeout: float = WARMUP_TIMEOUT) -> int:
+    """Ждет прогрева expected живых дочерних процессов пула; возвращает число прогретых"""
+    deadline = time.monotonic() + timeout
+    warm = 0
+    while time.monotonic() < deadline:
+        warm = len(_warm_pids(_pool_pids(consumer)))
+        if warm >= expected:
+            break
+        time.sleep(0.2)
+    return warm
+
+
+def _write_ready():
+    with open(ready_file(), 'w') as f:
+        f.write(str(os.getpid()))
+    metrics.set('photo_selector_worker_ready', 1)
+    print("✅ Воркер прогрет и принимает задачи")
+
+
+def _report_ready_when_warm(consumer):
+    warm = _wait_for_children(_state['concurrency'], consumer)
+    if warm < _state['concurrency']:
+        print(f"⚠️ Прогреты {warm} из {_state['concurrency']} процессов за {WARMUP_TIMEOUT:.0f} с")
+    _write_ready()
+
+
+def install_worker_preload(celery_app):
+    """Сигналы Celery: модель до fork, прогрев каждого процесса, готовность после прогрева"""
+    from celery import signals
+
+    # Процесс пула считается поднятым только после worker_process_init, то есть после прогрева
+    celery_app.conf.worker_proc_alive_timeout = max(
+        float(celery_app.conf.worker_proc_alive_timeout or 0), WARMUP_TIMEOUT)
+
+    @signals.worker_init.connect(weak=False)
+    def preload_model(sender=None, **kwargs):
+        _remove_ready_markers()
+        pool = str(getattr(sender, 'pool_cls', 'prefork')).lower()
+        _state['prefork'] = 'prefork' in pool or 'processes' in pool
+        _state['concurrency'] = int(getattr(sender, 'concurrency', None) or 1)
+
+        start = time.perf_counter()
+        base_selector = get_selector().base_selector
+        with contextlib.redirect_stdout(io.StringIO()):
+            loaded = base_selector.load_model()  # векторы меток тоже до fork
+        if not loaded:
+            print("⚠️ Модель не предзагружена: задачи загрузят ее сами")
+            return
+        if isinstance(base_selector.classifier, ModelServerClient):
+            # Веса держит сервер модели хоста: в воркере только клиент и векторы меток
+            print(f"🔌 Воркер использует сервер модели {base_selector.classifier.socket_path}")
+        else:
+            print(f"🔥 Модель загружена в главном процессе воркера за {time.perf_counter() - start:.2f} с")
+
+        if _state['prefork']:
+            # Все, что создано до fork, - в постоянное поколение: общие страницы не копируются
+            gc.collect()
+            gc.freeze()
+        else:
+            # solo/threads: задачи выполняет этот же процесс, прогреваем сразу
+            elapsed = warm_up()
+            if elapsed is not None:
+                print(f"🔥 Модель прогрета за {elapsed:.2f} с")
+
+    @signals.worker_process_init.connect(weak=False)
+    def warm_up_child(**kwargs):
+        elapsed = warm_up()
+        if elapsed is not None:
+            print(f"🔥 Процесс {os.getpid()}: модель прогрета за {elapsed:.2f} с")
+        _mark_process_warm()
+
+    @signals.worker_ready.connect(weak=False)
+    def report_ready(sender=None, **kwargs):
+        if _state['prefork']:
+            # Ожидание - в фоне: обработчик сигнала не задерживает запуск потребителя
+            threading.Thread(target=_report_ready_when_warm, args=(sender,),
+                             name="warmup-ready", daemon=True).start()
+        else:
+            _write_ready()
+
+    @signals.worker_shutdown.connect(weak=False)
+    def report_shutdown(**kwargs):
+        metrics.set('photo_selector_worker_ready', 0)
+        _remove_ready_markers()
+
+    return celery_app